@@ -0,0 +1,60 @@
+"""
+Мікробенчмарк клавіатур: побудова на кожен виклик проти кешу KeyboardRegistry
+
+    python benchmarks/bench_keyboards.py --repeat 20000
+
+Друга таблиця - серіалізація запиту editMessageText з клавіатурою:
+звичайна AiohttpSession проти KeyboardCachingSession з готовим JSON.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.methods import EditMessageText  # noqa: E402
+
+import escobar_jobs_bot as app  # noqa: E402
+
+KEYBOARDS = (
+    app.get_main_keyboard,
+    app.get_vacancies_keyboard,
+    app.get_back_keyboard,
+    app.get_telegram_keyboard,
+    app.get_skip_phone_keyboard,
+    app.get_admin_keyboard,
+)
+
+
+def per_call_us(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'клавіатура':<26} {'побудова':>10} {'кеш':>10}")
+    for getter in KEYBOARDS:
+        build = per_call_us(getter.build, args.repeat)
+        cached = per_call_us(getter, args.repeat)
+        print(f"{getter.__name__:<26} {build:8.2f}µs {cached:8.3f}µs")
+
+    plain = AiohttpSession()
+    caching = app.KeyboardCachingSession()
+    markup = app.get_vacancies_keyboard()
+    method = EditMessageText(text="x" * 200, chat_id=1, message_id=1, reply_markup=markup, parse_mode="HTML")
+
+    print()
+    print(f"{'editMessageText':<26} {'серіалізація':>10}")
+    for name, session in (("AiohttpSession", plain), ("KeyboardCachingSession", caching)):
+        cost = per_call_us(lambda: session.build_form_data(app.bot, method), args.repeat // 10)
+        print(f"{name:<26} {cost:8.2f}µs")
+
+
+if __name__ == "__main__":
+    main()
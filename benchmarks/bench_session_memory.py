@@ -0,0 +1,74 @@
+"""
+Бенчмарк пам'яті на активну сесію форми заявки
+
+    python benchmarks/bench_session_memory.py --sessions 100000
+
+Порівнює старий формат FSM даних (копія словника вакансії + окремі поля)
+з компактним ApplicationSession: байти в MemoryStorage (tracemalloc)
+та розмір JSON, який пишуть SQLite / Redis сховища на кожному кроці.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+import escobar_jobs_bot as app  # noqa: E402
+
+
+def legacy_data(i: int) -> dict:
+    vacancy = app.get_vacancy_by_id(i % 9 + 1)
+    return {
+        # Серіалізуюче сховище зберігає повну копію вакансії
+        "vacancy": dict(vacancy),
+        "message_id": 100000 + i,
+        "name": f"Користувач {i}",
+        "age": 25,
+        "city": "Київ",
+        "telegram": f"@user{i}",
+    }
+
+
+def compact_data(i: int) -> dict:
+    session = app.ApplicationSession(i % 9 + 1, 100000 + i, f"Користувач {i}", 25, "Київ", f"@user{i}")
+    return session.to_data()
+
+
+async def measure(build, sessions: int):
+    storage = MemoryStorage()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(sessions):
+        await storage.set_data(StorageKey(bot_id=1, chat_id=i, user_id=i), build(i))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    encoded = sum(len(json.dumps(build(i), ensure_ascii=False).encode()) for i in range(min(sessions, 1000)))
+    return allocated / sessions, encoded / min(sessions, 1000)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{args.sessions} активних сесій")
+    for name, build in (("legacy", legacy_data), ("compact", compact_data)):
+        per_session, encoded = await measure(build, args.sessions)
+        print(
+            f"{name:<8} {per_session:8.0f} B/сесію в пам'яті   "
+            f"{per_session * args.sessions / 2 ** 20:7.1f} MiB всього   "
+            f"{encoded:6.0f} B JSON на запис"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""
+Бенчмарк статистики заявок: запис однієї заявки та рендер для адмінки
+
+    python benchmarks/bench_stats.py --applications 1000000
+
+Рендер має лишатися в межах кількох мілісекунд незалежно від кількості заявок:
+всі агрегати фіксованого розміру (top-N, кільце годин, гістограма віку).
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import escobar_jobs_bot as app  # noqa: E402
+
+CITIES = ["Київ", "Львів", "Одеса", "Харків", "Дніпро", "Вінниця", "Полтава", "Черкаси"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--applications", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    stats = app.ApplicationStats(path="")
+    names = [v["name"] for v in app.catalog.vacancies]
+    rnd = random.Random(1)
+    now = time.time()
+    # Довгий хвіст рідкісних міст, щоб top-N справді витісняв ключі
+    rows = [
+        {
+            "vacancy": rnd.choice(names),
+            "city": rnd.choice(CITIES) if rnd.random() < 0.9 else f"Місто {rnd.randint(1, 5000)}",
+            "age": rnd.randint(17, 50),
+        }
+        for _ in range(10_000)
+    ]
+
+    print(f"{'заявок':>10} {'record':>10} {'render':>10} {'json':>8}")
+    checkpoints = {10_000, 100_000, args.applications}
+    started = time.perf_counter()
+    for i in range(1, args.applications + 1):
+        # Розтягуємо заявки на тиждень
+        stats.record(rows[i % len(rows)], now - (args.applications - i) * 7 * 24 * 3600 / args.applications)
+        if i in checkpoints:
+            record_us = (time.perf_counter() - started) / i * 1e6
+            render_ms = min(timeit.repeat(stats.render, number=100, repeat=3)) / 100 * 1000
+            size = len(json.dumps(stats.to_dict(), ensure_ascii=False))
+            print(f"{i:>10} {record_us:8.2f}µs {render_ms:8.3f}ms {size / 1024:6.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
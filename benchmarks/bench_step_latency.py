@@ -0,0 +1,117 @@
+"""
+Наскрізна затримка кроку форми проти фейкового Bot API з мережевою затримкою
+
+    python benchmarks/bench_step_latency.py --latency 0.08 --rounds 20
+
+Кожен раунд - повна форма (вибір вакансії, 5 кроків, фінал). Міряється час
+від отримання апдейту до повернення з хендлера: "послідовно" - усі виклики
+по черзі (як раніше), "pipeline" - OutboundPipeline з паралельними викликами.
+Ліміти Telegram вимкнені - інакше після burst кожен крок міряв би token-бакет чату.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update({"FLOOD_GLOBAL_RATE": "0", "FLOOD_CHAT_RATE": "0"})
+
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import escobar_jobs_bot as app  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+_ids = itertools.count(1)
+FORM_MESSAGE_ID = 500
+
+
+def user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"bench{chat_id}"}
+
+
+def text_update(chat_id: int, text: str) -> Update:
+    return Update(update_id=next(_ids), message={
+        "message_id": next(_ids), "date": 0, "chat": {"id": chat_id, "type": "private"},
+        "from": user(chat_id), "text": text,
+    })
+
+
+def callback_update(chat_id: int, data: str) -> Update:
+    return Update(update_id=next(_ids), callback_query={
+        "id": str(next(_ids)), "chat_instance": "bench", "from": user(chat_id), "data": data,
+        "message": {"message_id": FORM_MESSAGE_ID, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "x"},
+    })
+
+
+def form_round(chat_id: int, vacancy_id: int):
+    return (
+        ("вакансія", callback_update(chat_id, f"vacancy_{vacancy_id}")),
+        ("ім'я", text_update(chat_id, "Іван Петренко")),
+        ("вік (помилка)", text_update(chat_id, "abc")),
+        ("вік", text_update(chat_id, "25")),
+        ("місто", text_update(chat_id, "Київ")),
+        ("telegram", text_update(chat_id, "ivan_p")),
+        ("телефон", text_update(chat_id, "+380501234567")),
+    )
+
+
+async def run(mode: str, rounds: int) -> dict:
+    app.outbound.concurrent = mode == "pipeline"
+    timings = defaultdict(list)
+    vacancy_id = app.catalog.vacancies[0]["id"]
+    for i in range(rounds):
+        for name, update in form_round(10_000 + i, vacancy_id):
+            started = time.perf_counter()
+            await app.dp.feed_update(app.bot, update)
+            timings[name].append((time.perf_counter() - started) * 1000)
+        # Фонові видалення не входять у наступний замір
+        await app.outbound.close()
+        app.deferred.cancel(("apply_again", 10_000 + i))
+    return timings
+
+
+async def main_async(args):
+    server = FakeTelegram(args.latency, port=args.port)
+    await server.start()
+
+    workdir = tempfile.mkdtemp()
+    app.application_outbox.path = os.path.join(workdir, "bench.db")
+    app.bot.session.api = TelegramAPIServer.from_base(server.base_url)
+    app.sheets_sink.url = f"{server.base_url}/sheets"
+    app.setup_dispatcher()
+    await app.dp.emit_startup(bot=app.bot, dispatcher=app.dp)
+
+    try:
+        results = {mode: await run(mode, args.rounds) for mode in ("послідовно", "pipeline")}
+    finally:
+        await app.dp.emit_shutdown(bot=app.bot, dispatcher=app.dp)
+        await app.bot.session.close()
+        await server.close()
+
+    print(f"Затримка Bot API: {args.latency * 1000:.0f}ms, раундів: {args.rounds}")
+    print(f"{'крок':<16} {'послідовно':>12} {'pipeline':>12}")
+    for name in results["pipeline"]:
+        serial = statistics.median(results["послідовно"][name])
+        pipeline = statistics.median(results["pipeline"][name])
+        print(f"{name:<16} {serial:10.1f}ms {pipeline:10.1f}ms")
+    print(f"\nвиклики Bot API: {dict(server.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
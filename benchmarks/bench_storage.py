@@ -0,0 +1,75 @@
+"""
+Бенчмарк FSM сховищ: затримка на один апдейт форми (memory / sqlite / redis)
+
+    python benchmarks/bench_storage.py --updates 5000 --sessions 500
+
+Redis міряється, якщо встановлено пакет redis і сервер доступний за REDIS_URL.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+import escobar_jobs_bot as app  # noqa: E402
+
+
+async def one_update(storage, key: StorageKey, step: int):
+    """Типовий крок форми: прочитати дані, дописати поле, змінити стан"""
+    await storage.get_data(key)
+    await storage.update_data(key, {f"field_{step % 5}": "x" * 16})
+    await storage.set_state(key, f"ApplicationForm:step_{step % 5}")
+
+
+async def bench(name: str, storage, updates: int, sessions: int):
+    keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(sessions)]
+    # Прогрів: кожна сесія вже має дані
+    for key in keys:
+        await storage.set_data(key, {"vacancy_id": 1, "message_id": 100})
+
+    timings = []
+    for i in range(updates):
+        started = time.perf_counter()
+        await one_update(storage, keys[i % sessions], i)
+        timings.append((time.perf_counter() - started) * 1e6)
+
+    timings.sort()
+    print(
+        f"{name:<8} mean {statistics.mean(timings):9.1f} µs   "
+        f"p50 {timings[len(timings) // 2]:9.1f} µs   "
+        f"p99 {timings[int(len(timings) * 0.99)]:9.1f} µs"
+    )
+    await storage.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--sessions", type=int, default=500)
+    args = parser.parse_args()
+
+    await bench("memory", MemoryStorage(), args.updates, args.sessions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = app.SQLiteStorage(os.path.join(tmp, "fsm.db"), pool_size=app.FSM_DB_POOL_SIZE)
+        await bench("sqlite", storage, args.updates, args.sessions)
+
+    try:
+        storage = app.create_storage("redis")
+        await storage.redis.ping()
+    except Exception as e:
+        print(f"redis    пропущено: {e!r}")
+    else:
+        await bench("redis", storage, args.updates, args.sessions)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
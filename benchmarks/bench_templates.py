@@ -0,0 +1,90 @@
+"""
+Мікробенчмарк текстів форми: f-string на кожен апдейт проти готового FormTemplates
+
+    python benchmarks/bench_templates.py --repeat 100000
+
+"Старий" рендер повторює інлайнові f-string з хендлерів до каталогу текстів
+(кроки формуються з вакансії при кожному повідомленні користувача).
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import escobar_jobs_bot as app  # noqa: E402
+
+
+def legacy_age(vacancy):
+    return f"""
+<b>{vacancy['emoji']} {vacancy['name']}</b>
+
+━━━━━━━━━━━━━━━━
+
+<b>Крок 2 з 5</b>
+
+🎂 Скільки вам років?
+
+<i>Введіть ваш вік (від 17 до {vacancy['max_age']} років)</i>
+"""
+
+
+def legacy_too_old(vacancy, age):
+    suitable = app.catalog.suitable_for_age(age)
+    alt_text = "\n".join([f"• {v['emoji']} {v['name']} (до {v['max_age']} років)" for v in suitable])
+    return f"""
+<b>{vacancy['emoji']} {vacancy['name']}</b>
+
+━━━━━━━━━━━━━━━━
+
+<b>Крок 2 з 5</b>
+
+⚠️ <b>На вакансію "{vacancy['name']}" максимальний вік - {vacancy['max_age']} років</b>
+
+<b>Вакансії, які вам підходять:</b>
+{alt_text}
+
+<i>Поверніться назад та оберіть іншу вакансію</i>
+"""
+
+
+def legacy_start():
+    vacancy_list = "\n".join(f"• {v['name']}" for v in app.catalog.vacancies)
+    return app.FORM_STRINGS["uk"]["start"].format(min_salary=app.min_salary_text(), vacancy_list=vacancy_list)
+
+
+def per_call_us(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=100000)
+    args = parser.parse_args()
+
+    vacancy = app.catalog.vacancies[0]
+    vid = vacancy["id"]
+    texts = app.form_texts
+    # Вік, більший за max_age вакансії, але з альтернативами (якщо вони є)
+    too_old_age = vacancy["max_age"] + 1
+
+    cases = (
+        ("крок 'вік'", lambda: legacy_age(app.catalog.get(vid)),
+         lambda: texts.form(vid, "age")),
+        ("вік > max_age", lambda: legacy_too_old(app.catalog.get(vid), too_old_age),
+         lambda: texts.too_old(vid, too_old_age)),
+        ("/start", legacy_start, lambda: texts.screen("start")),
+    )
+
+    print(f"{'екран':<16} {'f-string':>10} {'каталог':>10}")
+    for name, legacy, cached in cases:
+        print(f"{name:<16} {per_call_us(legacy, args.repeat):8.2f}µs {per_call_us(cached, args.repeat):8.3f}µs")
+
+    rebuild = min(timeit.repeat(texts.rebuild, number=10, repeat=3)) / 10 * 1e3
+    print(f"\nrebuild() (усі мови x вакансії x кроки): {rebuild:.2f}ms, екранів: {len(texts._forms)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Локальний фейковий Bot API сервер із заданою затримкою відповіді
+
+    python benchmarks/fake_telegram.py --port 8081 --latency 0.08
+
+Бот підключається через TelegramAPIServer.from_base("http://127.0.0.1:8081").
+Відповідає правдоподібними об'єктами на методи, які використовує бот,
+і рахує виклики по методах (FakeTelegram.calls). Віддає getUpdates з черги,
+яку наповнює драйвер (push), і будить тих, хто чекає відповіді бота в чат
+(expect_reply). На /sheets приймає пакети заявок як Apps Script - із власною
+затримкою та часткою відповідей 500, щоб outbox бота теж мав куди доставляти.
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    """Фейковий api.telegram.org: кожен запит відповідає через latency секунд"""
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 8081,
+                 sheets_latency: float = 0.0, sheets_error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.sheets_latency = sheets_latency
+        self.sheets_error_rate = sheets_error_rate
+        self.calls = Counter()
+        self.sheets_rows = Counter()
+        self.last_message = {}
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._updates = []
+        self._has_updates = asyncio.Event()
+        self._waiters = defaultdict(list)
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _message(self, chat_id, text: str = "") -> dict:
+        return {
+            "message_id": next(self._ids), "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"}, "text": text,
+        }
+
+    def push(self, update: dict) -> int:
+        """Поставити апдейт у чергу getUpdates (update_id призначається тут)"""
+        update = {**update, "update_id": next(self._update_ids)}
+        self._updates.append(update)
+        self._has_updates.set()
+        return update["update_id"]
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        """Future, що завершиться на наступному sendMessage/editMessageText у чат (викликати до push)"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    def _replied(self, chat_id: int, method: str):
+        for future in self._waiters.pop(chat_id, ()):
+            if not future.done():
+                future.set_result(method)
+
+    async def get_updates(self, data: dict) -> list:
+        offset = int(data.get("offset") or 0)
+        # Підтверджені (update_id < offset) більше не віддаємо
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(data.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(data.get("limit") or 100)]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(data)})
+        await asyncio.sleep(self.latency)
+
+        if method in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(data.get("chat_id", 0))
+            result = self._message(chat_id, data.get("text", ""))
+            if method != "editMessageText":
+                self.last_message[chat_id] = result["message_id"]
+            self._replied(chat_id, method)
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_sheets(self, request: web.Request) -> web.Response:
+        rows = await request.json()
+        count = len(rows) if isinstance(rows, list) else 1
+        self.calls["sheets"] += 1
+        await asyncio.sleep(self.sheets_latency)
+        if self._random.random() < self.sheets_error_rate:
+            self.sheets_rows["failed"] += count
+            return web.Response(status=500, text="Apps Script: Service invoked too many times")
+        self.sheets_rows["ok"] += count
+        return web.json_response([True] * count)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_post("/sheets", self.handle_sheets)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(port: int, latency: float, sheets_latency: float, sheets_error_rate: float):
+    server = FakeTelegram(latency, port=port, sheets_latency=sheets_latency, sheets_error_rate=sheets_error_rate)
+    await server.start()
+    print(f"Fake Bot API: {server.base_url} (затримка {latency * 1000:.0f}ms)")
+    print(f"Fake Apps Script: {server.base_url}/sheets (затримка {sheets_latency * 1000:.0f}ms, "
+          f"помилок {sheets_error_rate:.0%})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--sheets-latency", type=float, default=0.0)
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency, args.sheets_latency, args.sheets_error_rate))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Навантажувальний тест: N віртуальних кандидатів проти фейкового Bot API та Apps Script
+
+    python benchmarks/load_test.py --users 200 --latency 0.05 --sheets-latency 0.3 --sheets-error-rate 0.05
+
+Бот працює як у проді: long polling, усі middleware, outbox, ліміти Telegram
+(--no-flood-limits прибирає їх, щоб побачити межу самого воркера). api.telegram.org
+і APPS_SCRIPT_URL підмінені локальним FakeTelegram. Кожен користувач проходить
+/start → select_vacancy → vacancy_N → ім'я/вік/місто/telegram/телефон і на кожному
+кроці чекає відповіді бота (sendMessage/editMessageText у свій чат).
+
+Звіт: пропускна здатність, p50/p99 кожного кроку, доставка в Sheets і пам'ять на
+активну сесію - окремим проходом під tracemalloc, щоб не гальмувати основний.
+Результат відтворюваний при тому самому --seed. Кроки, що лишились без
+відповіді довше --timeout, рахуються як таймаути.
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+# Бот імпортується в main() - налаштування читаються з оточення при імпорті
+app = None
+
+STEPS = ("/start", "select_vacancy", "vacancy_N", "ім'я", "вік", "місто", "telegram", "телефон")
+
+
+def user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"load{chat_id}"}
+
+
+def text_update(chat_id: int, text: str, message_id: int) -> dict:
+    return {"message": {
+        "message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+        "from": user(chat_id), "text": text,
+    }}
+
+
+def callback_update(chat_id: int, data: str, message_id: int) -> dict:
+    return {"callback_query": {
+        "id": f"{chat_id}:{data}", "chat_instance": "load", "from": user(chat_id), "data": data,
+        "message": {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": "x",
+        },
+    }}
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Applicant:
+    """Віртуальний кандидат: один чат, кроки по черзі, час від апдейту до відповіді бота"""
+
+    def __init__(self, server: FakeTelegram, chat_id: int, vacancy_id: int, rng: random.Random,
+                 think: float, timeout: float):
+        self.server = server
+        self.chat_id = chat_id
+        self.vacancy_id = vacancy_id
+        self.rng = rng
+        self.think = think
+        self.timeout = timeout
+        self._message_ids = iter(range(1, 1000))
+
+    def update(self, step: str) -> dict:
+        chat_id = self.chat_id
+        message_id = next(self._message_ids)
+        # Кнопки натискаються на повідомленні, яке бот надіслав на /start
+        form_message = self.server.last_message.get(chat_id, 0)
+        return {
+            "/start": lambda: text_update(chat_id, "/start", message_id),
+            "select_vacancy": lambda: callback_update(chat_id, "select_vacancy", form_message),
+            "vacancy_N": lambda: callback_update(chat_id, f"vacancy_{self.vacancy_id}", form_message),
+            "ім'я": lambda: text_update(chat_id, "Іван Петренко", message_id),
+            "вік": lambda: text_update(chat_id, str(self.rng.randint(18, 30)), message_id),
+            "місто": lambda: text_update(chat_id, self.rng.choice(("Київ", "Львів", "Одеса")), message_id),
+            "telegram": lambda: text_update(chat_id, f"load{chat_id}", message_id),
+            "телефон": lambda: text_update(chat_id, f"+38050{chat_id % 10_000_000:07d}", message_id),
+        }[step]()
+
+    async def run(self, steps: tuple, timings: dict) -> bool:
+        for step in steps:
+            if self.think:
+                await asyncio.sleep(self.rng.uniform(0, 2 * self.think))
+            reply = self.server.expect_reply(self.chat_id)
+            started = time.perf_counter()
+            self.server.push(self.update(step))
+            try:
+                await asyncio.wait_for(reply, self.timeout)
+            except asyncio.TimeoutError:
+                timings["timeouts"].append(step)
+                return False
+            timings[step].append(time.perf_counter() - started)
+        return True
+
+
+async def drive(server: FakeTelegram, users: int, first_chat: int, steps: tuple, args, rng: random.Random):
+    """Запуск users кандидатів рівномірно за --ramp секунд; повертає (таймінги, завершених, тривалість)"""
+    timings = defaultdict(list)
+    vacancies = [v["id"] for v in app.catalog.vacancies]
+    applicants = [
+        Applicant(server, first_chat + i, rng.choice(vacancies), random.Random(rng.random()),
+                  args.think, args.timeout)
+        for i in range(users)
+    ]
+
+    async def start(i: int, applicant: Applicant) -> bool:
+        await asyncio.sleep(args.ramp * i / users)
+        return await applicant.run(steps, timings)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(start(i, a) for i, a in enumerate(applicants)))
+    return timings, sum(results), time.perf_counter() - started
+
+
+async def measure_memory(server: FakeTelegram, args, rng: random.Random) -> float:
+    """Байт на сесію: кандидати зупиняються перед телефоном (сесія в FSM ще жива)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await drive(server, args.memory_users, 2_000_000, STEPS[:-1], args, rng)
+    await asyncio.sleep(0.5)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Завершуємо форми, щоб outbox і deferred не лишились напівпорожніми
+    await asyncio.gather(*(
+        Applicant(server, 2_000_000 + i, 0, rng, 0, args.timeout).run(STEPS[-1:], defaultdict(list))
+        for i in range(args.memory_users)
+    ))
+    return (after - before) / args.memory_users
+
+
+async def main_async(args):
+    from aiogram.client.telegram import TelegramAPIServer
+
+    server = FakeTelegram(args.latency, port=args.port, sheets_latency=args.sheets_latency,
+                          sheets_error_rate=args.sheets_error_rate, seed=args.seed)
+    await server.start()
+    app.bot.session.api = TelegramAPIServer.from_base(server.base_url)
+    app.setup_dispatcher()
+    polling = asyncio.create_task(app.dp.start_polling(app.bot, handle_signals=False, close_bot_session=False))
+    rng = random.Random(args.seed)
+
+    try:
+        # Чекаємо, поки on_startup відпрацює і polling почне забирати апдейти
+        while not server.calls["getUpdates"]:
+            await asyncio.sleep(0.05)
+
+        timings, completed, elapsed = await drive(server, args.users, 1_000_000, STEPS, args, rng)
+        memory = await measure_memory(server, args, rng) if args.memory_users else 0.0
+
+        drain_until = time.monotonic() + args.drain
+        while await app.application_outbox.pending() and time.monotonic() < drain_until:
+            await asyncio.sleep(0.2)
+        pending = await app.application_outbox.pending()
+    finally:
+        await app.dp.stop_polling()
+        await polling
+        await app.bot.session.close()
+        await server.close()
+
+    limits = "вимкнено" if args.no_flood_limits else f"{app.FLOOD_GLOBAL_RATE:g}/с, чат {app.FLOOD_CHAT_RATE:g}/с"
+    print(f"Користувачів: {args.users}, Bot API {args.latency * 1000:.0f}ms, "
+          f"Sheets {args.sheets_latency * 1000:.0f}ms / {args.sheets_error_rate:.0%} помилок, "
+          f"ліміти Telegram: {limits}, seed {args.seed}")
+    updates = sum(len(timings[step]) for step in STEPS)
+    print(f"Завершено форм: {completed}/{args.users} за {elapsed:.1f} с -> "
+          f"{completed / elapsed:.2f} форм/с, {updates / elapsed:.1f} апдейтів/с")
+    if timings["timeouts"]:
+        print(f"Таймаути (>{args.timeout:g} с): {len(timings['timeouts'])} на кроках {sorted(set(timings['timeouts']))}")
+
+    print(f"\n{'крок':<16} {'p50':>9} {'p99':>9}")
+    for step in STEPS:
+        if timings[step]:
+            print(f"{step:<16} {percentile(timings[step], 0.5) * 1000:7.0f}ms "
+                  f"{percentile(timings[step], 0.99) * 1000:7.0f}ms")
+
+    print(f"\nВиклики Bot API: {dict(server.calls)}")
+    print(f"Sheets: рядків прийнято {server.sheets_rows['ok']}, відхилено {server.sheets_rows['failed']}, "
+          f"в outbox лишилось {pending}")
+    if args.memory_users:
+        print(f"Пам'ять: {memory / 1024:.1f} KiB на активну сесію ({args.memory_users} сесій)")
+    print(f"Піковий RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+def main():
+    global app
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--ramp", type=float, default=5.0, help="за скільки секунд стартують усі користувачі")
+    parser.add_argument("--think", type=float, default=0.0, help="середня пауза користувача між кроками, с")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--sheets-latency", type=float, default=0.3)
+    parser.add_argument("--sheets-error-rate", type=float, default=0.05)
+    parser.add_argument("--no-flood-limits", action="store_true")
+    parser.add_argument("--memory-users", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--drain", type=float, default=10.0, help="скільки чекати доставки outbox у кінці, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8082)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.update({
+        "BOT_TOKEN": "1:load-test",
+        "APPS_SCRIPT_URL": f"http://127.0.0.1:{args.port}/sheets",
+        "DB_PATH": os.path.join(workdir, "load.db"),
+        "FSM_STORAGE": "memory",
+        "METRICS_PORT": "0",
+        "STATS_FILE": "",
+        "FUNNEL_LOG": "",
+        "OUTBOX_RETRY_BASE": "0.5",
+    })
+    if args.no_flood_limits:
+        os.environ.update({"FLOOD_GLOBAL_RATE": "0", "FLOOD_CHAT_RATE": "0"})
+
+    import escobar_jobs_bot
+    app = escobar_jobs_bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Replay журналу апдейтів (RECORD_UPDATES) у Dispatcher проти фейкового Bot API та Apps Script
+
+    python benchmarks/replay.py updates.log.gz --speed max --json after.json --compare before.json
+
+--speed 1 - у реальному темпі запису, 10 - вдесятеро швидше, max - без пауз
+(не більше --concurrency апдейтів одночасно). Ліміти Telegram вимкнені, щоб
+міряти хендлери, а не token-бакети (--flood-limits вмикає). Апдейти одного
+чату йдуть строго по черзі, різні чати - паралельно. Звіт: апдейтів/с,
+p50/p99 на апдейт і по хендлерах, виклики Bot API, помилки. --json зберігає
+підсумок, --compare показує різницю з підсумком іншого коміту на тому ж журналі.
+
+Записати журнал: RECORD_UPDATES=updates.log.gz python escobar_jobs_bot.py
+(або той самий env для benchmarks/load_test.py).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+# Бот імпортується в main() - налаштування читаються з оточення при імпорті
+app = None
+
+
+def chat_of(update: dict):
+    """Чат апдейту - ключ порядку (апдейти без чату йдуть кожен окремо)"""
+    for key, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat") or event.get("from")
+        if chat:
+            return chat["id"]
+    return ("update", update.get("update_id"))
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def replay(records: list, speed: float, concurrency: int) -> dict:
+    from aiogram.types import Update
+
+    latencies = []
+    errors = Counter()
+    tails = {}
+    slots = asyncio.Semaphore(concurrency)
+
+    async def feed(previous, data: dict):
+        if previous is not None:
+            await previous
+        started = time.perf_counter()
+        try:
+            await app.dp.feed_update(app.bot, Update.model_validate(data, context={"bot": app.bot}))
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        finally:
+            latencies.append(time.perf_counter() - started)
+            slots.release()
+
+    first_ts = records[0][0]
+    started = time.perf_counter()
+    for ts, data in records:
+        if speed:
+            delay = (ts - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await slots.acquire()
+        chat = chat_of(data)
+        tails[chat] = asyncio.create_task(feed(tails.get(chat), data))
+    await asyncio.gather(*tails.values())
+    elapsed = time.perf_counter() - started
+
+    handlers = {
+        handler: {"count": h.count, "p50_ms": h.quantile(0.5) * 1000, "p99_ms": h.quantile(0.99) * 1000}
+        for (handler,), h in app.metrics.series("escobar_handler_seconds").items()
+    }
+    return {
+        "updates": len(records),
+        "chats": len(tails),
+        "seconds": elapsed,
+        "updates_per_second": len(records) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "handlers": handlers,
+        "errors": dict(errors),
+    }
+
+
+def compare(before: dict, after: dict):
+    def delta(old: float, new: float) -> str:
+        return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+    print(f"\nПорівняння з попереднім ({before['updates']} апдейтів):")
+    for key in ("updates_per_second", "p50_ms", "p99_ms"):
+        print(f"  {key:<20} {before[key]:10.2f} -> {after[key]:10.2f}  {delta(before[key], after[key])}")
+    for handler, stats in after["handlers"].items():
+        old = before["handlers"].get(handler)
+        if old:
+            print(f"  {handler:<28} p50 {delta(old['p50_ms'], stats['p50_ms']):>7}  "
+                  f"p99 {delta(old['p99_ms'], stats['p99_ms']):>7}")
+
+
+async def main_async(args, records: list):
+    from aiogram.client.telegram import TelegramAPIServer
+
+    server = FakeTelegram(args.latency, port=args.port, sheets_latency=args.sheets_latency)
+    await server.start()
+    app.bot.session.api = TelegramAPIServer.from_base(server.base_url)
+    app.setup_dispatcher()
+    await app.dp.emit_startup(bot=app.bot, dispatcher=app.dp)
+    try:
+        summary = await replay(records, 0 if args.speed == "max" else float(args.speed), args.concurrency)
+    finally:
+        await app.dp.emit_shutdown(bot=app.bot, dispatcher=app.dp)
+        await app.bot.session.close()
+        await server.close()
+    summary["bot_api"] = dict(server.calls)
+    return summary
+
+
+def main():
+    global app
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log")
+    parser.add_argument("--speed", default="max", help="1, 10, ... або max")
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--sheets-latency", type=float, default=0.0)
+    parser.add_argument("--flood-limits", action="store_true", help="увімкнути ліміти Telegram (за замовчуванням вимкнені)")
+    parser.add_argument("--json", help="зберегти підсумок у файл")
+    parser.add_argument("--compare", help="підсумок іншого коміту (--json) для порівняння")
+    parser.add_argument("--port", type=int, default=8083)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.update({
+        "BOT_TOKEN": "1:replay",
+        "APPS_SCRIPT_URL": f"http://127.0.0.1:{args.port}/sheets",
+        "DB_PATH": os.path.join(workdir, "replay.db"),
+        "FSM_STORAGE": "memory",
+        "METRICS_PORT": "0",
+        "STATS_FILE": "",
+        "FUNNEL_LOG": "",
+        "RECORD_UPDATES": "",
+    })
+    if not args.flood_limits:
+        os.environ.update({"FLOOD_GLOBAL_RATE": "0", "FLOOD_CHAT_RATE": "0"})
+
+    import escobar_jobs_bot
+    app = escobar_jobs_bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    records = list(app.read_update_log(args.log))
+    if not records:
+        print("Журнал порожній")
+        return
+    summary = asyncio.run(main_async(args, records))
+
+    print(f"Апдейтів: {summary['updates']} ({summary['chats']} чатів), швидкість {args.speed}")
+    print(f"Час: {summary['seconds']:.2f} с -> {summary['updates_per_second']:.1f} апдейтів/с, "
+          f"p50 {summary['p50_ms']:.1f}ms, p99 {summary['p99_ms']:.1f}ms")
+    print(f"\n{'хендлер':<28} {'к-сть':>6} {'p50':>9} {'p99':>9}")
+    for handler, stats in sorted(summary["handlers"].items(), key=lambda item: -item[1]["count"]):
+        print(f"{handler:<28} {stats['count']:>6} {stats['p50_ms']:7.1f}ms {stats['p99_ms']:7.1f}ms")
+    print(f"\nВиклики Bot API: {summary['bot_api']}")
+    if summary["errors"]:
+        print(f"Помилки: {summary['errors']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), summary)
+
+
+if __name__ == "__main__":
+    main()
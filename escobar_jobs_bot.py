@@ -4,20 +4,48 @@ Telegram бот для рекрутингу з WebApp та вбудованою
 """
 
 import asyncio
+import bisect
+import contextlib
+import contextvars
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import logging
+import mmap
 import os
+import queue
+import random
 import re
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
 
 import aiohttp
-from aiogram import Bot, Dispatcher, F, Router
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
 from aiogram.types import (
+    BufferedInputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     KeyboardButton,
@@ -26,6 +54,8 @@ from aiogram.types import (
     WebAppInfo,
     CallbackQuery
 )
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from pydantic import ConfigDict, field_validator
 
 # ════════════════════════════════════════════════════════════
 # НАЛАШТУВАННЯ
@@ -42,75 +72,215 @@ ADMIN_IDS = [7952260718]
 # КАНАЛ ДЛЯ ПОСТІВ - пустий, щоб пости йшли тобі в приватні
 POST_CHANNEL_ID = ""
 
+# РЕЖИМ РОБОТИ - "polling" (локальна розробка) або "webhook" (продакшн, кілька реплік)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публічна адреса сервісу (https://...) - обов'язкова у webhook-режимі
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+# Секрет однаковий для всіх реплік - обов'язковий у webhook-режимі (напр. `openssl rand -hex 32`)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+# GOOGLE SHEETS - пул з'єднань до Apps Script
+SHEETS_CONNECT_TIMEOUT = float(os.getenv("SHEETS_CONNECT_TIMEOUT", "5"))
+SHEETS_READ_TIMEOUT = float(os.getenv("SHEETS_READ_TIMEOUT", "30"))
+SHEETS_POOL_LIMIT = int(os.getenv("SHEETS_POOL_LIMIT", "20"))
+SHEETS_POOL_LIMIT_PER_HOST = int(os.getenv("SHEETS_POOL_LIMIT_PER_HOST", "10"))
+SHEETS_DNS_CACHE_TTL = int(os.getenv("SHEETS_DNS_CACHE_TTL", "300"))
+SHEETS_KEEPALIVE_TIMEOUT = float(os.getenv("SHEETS_KEEPALIVE_TIMEOUT", "60"))
+
+# GOOGLE SHEETS - пакетна відправка: вмикати (SHEETS_BATCH_SIZE > 1) лише після того, як Apps Script
+# приймає JSON-масив і відповідає результатом по кожному рядку (контракт - у README.md).
+# За замовчуванням 1 - кожна заявка йде окремим POST, як розуміє поточний скрипт
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "1"))
+SHEETS_BATCH_DELAY = float(os.getenv("SHEETS_BATCH_DELAY", "0.5"))
+SHEETS_BATCH_CONCURRENCY = int(os.getenv("SHEETS_BATCH_CONCURRENCY", "4"))
+
+# ЛОКАЛЬНА БАЗА - outbox заявок та інші дані, що мають пережити рестарт
+DB_PATH = os.getenv("DB_PATH", "escobar_bot.db")
+
+# ДУБЛІ ЗАЯВОК - скільки секунд та сама заявка (чат + telegram/телефон + вакансія) вважається
+# повтором (0 - без перевірки) і скільки відбитків тримати в пам'яті
+SUBMISSION_DEDUP_WINDOW = float(os.getenv("SUBMISSION_DEDUP_WINDOW", "600"))
+SUBMISSION_CACHE_SIZE = int(os.getenv("SUBMISSION_CACHE_SIZE", "10000"))
+
+# FSM СХОВИЩЕ - "memory", "sqlite" або "redis" (для redis потрібен пакет redis)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", DB_PATH)
+FSM_DB_POOL_SIZE = int(os.getenv("FSM_DB_POOL_SIZE", "4"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# FSM СЕСІЇ - скільки секунд неактивності живе незавершена форма (0 - без обмеження)
+FSM_SESSION_TTL = int(os.getenv("FSM_SESSION_TTL", str(6 * 3600)))
+FSM_POST_DRAFT_TTL = int(os.getenv("FSM_POST_DRAFT_TTL", str(24 * 3600)))
+FSM_MAX_SESSIONS = int(os.getenv("FSM_MAX_SESSIONS", "0"))
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", "60"))
+OUTBOX_DRAIN_BATCH = int(os.getenv("OUTBOX_DRAIN_BATCH", "100"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "2"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "600"))
+
+# ЛІМІТИ TELEGRAM - запитів на секунду глобально та на чат, повідомлень на хвилину в групу/канал
+# (0 - без обмеження); FLOOD_CHAT_BURST - скільки повідомлень у чат можна відправити підряд.
+# Правки повідомлень у приватному чаті (екран форми) ліміт чату не витрачають - лише загальний
+FLOOD_GLOBAL_RATE = float(os.getenv("FLOOD_GLOBAL_RATE", "30"))
+FLOOD_CHAT_RATE = float(os.getenv("FLOOD_CHAT_RATE", "1"))
+FLOOD_CHAT_BURST = int(os.getenv("FLOOD_CHAT_BURST", "3"))
+FLOOD_GROUP_PER_MINUTE = float(os.getenv("FLOOD_GROUP_PER_MINUTE", "20"))
+FLOOD_MAX_RETRIES = int(os.getenv("FLOOD_MAX_RETRIES", "3"))
+
+# ЧЕРГА ЧАТУ - апдейти одного чату обробляються по черзі (CHAT_GUARD_MAX_CHATS=0 - вимкнено);
+# скільки апдейтів чату може чекати (решта відкидається), через скільки секунд той самий
+# callback на тому ж повідомленні вже не вважається подвійним натисканням
+CHAT_GUARD_MAX_CHATS = int(os.getenv("CHAT_GUARD_MAX_CHATS", "10000"))
+CHAT_GUARD_MAX_PENDING = int(os.getenv("CHAT_GUARD_MAX_PENDING", "10"))
+CALLBACK_DEBOUNCE = float(os.getenv("CALLBACK_DEBOUNCE", "0.5"))
+
+# РОЗСИЛКА - підписників на пачку (пачка = чекпоінт), як часто оновлювати прогрес у адміна
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "30"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# СТАТИСТИКА - файл для збереження між рестартами (пустий - тільки в пам'яті)
+STATS_FILE = os.getenv("STATS_FILE", "escobar_stats.json")
+STATS_SAVE_INTERVAL = float(os.getenv("STATS_SAVE_INTERVAL", "60"))
+
+# ВОРОНКА - журнал подій форми (пустий - вимкнено) і як часто його агрегувати
+FUNNEL_LOG = os.getenv("FUNNEL_LOG", "escobar_funnel.log")
+FUNNEL_AGGREGATE_INTERVAL = float(os.getenv("FUNNEL_AGGREGATE_INTERVAL", "5"))
+
+# МЕТРИКИ - endpoint для Prometheus на окремому порту (METRICS_PORT=0 - вимкнено);
+# за замовчуванням лише локально, для зовнішнього Prometheus - METRICS_HOST=0.0.0.0
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# ПРОФАЙЛЕР - частка апдейтів під профайлером і поріг повільного апдейту в мс (обидва 0 - вимкнено),
+# період семплування стеку, скільки найгірших трас тримати, куди писати folded-стеки
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "escobar_profiles")
+
+# ЗАПИС АПДЕЙТІВ - знеособлені апдейти у стиснений журнал для replay (пустий шлях - вимкнено);
+# RECORD_SALT - ключ псевдонімів id (пустий - новий на кожен запуск, чати між рестартами не зшиваються)
+RECORD_UPDATES = os.getenv("RECORD_UPDATES", "")
+RECORD_SALT = os.getenv("RECORD_SALT", "")
+RECORD_FLUSH_INTERVAL = float(os.getenv("RECORD_FLUSH_INTERVAL", "1"))
+
 # ════════════════════════════════════════════════════════════
 # ВАКАНСІЇ
 # ════════════════════════════════════════════════════════════
 
-VACANCIES = [
-    {
-        "id": 1,
-        "name": "Адміністратор",
-        "salary": "від 42 000 грн",
-        "max_age": 35,
-        "emoji": "🏢"
-    },
-    {
-        "id": 2,
-        "name": "Менеджер з продажу",
-        "salary": "від 60 000 грн + премії",
-        "max_age": 35,
-        "emoji": "📊"
-    },
-    {
-        "id": 3,
-        "name": "Менеджер з клієнтами",
-        "salary": "від 55 000 грн + премії",
-        "max_age": 35,
-        "emoji": "🤝"
-    },
-    {
-        "id": 4,
-        "name": "HR-менеджер",
-        "salary": "від 48 000 грн + премії",
-        "max_age": 35,
-        "emoji": "👥"
-    },
-    {
-        "id": 5,
-        "name": "Sale Manager",
-        "salary": "від 60 000 грн + премії",
-        "max_age": 35,
-        "emoji": "🎯"
-    },
-    {
-        "id": 6,
-        "name": "Рекрутер",
-        "salary": "від 40 000 грн + премії",
-        "max_age": 35,
-        "emoji": "🔍"
-    },
-    {
-        "id": 7,
-        "name": "Менеджер по роботі з персоналом",
-        "salary": "від 45 000 грн + премії",
-        "max_age": 35,
-        "emoji": "👤"
-    },
-    {
-        "id": 8,
-        "name": "Спеціаліст з комунікацій",
-        "salary": "від 38 000 грн",
-        "max_age": 35,
-        "emoji": "📢"
-    },
-    {
-        "id": 9,
-        "name": "Project Manager",
-        "salary": "від 55 000 грн + премії",
-        "max_age": 35,
-        "emoji": "📋"
-    }
-]
+# Список вакансій - у vacancies.json, підхоплюється без рестарту бота
+VACANCIES_FILE = os.getenv("VACANCIES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vacancies.json"))
+VACANCIES_RELOAD_INTERVAL = float(os.getenv("VACANCIES_RELOAD_INTERVAL", "5"))
+
+
+
+class VacancyCatalog:
+    """
+    Каталог вакансій з JSON-файлу.
+    Індекси: id -> вакансія, назва -> вакансія та відсортований max_age для пошуку через bisect.
+    При зміні файлу перезавантажується атомарно (підміна одного знімка)
+    і викликає підписників, щоб перебудувати тексти та клавіатури.
+    """
+
+    REQUIRED = {"id": int, "name": str, "salary": str, "max_age": int, "emoji": str}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._listeners: List[Callable[[], None]] = []
+        self._mtime = None
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot = self._build(self._read())
+
+    def _read(self) -> List[Dict]:
+        # Запам'ятовуємо версію файлу одразу - невалідний файл не перечитуємо по колу
+        self._mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, encoding="utf-8") as f:
+            vacancies = json.load(f)
+        if not isinstance(vacancies, list) or not vacancies:
+            raise ValueError("vacancies.json має містити непорожній список")
+        for v in vacancies:
+            for field, kind in self.REQUIRED.items():
+                if not isinstance(v.get(field), kind):
+                    raise ValueError(f"Вакансія {v.get('id')!r}: поле {field!r} має бути {kind.__name__}")
+        return vacancies
+
+    @staticmethod
+    def _build(vacancies: List[Dict]) -> tuple:
+        by_id = {v["id"]: v for v in vacancies}
+        if len(by_id) != len(vacancies):
+            raise ValueError("Дублікати id у vacancies.json")
+        by_name = {VacancyCatalog.name_key(v["name"]): v for v in vacancies}
+        by_age = sorted(vacancies, key=lambda v: v["max_age"])
+        max_ages = [v["max_age"] for v in by_age]
+        return tuple(vacancies), by_id, by_age, max_ages, by_name
+
+    @staticmethod
+    def name_key(name: str) -> str:
+        return " ".join(str(name).split()).casefold()
+
+    @property
+    def vacancies(self) -> tuple:
+        """Вакансії в порядку з файлу"""
+        return self._snapshot[0]
+
+    def get(self, vacancy_id: int) -> Optional[Dict]:
+        return self._snapshot[1].get(vacancy_id)
+
+    def find(self, name: str) -> Optional[Dict]:
+        """Вакансія за назвою (без урахування регістру та зайвих пробілів)"""
+        return self._snapshot[4].get(self.name_key(name))
+
+    def suitable_for_age(self, age: int) -> List[Dict]:
+        """Вакансії, на які проходить кандидат віку age (max_age >= age)"""
+        _, _, by_age, max_ages, _ = self._snapshot
+        return by_age[bisect.bisect_left(max_ages, age):]
+
+    def on_reload(self, listener: Callable[[], None]):
+        """Підписка на перезавантаження каталогу"""
+        self._listeners.append(listener)
+
+    def reload(self) -> bool:
+        """Перечитати файл; при помилці лишається попередній каталог"""
+        try:
+            snapshot = self._build(self._read())
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ Каталог вакансій не оновлено: {e}")
+            return False
+
+        self._snapshot = snapshot
+        for listener in self._listeners:
+            listener()
+        logging.info(f"🔄 Каталог вакансій оновлено: {len(snapshot[0])} вакансій")
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(VACANCIES_RELOAD_INTERVAL)
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime != self._mtime:
+                self.reload()
+
+
+catalog = VacancyCatalog(VACANCIES_FILE)
 
 # ════════════════════════════════════════════════════════════
 # FSM СТАНИ
@@ -130,788 +300,4239 @@ class PostCreation(StatesGroup):
     text = State()
     confirm = State()
 
-# ════════════════════════════════════════════════════════════
-# ІНІЦІАЛІЗАЦІЯ
-# ════════════════════════════════════════════════════════════
 
-logging.basicConfig(level=logging.INFO)
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-router = Router()
+class ApplicationSession:
+    """
+    Дані заявки в FSM: id вакансії, id повідомлення форми та зібрані поля.
+    У сховищі лежить компактний список, сама вакансія береться з каталогу.
+    """
 
-# ════════════════════════════════════════════════════════════
-# ДОПОМІЖНІ ФУНКЦІЇ
-# ════════════════════════════════════════════════════════════
+    __slots__ = ("vacancy_id", "message_id", "name", "age", "city", "telegram")
 
-def get_vacancy_by_id(vacancy_id: int) -> Optional[Dict]:
-    """Отримати вакансію по ID"""
-    for v in VACANCIES:
-        if v["id"] == vacancy_id:
-            return v
-    return None
+    def __init__(self, vacancy_id: int, message_id: int, name: Optional[str] = None,
+                 age: Optional[int] = None, city: Optional[str] = None, telegram: Optional[str] = None):
+        self.vacancy_id = vacancy_id
+        self.message_id = message_id
+        self.name = name
+        self.age = age
+        self.city = city
+        self.telegram = telegram
 
+    @classmethod
+    def from_data(cls, data: Dict) -> Optional["ApplicationSession"]:
+        form = data.get("form")
+        return cls(*form) if form else None
 
-async def send_to_google_sheets(data: Dict) -> bool:
-    """Відправка даних в Google Sheets"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                APPS_SCRIPT_URL,
-                json=data,
-                headers={'Content-Type': 'application/json'}
-            ) as response:
-                if response.status == 200:
-                    logging.info("✅ Дані відправлено в Google Sheets")
-                    return True
-                else:
-                    logging.error(f"❌ Помилка Google Sheets: {response.status}")
-                    return False
-    except Exception as e:
-        logging.error(f"❌ Помилка відправки в Google Sheets: {e}")
-        return False
+    def to_data(self) -> Dict:
+        return {"form": [self.vacancy_id, self.message_id, self.name, self.age, self.city, self.telegram]}
+
+    @property
+    def vacancy(self) -> Optional[Dict]:
+        return get_vacancy_by_id(self.vacancy_id)
 
 # ════════════════════════════════════════════════════════════
-# КЛАВІАТУРИ
+# FSM СХОВИЩЕ
 # ════════════════════════════════════════════════════════════
 
-def get_main_keyboard() -> InlineKeyboardMarkup:
-    """Головна клавіатура з 2 кнопками"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🌐 Заповнити онлайн", web_app=WebAppInfo(url=WEBAPP_URL))],
-        [InlineKeyboardButton(text="📋 Вибрати вакансію в боті", callback_data="select_vacancy")]
-    ])
-
-
-def get_vacancies_keyboard() -> InlineKeyboardMarkup:
-    """Клавіатура зі списком вакансій"""
-    buttons = []
-    for v in VACANCIES:
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"{v['emoji']} {v['name']} • {v['salary']}",
-                callback_data=f"vacancy_{v['id']}"
+class SQLiteStorage(BaseStorage):
+    """
+    FSM сховище на SQLite (WAL): стан форм переживає рестарт.
+    Пул з'єднань обслуговує пул потоків - читання йдуть паралельно.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        self.pool_size = max(1, pool_size)
+        self._pool: Optional[queue.SimpleQueue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _open(self):
+        if self._pool is not None:
+            return
+        first = self._connect()
+        first.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                updated_at REAL
             )
-        ])
-    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+        """)
+        # База з попередньої версії - без часу останнього запису
+        columns = {row[1] for row in first.execute("PRAGMA table_info(fsm)")}
+        if "updated_at" not in columns:
+            first.execute("ALTER TABLE fsm ADD COLUMN updated_at REAL")
+        self._pool = queue.SimpleQueue()
+        self._pool.put(first)
+        for _ in range(self.pool_size - 1):
+            self._pool.put(self._connect())
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="fsm")
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    @staticmethod
+    def _parse_key(value: str) -> StorageKey:
+        bot_id, chat_id, user_id, thread_id, destiny = value.split(":", 4)
+        return StorageKey(
+            bot_id=int(bot_id), chat_id=int(chat_id), user_id=int(user_id),
+            thread_id=int(thread_id) if thread_id else None, destiny=destiny
+        )
 
+    async def _run(self, query: str, params: tuple, fetch: bool = False, fetch_all: bool = False):
+        self._open()
+
+        def work():
+            db = self._pool.get()
+            try:
+                cursor = db.execute(query, params)
+                if fetch_all:
+                    return cursor.fetchall()
+                return cursor.fetchone() if fetch else cursor.rowcount
+            finally:
+                self._pool.put(db)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, work)
+
+    async def _delete_if_empty(self, key: StorageKey):
+        """Запис без стану і без даних не тримаємо (умова перевіряється атомарно в SQL)"""
+        await self._run("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (self._key(key),))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        if value is None:
+            await self._run("UPDATE fsm SET state = NULL WHERE key = ?", (self._key(key),))
+            await self._delete_if_empty(key)
+            return
+        await self._run(
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (self._key(key), value, time.time())
+        )
 
-def get_back_keyboard() -> InlineKeyboardMarkup:
-    """Кнопка назад"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад до вакансій", callback_data="back_to_vacancies")]
-    ])
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run("SELECT state FROM fsm WHERE key = ?", (self._key(key),), fetch=True)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not data:
+            await self._run("UPDATE fsm SET data = NULL WHERE key = ?", (self._key(key),))
+            await self._delete_if_empty(key)
+            return
+        await self._run(
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (self._key(key), json.dumps(data, ensure_ascii=False), time.time())
+        )
 
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run("SELECT data FROM fsm WHERE key = ?", (self._key(key),), fetch=True)
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        """Стан і дані одним записом (порожній запис видаляється)"""
+        value = state.state if isinstance(state, State) else state
+        if value is None and not data:
+            await self._run("DELETE FROM fsm WHERE key = ?", (self._key(key),))
+            return
+        await self._run(
+            "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+            "updated_at = excluded.updated_at",
+            (self._key(key), value, json.dumps(data, ensure_ascii=False) if data else None, time.time())
+        )
 
-def get_telegram_keyboard() -> InlineKeyboardMarkup:
-    """Клавіатура для кроку Telegram з кнопкою автопідстановки"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📱 Підставити мій @username", callback_data="auto_username")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_city")]
-    ])
+    async def sessions(self) -> List[Tuple[StorageKey, Optional[str], bool, float]]:
+        """Усі збережені сесії: (ключ, стан, чи є дані, час останнього запису)"""
+        rows = await self._run("SELECT key, state, data IS NOT NULL, updated_at FROM fsm", (), fetch_all=True)
+        # Запис без часу (стара база) вважаємо зробленим зараз - TTL відраховується з рестарту
+        now = time.time()
+        return [(self._parse_key(key), state, bool(has_data), updated_at or now)
+                for key, state, has_data, updated_at in rows]
+
+    async def delete_stale(self, key: StorageKey, updated_at: float) -> bool:
+        """Видалити сесію, якщо з updated_at у неї не було записів"""
+        deleted = await self._run(
+            "DELETE FROM fsm WHERE key = ? AND (updated_at IS NULL OR updated_at <= ?)",
+            (self._key(key), updated_at)
+        )
+        return deleted > 0
+
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+        # Дочікування запитів у потоці - event loop не блокується
+        await asyncio.to_thread(self._executor.shutdown, True)
+        while not self._pool.empty():
+            self._pool.get().close()
+        self._pool = None
+        self._executor = None
+
+
+def create_storage(kind: str, ttl: int = 0) -> BaseStorage:
+    """
+    FSM сховище за назвою з FSM_STORAGE; ttl (0 - без обмеження) - найдовший
+    idle TTL сесій, для redis ключі отримують EXPIRE і зникають самі навіть після рестарту
+    """
+    if kind == "sqlite":
+        return SQLiteStorage(FSM_DB_PATH, pool_size=FSM_DB_POOL_SIZE)
+    if kind == "redis":
+        # Імпорт тут - пакет redis потрібен лише для цього режиму
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        class AtomicRedisStorage(RedisStorage):
+            async def set_record(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+                """Стан і дані в одній транзакції MULTI/EXEC - один round trip"""
+                state_key = self.key_builder.build(key, "state")
+                data_key = self.key_builder.build(key, "data")
+                value = state.state if isinstance(state, State) else state
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    if value is None:
+                        pipe.delete(state_key)
+                    else:
+                        pipe.set(state_key, value, ex=self.state_ttl)
+                    if not data:
+                        pipe.delete(data_key)
+                    else:
+                        pipe.set(data_key, self.json_dumps(data), ex=self.data_ttl)
+                    await pipe.execute()
+
+        return AtomicRedisStorage.from_url(REDIS_URL, state_ttl=ttl or None, data_ttl=ttl or None)
+    if kind != "memory":
+        logging.warning(f"⚠️ Невідоме FSM_STORAGE={kind!r}, використовуємо memory")
+    return MemoryStorage()
+
+class ExpiringStorage(BaseStorage):
+    """
+    Обгортка над FSM сховищем: прибирає покинуті сесії.
+    - idle TTL окремо для кожного стану (або групи станів)
+    - необов'язковий ліміт кількості сесій (LRU)
+    - sweeper на "колесі таймерів": кошики по sweep_interval секунд,
+      за прохід обробляються лише кошики, що вже прострочені
+    - після рестарту сесії з довговічного сховища (час останнього запису)
+      або видаляються, якщо вже прострочені, або стають на облік
+    """
+
+    AGE_BUCKETS = ((300, "< 5 хв"), (1800, "< 30 хв"), (7200, "< 2 год"), (21600, "< 6 год"), (86400, "< 24 год"))
+
+    def __init__(self, inner: BaseStorage, default_ttl: int, ttls: Optional[Dict[str, int]] = None,
+                 max_sessions: int = 0, sweep_interval: int = 60):
+        self.inner = inner
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.max_sessions = max_sessions
+        self.sweep_interval = max(1, sweep_interval)
+        # key -> [created_at, last_access, state, has_data, bucket]
+        self._sessions: "OrderedDict[StorageKey, list]" = OrderedDict()
+        self._buckets: Dict[int, set] = {}
+        self._swept_bucket = int(time.time() // self.sweep_interval)
+        self._task: Optional[asyncio.Task] = None
+        # Фонові видалення LRU - тримаємо посилання, щоб задачі не зібрав GC
+        self._drops: set = set()
+        self.stats = {"expired": 0, "lru_evicted": 0}
+
+    # --- налаштування ---
+
+    def ttl_for(self, state: Optional[str]) -> int:
+        """TTL для стану: точний стан -> група станів -> за замовчуванням"""
+        if state in self.ttls:
+            return self.ttls[state]
+        group = state.split(":", 1)[0] if state else None
+        return self.ttls.get(group, self.default_ttl)
+
+    def set_ttl(self, state: Optional[str], seconds: int):
+        """Змінити TTL на льоту (діє з наступного звернення до сесії)"""
+        if state is None:
+            self.default_ttl = seconds
+        else:
+            self.ttls[state] = seconds
+
+    def set_max_sessions(self, max_sessions: int):
+        self.max_sessions = max_sessions
+
+    # --- облік сесій ---
+
+    def _unschedule(self, entry: list, key: StorageKey):
+        bucket = self._buckets.get(entry[4])
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[entry[4]]
+        entry[4] = None
+
+    def _touch(self, key: StorageKey, state=..., has_data=None, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        entry = self._sessions.get(key)
+        if entry is None:
+            entry = [now, now, None, False, None]
+            self._sessions[key] = entry
+        else:
+            self._sessions.move_to_end(key)
+            self._unschedule(entry, key)
+
+        entry[1] = now
+        if state is not ...:
+            entry[2] = state
+        if has_data is not None:
+            entry[3] = has_data
+
+        # Порожня сесія - нічого стежити
+        if entry[2] is None and not entry[3]:
+            del self._sessions[key]
+            return
+
+        ttl = self.ttl_for(entry[2])
+        if ttl > 0:
+            bucket = int((now + ttl) // self.sweep_interval) + 1
+            entry[4] = bucket
+            self._buckets.setdefault(bucket, set()).add(key)
+
+        if self.max_sessions and len(self._sessions) > self.max_sessions:
+            self._evict_lru()
+
+    def _evict_lru(self):
+        while len(self._sessions) > self.max_sessions:
+            key, entry = self._sessions.popitem(last=False)
+            self._unschedule(entry, key)
+            self.stats["lru_evicted"] += 1
+            task = asyncio.get_running_loop().create_task(self._drop(key, entry[1]))
+            self._drops.add(task)
+            task.add_done_callback(self._drop_done)
+
+    def _drop_done(self, task: asyncio.Task):
+        self._drops.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"❌ Помилка видалення FSM сесії: {task.exception()!r}")
+
+    async def _drop(self, key: StorageKey, last_access: float) -> bool:
+        """
+        Видалити сесію, до якої не зверталися після last_access. Поки чекали своєї черги,
+        користувач міг повернутись - така сесія знову на обліку, її не чіпаємо
+        """
+        if key in self._sessions:
+            return False
+        try:
+            # Довговічне сховище атомарно видаляє лише запис, не змінений після last_access
+            delete_stale = getattr(self.inner, "delete_stale", None)
+            if delete_stale is not None:
+                deleted = await delete_stale(key, last_access)
+                if deleted is not None:
+                    return deleted
+            set_record = getattr(self.inner, "set_record", None)
+            if set_record is not None:
+                await set_record(key, None, {})
+            else:
+                await self.inner.set_state(key=key, state=None)
+                await self.inner.set_data(key=key, data={})
+            return True
+        except Exception as e:
+            logging.warning(f"⚠️ Не вдалось видалити сесію {key.chat_id}: {e!r}")
+            return False
+
+    # --- sweeper ---
+
+    async def start(self):
+        if self._task is None:
+            await self.restore()
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def restore(self) -> int:
+        """
+        Сесії, збережені до рестарту: прострочені видаляються зі сховища,
+        решта стає на облік з часом останнього запису. Повертає кількість видалених
+        """
+        sessions = getattr(self.inner, "sessions", None)
+        if sessions is None:
+            return 0
+        now = time.time()
+        expired = restored = 0
+        for key, state, has_data, updated_at in sorted(await sessions(), key=lambda s: s[3]):
+            ttl = self.ttl_for(state)
+            if ttl > 0 and updated_at + ttl <= now:
+                if await self.inner.delete_stale(key, updated_at):
+                    expired += 1
+            elif key not in self._sessions:
+                self._touch(key, state=state, has_data=has_data, now=updated_at)
+                restored += 1
+        self.stats["expired"] += expired
+        if expired or restored:
+            logging.info(f"🗂 FSM сесії після рестарту: {restored} відновлено, {expired} прострочених видалено")
+        return expired
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.error(f"❌ Помилка прибирання FSM сесій: {e!r}")
+
+    async def sweep(self) -> int:
+        """Видалити сесії з прострочених кошиків; вартість ~ кількості прострочених"""
+        current = int(time.time() // self.sweep_interval)
+        expired = []
+        for bucket in range(self._swept_bucket + 1, current + 1):
+            for key in self._buckets.pop(bucket, ()):
+                entry = self._sessions.pop(key, None)
+                if entry is not None:
+                    expired.append((key, entry[1]))
+        self._swept_bucket = current
+
+        dropped = 0
+        for key, last_access in expired:
+            dropped += await self._drop(key, last_access)
+        self.stats["expired"] += dropped
+        return dropped
+
+    # --- метрики ---
+
+    @property
+    def live_sessions(self) -> int:
+        return len(self._sessions)
+
+    def age_histogram(self) -> List[tuple]:
+        """Розподіл віку живих сесій (для адмін-панелі)"""
+        now = time.time()
+        counts = [0] * (len(self.AGE_BUCKETS) + 1)
+        for created_at, *_ in self._sessions.values():
+            age = now - created_at
+            for i, (limit, _) in enumerate(self.AGE_BUCKETS):
+                if age < limit:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        labels = [label for _, label in self.AGE_BUCKETS] + ["≥ 24 год"]
+        return list(zip(labels, counts))
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.inner.set_state(key=key, state=state)
+        self._touch(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self.inner.get_state(key=key)
+        if value is not None or key in self._sessions:
+            self._touch(key, state=value)
+        return value
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.inner.set_data(key=key, data=data)
+        self._touch(key, has_data=bool(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.inner.get_data(key=key)
+        if value or key in self._sessions:
+            self._touch(key, has_data=bool(value))
+        return value
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        set_record = getattr(self.inner, "set_record", None)
+        if set_record is not None:
+            await set_record(key, state, data)
+        else:
+            await self.inner.set_state(key=key, state=state)
+            await self.inner.set_data(key=key, data=data)
+        self._touch(key, state=state.state if isinstance(state, State) else state, has_data=bool(data))
 
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._drops:
+            await asyncio.gather(*self._drops, return_exceptions=True)
+        await self.inner.close()
 
-def get_skip_phone_keyboard() -> InlineKeyboardMarkup:
-    """Кнопка пропустити телефон"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⏭ Пропустити", callback_data="skip_phone")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_telegram")]
-    ])
 
 # ════════════════════════════════════════════════════════════
-# ОБРОБНИКИ КОМАНД
+# FSM: ОДИН ЗАПИС НА АПДЕЙТ
 # ════════════════════════════════════════════════════════════
 
-@router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
-    """Обробник команди /start"""
-    await state.clear()
-    
-    text = """
-<b>🎯 ESCOBAR JOBS</b>
-<i>Ваша кар'єра починається тут</i>
+# Скільки звернень до сховища зробив би звичайний FSMContext
+_FSM_DIRECT_OPS = {"get_state": 1, "set_state": 1, "get_data": 1, "set_data": 1, "update_data": 2, "clear": 2}
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSMContext для одного апдейту: стан береться з raw_state, дані читаються
+    зі сховища щонайбільше раз, усі зміни накопичуються в пам'яті і
+    записуються одним flush() наприкінці (або не записуються, якщо нічого не змінилось).
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey, raw_state: Optional[str]):
+        super().__init__(storage=storage, key=key)
+        self._state = raw_state
+        self._data: Optional[Dict[str, Any]] = None
+        self._state_dirty = False
+        self._data_dirty = False
+        self.direct_ops = 0
+        self.storage_ops = 0
+
+    async def _load_data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await self.storage.get_data(key=self.key)
+            self.storage_ops += 1
+        return self._data
+
+    async def set_state(self, state: StateType = None) -> None:
+        self.direct_ops += _FSM_DIRECT_OPS["set_state"]
+        value = state.state if isinstance(state, State) else state
+        if value != self._state:
+            self._state = value
+            self._state_dirty = True
+
+    async def get_state(self) -> Optional[str]:
+        self.direct_ops += _FSM_DIRECT_OPS["get_state"]
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self.direct_ops += _FSM_DIRECT_OPS["set_data"]
+        self._data = dict(data)
+        self._data_dirty = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        self.direct_ops += _FSM_DIRECT_OPS["get_data"]
+        return dict(await self._load_data())
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        self.direct_ops += _FSM_DIRECT_OPS["update_data"]
+        if data:
+            kwargs.update(data)
+        current = await self._load_data()
+        current.update(kwargs)
+        self._data_dirty = True
+        return dict(current)
+
+    async def clear(self) -> None:
+        self.direct_ops += _FSM_DIRECT_OPS["clear"]
+        if self._state is not None:
+            self._state = None
+            self._state_dirty = True
+        self._data = {}
+        self._data_dirty = True
+
+    async def flush(self):
+        """Один запис у сховище наприкінці апдейту"""
+        if not (self._state_dirty or self._data_dirty):
+            return
+
+        set_record = getattr(self.storage, "set_record", None)
+        if self._state_dirty and self._data_dirty and set_record is not None:
+            await set_record(self.key, self._state, self._data)
+        elif self._state_dirty and self._data_dirty:
+            await self.storage.set_state(key=self.key, state=self._state)
+            await self.storage.set_data(key=self.key, data=self._data)
+            self.storage_ops += 1
+        elif self._state_dirty:
+            await self.storage.set_state(key=self.key, state=self._state)
+        else:
+            await self.storage.set_data(key=self.key, data=self._data)
+        self.storage_ops += 1
+        self._state_dirty = self._data_dirty = False
 
-━━━━━━━━━━━━━━━━
 
-💼 <b>Ми пропонуємо:</b>
+class FSMUnitOfWorkMiddleware(BaseMiddleware):
+    """Підміняє state на BufferedFSMContext і робить flush після хендлера"""
 
-💰 Високі зарплати від 38 000 грн
-📈 Швидке кар'єрне зростання  
-🏢 Сучасний офіс в центрі міста
-✅ Офіційне працевлаштування
-🎓 Навчання з першого дня
-🎁 Бонуси та преміальні до 150%
+    def __init__(self):
+        self.stats = {"updates": 0, "direct_ops": 0, "storage_ops": 0}
 
-━━━━━━━━━━━━━━━━
+    async def __call__(self, handler, event, data):
+        context = data.get("state")
+        if context is None:
+            return await handler(event, data)
 
-<b>🔥 Актуальні вакансії:</b>
+        buffered = BufferedFSMContext(context.storage, context.key, data.get("raw_state"))
+        data["state"] = buffered
+        result = await handler(event, data)
+        # Хендлер впав - нічого не записуємо (як відкат транзакції)
+        await buffered.flush()
 
-• Адміністратор
-• Менеджер з продажу
-• Менеджер з клієнтами
-• HR-менеджер
-• Sale Manager
-• Рекрутер
-• Менеджер по роботі з персоналом
-• Спеціаліст з комунікацій
-• Project Manager
+        self.stats["updates"] += 1
+        self.stats["direct_ops"] += buffered.direct_ops
+        self.stats["storage_ops"] += buffered.storage_ops
+        return result
 
-━━━━━━━━━━━━━━━━
+    def ops_per_update(self):
+        """(звернень без буфера, реальних звернень) в середньому на апдейт"""
+        updates = self.stats["updates"] or 1
+        return self.stats["direct_ops"] / updates, self.stats["storage_ops"] / updates
 
-👇 <b>Оберіть зручний спосіб подачі заявки:</b>
-"""
-    
-    await message.answer(
-        text,
-        reply_markup=get_main_keyboard(),
-        parse_mode="HTML"
-    )
+
+fsm_unit_of_work = FSMUnitOfWorkMiddleware()
 
 # ════════════════════════════════════════════════════════════
-# ВИБІР ВАКАНСІЇ В БОТІ
+# КЕШ КЛАВІАТУР
 # ════════════════════════════════════════════════════════════
 
-@router.callback_query(F.data == "select_vacancy")
-async def select_vacancy_in_bot(callback: CallbackQuery, state: FSMContext):
-    """Показати список вакансій"""
-    await state.clear()
-    
-    text = """
-<b>📋 ВАКАНСІЇ</b>
+class ReadOnlyList(list):
+    """Список, який не можна змінити на місці (ряди закешованої клавіатури)"""
 
-Оберіть вакансію, яка вас цікавить:
-"""
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=get_vacancies_keyboard(),
-        parse_mode="HTML"
-    )
-    await callback.answer()
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Закешована клавіатура спільна для всіх - побудуйте нову InlineKeyboardMarkup")
 
-# ════════════════════════════════════════════════════════════
-# ОБРОБНИКИ CALLBACK
-# ════════════════════════════════════════════════════════════
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
 
-@router.callback_query(F.data.startswith("vacancy_"))
-async def vacancy_selected(callback: CallbackQuery, state: FSMContext):
-    """Вибрана вакансія"""
-    vacancy_id = int(callback.data.split("_")[1])
-    vacancy = get_vacancy_by_id(vacancy_id)
-    
-    if not vacancy:
-        await callback.answer("❌ Вакансію не знайдено")
-        return
-    
-    # Зберігаємо вакансію
-    await state.update_data(vacancy=vacancy, message_id=callback.message.message_id)
-    await state.set_state(ApplicationForm.name)
-    
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
-💰 {vacancy['salary']}
 
-━━━━━━━━━━━━━━━━
+class FrozenWebAppInfo(WebAppInfo):
+    model_config = ConfigDict(frozen=True, defer_build=False)
 
-<b>Крок 1 з 5</b>
 
-👤 Як вас звати?
+class FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True, defer_build=False)
 
-<i>Введіть ваше ім'я та прізвище</i>
-"""
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=get_back_keyboard(),
-        parse_mode="HTML"
-    )
-    await callback.answer()
+    web_app: Optional[FrozenWebAppInfo] = None
 
 
-@router.callback_query(F.data == "back_to_vacancies")
-async def back_to_vacancies(callback: CallbackQuery, state: FSMContext):
-    """Повернення до списку вакансій"""
-    await state.clear()
-    
-    text = """
-<b>📋 ВАКАНСІЇ</b>
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """
+    Закешована клавіатура, спільна для всіх користувачів: ряди - ReadOnlyList, кнопки заморожені.
+    Правка на місці (append, присвоєння поля) падає, а не псує клавіатуру й готовий JSON для всіх.
+    Потрібна інша клавіатура - будується нова InlineKeyboardMarkup.
+    """
 
-Оберіть вакансію, яка вас цікавить:
-"""
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=get_vacancies_keyboard(),
-        parse_mode="HTML"
-    )
-    await callback.answer()
+    model_config = ConfigDict(frozen=True, defer_build=False)
 
+    inline_keyboard: List[List[FrozenInlineKeyboardButton]]
 
-@router.callback_query(F.data == "back_to_start")
-async def back_to_start(callback: CallbackQuery, state: FSMContext):
-    """Повернення на старт"""
-    await state.clear()
-    await callback.message.delete()
-    await cmd_start(callback.message, state)
-    await callback.answer()
+    @field_validator("inline_keyboard")
+    @classmethod
+    def _read_only_rows(cls, rows):
+        # Підклас list - серіалізується будь-якою сесією як звичайний масив
+        return ReadOnlyList(ReadOnlyList(row) for row in rows)
 
 
-@router.callback_query(F.data == "back_to_telegram")
-async def back_to_telegram(callback: CallbackQuery, state: FSMContext):
-    """Повернення до кроку Telegram"""
-    data = await state.get_data()
-    vacancy = data.get('vacancy')
-    
-    if not vacancy:
-        await callback.answer("❌ Помилка")
-        return
-    
-    await state.set_state(ApplicationForm.telegram)
-    
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+class KeyboardRegistry:
+    """
+    Кеш клавіатур: кожна InlineKeyboardMarkup будується один раз, заморожується
+    (InlineKeyboardMarkup в aiogram змінна, а екземпляр спільний) і віддається
+    разом з готовим JSON. Кеш скидається лише при зміні залежності - каталогу
+    вакансій або WEBAPP_URL.
+    """
 
-━━━━━━━━━━━━━━━━
+    def __init__(self):
+        self._builders: Dict[str, tuple] = {}
+        self._cache: Dict[str, InlineKeyboardMarkup] = {}
+        # id(markup) -> JSON (None - ще не серіалізовано)
+        self._json: Dict[int, Optional[str]] = {}
+        self.stats = {"builds": 0, "hits": 0}
 
-<b>Крок 4 з 5</b>
+    def keyboard(self, name: str, depends_on: tuple = ()):
+        """Декоратор: функція-будівельник стає геттером закешованої клавіатури"""
+        def decorator(builder: Callable[[], InlineKeyboardMarkup]):
+            self._builders[name] = (builder, frozenset(depends_on))
 
-📱 Ваш Telegram?
+            @functools.wraps(builder)
+            def get() -> InlineKeyboardMarkup:
+                return self.get(name)
 
-<i>Введіть username (@ додасться автоматично) або натисніть кнопку</i>
-"""
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=get_telegram_keyboard(),
-        parse_mode="HTML"
-    )
-    await callback.answer()
+            get.build = builder
+            return get
+        return decorator
 
+    def get(self, name: str) -> FrozenInlineKeyboardMarkup:
+        markup = self._cache.get(name)
+        if markup is not None:
+            self.stats["hits"] += 1
+            return markup
 
-@router.callback_query(F.data == "auto_username")
-async def auto_username(callback: CallbackQuery, state: FSMContext):
-    """Автоматична підстановка username"""
-    username = callback.from_user.username
-    
-    if not username:
-        await callback.answer("❌ У вас немає @username в Telegram", show_alert=True)
-        return
-    
-    # Зберігаємо username
-    telegram = f"@{username}"
-    await state.update_data(telegram=telegram)
-    await state.set_state(ApplicationForm.phone)
-    
-    # Оновлюємо повідомлення
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
-    
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+        markup = FrozenInlineKeyboardMarkup.model_validate(self._builders[name][0]().model_dump())
+        self._cache[name] = markup
+        self._json[id(markup)] = None
+        self.stats["builds"] += 1
+        return markup
 
-━━━━━━━━━━━━━━━━
+    def serialized(self, markup, encode: Callable[[Any], str]) -> Optional[str]:
+        """Готовий JSON для закешованої клавіатури (None - клавіатура не з кешу)"""
+        key = id(markup)
+        if key not in self._json:
+            return None
+        value = self._json[key]
+        if value is None:
+            value = self._json[key] = encode(markup)
+        return value
 
-<b>Крок 5 з 5</b>
+    def invalidate(self, dependency: str):
+        """Скинути клавіатури, що залежать від dependency"""
+        for name, (_, depends_on) in self._builders.items():
+            if dependency in depends_on:
+                markup = self._cache.pop(name, None)
+                if markup is not None:
+                    self._json.pop(id(markup), None)
 
-📞 Ваш номер телефону?
 
-<i>Введіть номер або пропустіть цей крок</i>
-"""
-    
-    await bot.edit_message_text(
-        text,
-        chat_id=callback.message.chat.id,
-        message_id=message_id,
-        reply_markup=get_skip_phone_keyboard(),
-        parse_mode="HTML"
-    )
-    await callback.answer()
+keyboards = KeyboardRegistry()
 
 
-@router.callback_query(F.data == "back_to_city")
-async def back_to_city(callback: CallbackQuery, state: FSMContext):
-    """Повернення до кроку Місто"""
-    data = await state.get_data()
-    vacancy = data.get('vacancy')
-    
-    if not vacancy:
-        await callback.answer("❌ Помилка")
-        return
-    
-    await state.set_state(ApplicationForm.city)
-    
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+class KeyboardCachingSession(AiohttpSession):
+    """Сесія бота, що підставляє готовий JSON закешованих клавіатур замість серіалізації"""
 
-━━━━━━━━━━━━━━━━
+    def build_form_data(self, bot: Bot, method):
+        markup = getattr(method, "reply_markup", None)
+        encoded = None
+        if markup is not None:
+            encoded = keyboards.serialized(
+                markup,
+                lambda m: self.prepare_value(m.model_dump(warnings=False), bot=bot, files={})
+            )
+        if encoded is None:
+            return super().build_form_data(bot, method)
 
-<b>Крок 3 з 5</b>
+        form = super().build_form_data(bot, method.model_copy(update={"reply_markup": None}))
+        form.add_field("reply_markup", encoded)
+        return form
+
+# ════════════════════════════════════════════════════════════
+# ЛІМІТИ TELEGRAM
+# ════════════════════════════════════════════════════════════
 
-🏙 З якого ви міста?
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
 
-<i>Введіть назву вашого міста</i>
-"""
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=get_back_keyboard(),
-        parse_mode="HTML"
-    )
-    await callback.answer()
+# Пріоритет вихідних викликів поточного хендлера/таска (таски успадковують контекст)
+outbound_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "outbound_priority", default=PRIORITY_INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def bulk_priority():
+    """Масова відправка (пости, розсилки) - пропускає вперед правки форм користувачів"""
+    token = outbound_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class TokenBucket:
+    """rate токенів на секунду, не більше capacity в запасі"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Скільки чекати до наступного токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Забрати токен (за потреби в борг) - повертає, скільки чекати на нього"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, now: float, seconds: float):
+        """Наступний токен - не раніше ніж через seconds (retry_after від Telegram)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """
+    Усі вихідні запити бота проходять через токен-бакети: свій на кожен чат
+    (приватний ~1/с, група/канал ~20/хв) і загальний (~30/с) з чергою за пріоритетом.
+    TelegramRetryAfter обробляється тут же: пауза для чату і повтор запиту.
+    """
+
+    # Методи, що надсилають/змінюють повідомлення - саме на них діють ліміти Telegram
+    LIMITED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int,
+                 group_per_minute: float, max_retries: int):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, max(1.0, global_rate), time.monotonic()) if global_rate > 0 else None
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._queue = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._chat_waiting = 0
+        self._pruned = time.monotonic()
+        self.stats = {"requests": 0, "delayed": 0, "retry_after": 0, "max_queue": 0}
+        self.waits = {
+            priority: {"count": 0, "total": 0.0, "max": 0.0}
+            for priority in (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        """Запити, що зараз чекають на токен (загальна черга + чати)"""
+        return len(self._queue) + self._chat_waiting
+
+    def _limited(self, method) -> bool:
+        return type(method).__name__.startswith(self.LIMITED_PREFIXES)
+
+    @staticmethod
+    def _per_chat(method, chat_id) -> bool:
+        """
+        Чи витрачає запит токен чату. Правки в приватному чаті - ні: форма редагує
+        одне повідомлення на кожен крок, і швидкий набір не має чекати по секунді.
+        Пауза від Telegram (retry_after) діє і на них.
+        """
+        private = isinstance(chat_id, int) and chat_id > 0
+        return not (private and type(method).__name__.startswith("Edit"))
+
+    def _chat_bucket(self, chat_id, now: float) -> Optional[TokenBucket]:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Від'ємний id або @username - група чи канал
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if group else self.chat_rate
+            if rate <= 0:
+                return None
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _prune(self, now: float):
+        """Повні бакети нічим не відрізняються від відсутніх - прибираємо"""
+        if now - self._pruned < 60:
+            return
+        self._pruned = now
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.full(now)]:
+            del self._chats[chat_id]
+
+    async def __call__(self, make_request, bot, method):
+        if not self._limited(method):
+            return await make_request(bot, method)
+
+        priority = outbound_priority.get()
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            with io_wait("rate_limit"):
+                await self._acquire(chat_id, priority, self._per_chat(method, chat_id))
+            self._record_wait(priority, time.monotonic() - started)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                logging.warning(
+                    f"🐢 Flood control: {type(method).__name__} у чаті {chat_id}, "
+                    f"пауза {e.retry_after} с (спроба {attempt + 1})"
+                )
+                self._pause(chat_id, e.retry_after)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+
+    def _record_wait(self, priority: int, waited: float):
+        self.stats["requests"] += 1
+        if waited > 0.001:
+            self.stats["delayed"] += 1
+        waits = self.waits[priority]
+        waits["count"] += 1
+        waits["total"] += waited
+        waits["max"] = max(waits["max"], waited)
+
+    def _pause(self, chat_id, seconds: float):
+        now = time.monotonic()
+        bucket = self._chat_bucket(chat_id, now) if chat_id is not None else None
+        bucket = bucket or self._global
+        if bucket:
+            bucket.pause(now, seconds)
+
+    async def _acquire(self, chat_id, priority: int, per_chat: bool = True):
+        now = time.monotonic()
+        self._prune(now)
+
+        # Чат: черга FIFO через "борг" у бакеті (без токена - лише пауза від Telegram)
+        bucket = self._chat_bucket(chat_id, now) if chat_id is not None else None
+        if bucket:
+            delay = bucket.reserve(now) if per_chat else max(0.0, bucket.paused_until - now)
+            if delay > 0:
+                self._chat_waiting += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._chat_waiting -= 1
+
+        if self._global is None:
+            return
+        # Загальний ліміт: без черги - одразу, інакше в heap за пріоритетом
+        if not self._queue and self._global.delay(time.monotonic()) == 0:
+            self._global.reserve(time.monotonic())
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._queue, (priority, self._seq, future))
+        self.stats["max_queue"] = max(self.stats["max_queue"], self.queue_depth)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        await future
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            delay = self._global.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            # Запит, що чекав, уже скасований - токен не витрачаємо
+            if future.done():
+                continue
+            self._global.reserve(time.monotonic())
+            future.set_result(None)
+
+    async def close(self):
+        """Зупинка: запити в черзі відпускаються без очікування"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Метрики для адмінки: глибина черги та час очікування за пріоритетами"""
+        waits = {}
+        for priority, w in self.waits.items():
+            name = "interactive" if priority == PRIORITY_INTERACTIVE else "bulk"
+            waits[name] = {
+                "count": w["count"],
+                "avg_ms": w["total"] / w["count"] * 1000 if w["count"] else 0.0,
+                "max_ms": w["max"] * 1000,
+            }
+        return {"queue_depth": self.queue_depth, "chats": len(self._chats), "waits": waits, **self.stats}
+
+
+flood_control = FloodControlMiddleware(
+    global_rate=FLOOD_GLOBAL_RATE,
+    chat_rate=FLOOD_CHAT_RATE,
+    chat_burst=FLOOD_CHAT_BURST,
+    group_per_minute=FLOOD_GROUP_PER_MINUTE,
+    max_retries=FLOOD_MAX_RETRIES
+)
 
 # ════════════════════════════════════════════════════════════
-# ЗАПОВНЕННЯ ФОРМИ - ІМ'Я
+# МЕТРИКИ
 # ════════════════════════════════════════════════════════════
 
-@router.message(ApplicationForm.name)
-async def process_name(message: Message, state: FSMContext):
-    """Обробка імені"""
-    name = message.text.strip()
-    
-    # Видаляємо повідомлення користувача
-    await message.delete()
-    
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
-    
-    # Перевірка довжини
-    if len(name) < 2:
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
-💰 {vacancy['salary']}
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гістограма з фіксованими межами (як у Prometheus) + оцінка перцентилів з кошиків"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Лінійна інтерполяція всередині кошика (те саме робить histogram_quantile)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class RateMeter:
+    """Подій за секунду в середньому за останні window секунд (кільце посекундних лічильників)"""
+
+    __slots__ = ("window", "counts", "seconds")
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.counts = [0] * window
+        self.seconds = [0] * window
+
+    def tick(self):
+        second = int(time.time())
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def rate(self) -> float:
+        now = int(time.time())
+        total = sum(c for c, s in zip(self.counts, self.seconds) if now - s < self.window)
+        return total / self.window
+
+
+class MetricsRegistry:
+    """Лічильники, гістограми та гейджі з мітками - віддаються у текстовому форматі Prometheus"""
+
+    def __init__(self):
+        self._families: Dict[str, tuple] = {}
+        self._gauges: Dict[str, tuple] = {}
+
+    def counter(self, name: str, help: str, labels: tuple = ()):
+        self._families[name] = ("counter", help, labels, {})
+
+    def histogram(self, name: str, help: str, labels: tuple = ()):
+        self._families[name] = ("histogram", help, labels, {})
+
+    def gauge(self, name: str, help: str, labels: tuple, collect: Callable[[], Dict[tuple, float]]):
+        """Гейдж рахується при кожному scrape: collect() -> {значення міток: число}"""
+        self._gauges[name] = (help, labels, collect)
+
+    def inc(self, name: str, *labels, value: float = 1):
+        series = self._families[name][3]
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, *labels):
+        series = self._families[name][3]
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram()
+        histogram.observe(value)
+
+    def series(self, name: str) -> Dict[tuple, Any]:
+        return self._families[name][3]
+
+    @staticmethod
+    def _labels(names: tuple, values: tuple, le: Optional[str] = None) -> str:
+        if le is not None:
+            names, values = names + ("le",), values + (le,)
+        if not names:
+            return ""
+        pairs = []
+        for name, value in zip(names, values):
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{name}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, names, series) in self._families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for values, item in list(series.items()):
+                if kind == "counter":
+                    lines.append(f"{name}{self._labels(names, values)} {item}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(item.buckets, item.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(names, values, str(bound))} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(names, values, '+Inf')} {item.count}")
+                lines.append(f"{name}_sum{self._labels(names, values)} {item.sum}")
+                lines.append(f"{name}_count{self._labels(names, values)} {item.count}")
+        for name, (help, names, collect) in self._gauges.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                values = collect()
+            except Exception as e:
+                logging.error(f"❌ Метрика {name}: {e!r}")
+                continue
+            for label_values, value in values.items():
+                lines.append(f"{name}{self._labels(names, label_values)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.counter("escobar_updates_total", "Апдейти від Telegram", ("type",))
+metrics.histogram("escobar_handler_seconds", "Час хендлера (разом з flush FSM)", ("handler",))
+metrics.counter("escobar_handler_errors_total", "Хендлери, що впали з винятком", ("handler",))
+metrics.histogram("escobar_bot_api_seconds", "Час запиту до Bot API (без очікування лімітів)", ("method",))
+metrics.counter("escobar_bot_api_requests_total", "Запити до Bot API за результатом", ("method", "result"))
+metrics.histogram("escobar_sheets_seconds", "Від постановки рядка в пакет до відповіді Apps Script")
+metrics.counter("escobar_sheets_rows_total", "Рядки, відправлені в Google Sheets", ("result",))
+metrics.histogram("escobar_fsm_storage_seconds", "Час операції FSM сховища", ("op",))
+metrics.counter("escobar_updates_skipped_total", "Апдейти, відкинуті чергою чату", ("reason",))
+
+update_rate = RateMeter()
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware диспетчера: кількість і темп апдейтів, хендлери в роботі"""
+
+    def __init__(self):
+        self.in_flight = 0
+
+    async def __call__(self, handler, event, data):
+        metrics.inc("escobar_updates_total", event.event_type)
+        update_rate.tick()
+        self.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
 
-━━━━━━━━━━━━━━━━
 
-<b>Крок 1 з 5</b>
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware роутера: час кожного хендлера за назвою функції"""
 
-👤 Як вас звати?
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc("escobar_handler_errors_total", name)
+            raise
+        finally:
+            metrics.observe("escobar_handler_seconds", time.perf_counter() - started, name)
 
-❌ <b>Ім'я занадто коротке</b>
-<i>Введіть ваше повне ім'я та прізвище</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
-            parse_mode="HTML"
-        )
-        return
-    
-    # Перевірка на літери (українські, російські, латинські, пробіл, дефіс)
-    if not re.match(r'^[а-яА-ЯіІїЇєЄґҐёЁa-zA-Z\s\-]+$', name):
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
-💰 {vacancy['salary']}
 
-━━━━━━━━━━━━━━━━
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Час і результат кожного виклику Bot API (стоїть після FloodControl - міряє сам запит)"""
 
-<b>Крок 1 з 5</b>
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        result = "ok"
+        try:
+            with io_wait("telegram"):
+                return await make_request(bot, method)
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            metrics.observe("escobar_bot_api_seconds", time.perf_counter() - started, name)
+            metrics.inc("escobar_bot_api_requests_total", name, result)
 
-👤 Як вас звати?
 
-❌ <b>Тільки букви</b>
-<i>Ім'я може містити тільки літери (без цифр та символів)</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
-            parse_mode="HTML"
-        )
-        return
-    
-    # Зберігаємо ім'я
-    await state.update_data(name=name)
-    await state.set_state(ApplicationForm.age)
-    
-    # Оновлюємо повідомлення
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+class InstrumentedStorage(BaseStorage):
+    """Обгортка над FSM сховищем: час кожної операції в escobar_fsm_storage_seconds"""
 
-━━━━━━━━━━━━━━━━
+    def __init__(self, inner: BaseStorage):
+        self.inner = inner
 
-<b>Крок 2 з 5</b>
+    async def _timed(self, op: str, call: Awaitable):
+        started = time.perf_counter()
+        try:
+            with io_wait("fsm"):
+                return await call
+        finally:
+            metrics.observe("escobar_fsm_storage_seconds", time.perf_counter() - started, op)
 
-🎂 Скільки вам років?
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._timed("set_state", self.inner.set_state(key=key, state=state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._timed("get_state", self.inner.get_state(key=key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._timed("set_data", self.inner.set_data(key=key, data=data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return await self._timed("get_data", self.inner.get_data(key=key))
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        set_record = getattr(self.inner, "set_record", None)
+        if set_record is not None:
+            await self._timed("set_record", set_record(key, state, data))
+        else:
+            await self.set_state(key, state)
+            await self.set_data(key, data)
+
+    async def sessions(self) -> List[Tuple[StorageKey, Optional[str], bool, float]]:
+        sessions = getattr(self.inner, "sessions", None)
+        return await self._timed("sessions", sessions()) if sessions is not None else []
+
+    async def delete_stale(self, key: StorageKey, updated_at: float) -> Optional[bool]:
+        """None - сховище не веде час запису (memory, redis)"""
+        delete_stale = getattr(self.inner, "delete_stale", None)
+        if delete_stale is None:
+            return None
+        return await self._timed("delete_stale", delete_stale(key, updated_at))
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+class MetricsEndpoint:
+    """Невеликий aiohttp сервер з /metrics для Prometheus (окремий порт від webhook)"""
+
+    def __init__(self, host: str, port: int, path: str):
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    async def start(self):
+        if not self.port or self._runner:
+            return
+        app = web.Application()
+        app.router.add_get(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"📈 Метрики: http://{self.host}:{self.port}{self.path}")
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+update_metrics = UpdateMetricsMiddleware()
+handler_metrics = HandlerMetricsMiddleware()
+api_metrics = ApiMetricsMiddleware()
+metrics_endpoint = MetricsEndpoint(METRICS_HOST, METRICS_PORT, METRICS_PATH)
+
+
+def handler_quantiles() -> Dict[tuple, float]:
+    return {
+        (handler, str(q)): histogram.quantile(q)
+        for (handler,), histogram in metrics.series("escobar_handler_seconds").items()
+        for q in (0.5, 0.95, 0.99)
+    }
+
+
+def sheets_success_ratio() -> Dict[tuple, float]:
+    rows = metrics.series("escobar_sheets_rows_total")
+    ok = rows.get(("ok",), 0)
+    total = ok + rows.get(("error",), 0)
+    return {(): ok / total if total else 1.0}
 
-<i>Введіть ваш вік (від 17 до {vacancy['max_age']} років)</i>
-"""
-    
-    await bot.edit_message_text(
-        text,
-        chat_id=message.chat.id,
-        message_id=message_id,
-        reply_markup=get_back_keyboard(),
-        parse_mode="HTML"
-    )
+
+# Гейджі рахуються при scrape - об'єкти нижче створюються далі в модулі
+metrics.gauge("escobar_updates_per_second", "Апдейтів за секунду (середнє за хвилину)", (),
+              lambda: {(): update_rate.rate()})
+metrics.gauge("escobar_handlers_in_flight", "Апдейти, що зараз обробляються", (),
+              lambda: {(): update_metrics.in_flight})
+metrics.gauge("escobar_handler_latency_seconds", "p50/p95/p99 часу хендлера (оцінка з гістограми)",
+              ("handler", "quantile"), handler_quantiles)
+metrics.gauge("escobar_sheets_success_ratio", "Частка рядків, прийнятих Google Sheets", (), sheets_success_ratio)
+metrics.gauge("escobar_outbound_queue_depth", "Запити в черзі лімітів Telegram", (),
+              lambda: {(): flood_control.queue_depth})
+metrics.gauge("escobar_fsm_sessions", "Активні FSM сесії", (), lambda: {(): storage.live_sessions})
+metrics.gauge("escobar_outbox_drainer_up", "Drainer outbox працює (1) чи зупинився (0)", (),
+              lambda: {(): int(application_outbox.alive)})
 
 # ════════════════════════════════════════════════════════════
-# ЗАПОВНЕННЯ ФОРМИ - ВІК
+# ПРОФАЙЛЕР
 # ════════════════════════════════════════════════════════════
 
-@router.message(ApplicationForm.age)
-async def process_age(message: Message, state: FSMContext):
-    """Обробка віку"""
-    # Видаляємо повідомлення користувача
-    await message.delete()
-    
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
-    
+# Траса апдейту, який зараз обробляється (таски outbound успадковують її через контекст)
+profile_trace: contextvars.ContextVar = contextvars.ContextVar("profile_trace", default=None)
+
+
+@contextlib.contextmanager
+def io_wait(category: str):
+    """Позначає очікування I/O (telegram, fsm, sheets, outbox) для траси поточного апдейту"""
+    trace = profile_trace.get()
+    if trace is None or trace.wall is not None:
+        yield
+        return
+    trace.waiting[category] = trace.waiting.get(category, 0) + 1
+    started = time.perf_counter()
     try:
-        age = int(message.text.strip())
-    except ValueError:
-        # Помилка валідації - не число
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+        yield
+    finally:
+        trace.io[category] = trace.io.get(category, 0.0) + time.perf_counter() - started
+        trace.waiting[category] -= 1
+        if not trace.waiting[category]:
+            del trace.waiting[category]
+
+
+class ProfileTrace:
+    """Один апдейт під профайлером: семпли стеку, очікування I/O за категоріями, підсумки"""
+
+    __slots__ = ("handler", "update_id", "started_at", "frame", "sampled", "waiting", "io",
+                 "stacks", "on_cpu", "off_cpu", "wall")
+
+    def __init__(self, handler: str, update_id: int, frame, sampled: bool):
+        self.handler = handler
+        self.update_id = update_id
+        self.started_at = time.time()
+        self.frame = frame
+        self.sampled = sampled
+        self.waiting: Dict[str, int] = {}
+        self.io: Dict[str, float] = {}
+        self.stacks = Counter()
+        self.on_cpu = 0
+        self.off_cpu = 0
+        self.wall: Optional[float] = None
+
+    @property
+    def cpu(self) -> float:
+        """Час на CPU - частка семплів, де стек цього апдейту виконувався"""
+        samples = self.on_cpu + self.off_cpu
+        if not samples:
+            return max(0.0, self.wall - sum(self.io.values()))
+        return self.wall * self.on_cpu / samples
+
+    @property
+    def other(self) -> float:
+        """Решта: черга лімітів, sleep, чужі таски в циклі подій"""
+        return max(0.0, self.wall - self.cpu - sum(self.io.values()))
+
+
+class SamplingProfiler(BaseMiddleware):
+    """
+    Inner middleware роутера + фоновий потік, що кожні interval секунд знімає стек
+    потоку циклу подій. Семпл зараховується апдейту, чий кадр middleware є в стеку
+    (він на CPU), решті активних - як очікування (I/O за поточною категорією або
+    чужі таски). Профілюється sample_rate апдейтів і кожен, що довший за slow_ms;
+    найгірші keep трас лишаються в буфері, стеки віддаються у folded-форматі
+    (flamegraph.pl, speedscope, inferno).
+    """
+
+    def __init__(self, sample_rate: float, slow_ms: float, interval_ms: float, keep: int, out_dir: str):
+        self.sample_rate = sample_rate
+        self.slow = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self.out_dir = out_dir
+        self._active: List[ProfileTrace] = []
+        self._worst: List[tuple] = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._busy = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+        self.handlers: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"profiled": 0, "sampled": 0, "slow": 0, "samples": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow > 0
+
+    def start(self):
+        if not self.enabled or self._thread:
+            return
+        self._loop_thread = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._thread.start()
+        logging.info(
+            f"🔬 Профайлер: вибірка {self.sample_rate:.0%}, повільні від {self.slow * 1000:.0f} мс, "
+            f"семпл кожні {self.interval * 1000:.0f} мс"
+        )
+
+    def close(self):
+        if self._thread:
+            self._stopping.set()
+            self._busy.set()
+            self._thread.join()
+            self._thread = None
+
+    async def __call__(self, handler, event, data):
+        if not self._thread:
+            return await handler(event, data)
+        sampled = random.random() < self.sample_rate
+        if not sampled and not self.slow:
+            return await handler(event, data)
+
+        update = data.get("event_update")
+        trace = ProfileTrace(data["handler"].callback.__name__, update.update_id if update else 0,
+                             sys._getframe(), sampled)
+        with self._lock:
+            self._active.append(trace)
+            self._busy.set()
+        token = profile_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            profile_trace.reset(token)
+            with self._lock:
+                trace.wall = time.perf_counter() - started
+                trace.frame = None
+                self._active.remove(trace)
+                if not self._active:
+                    self._busy.clear()
+            self._finish(trace)
+
+    def _finish(self, trace: ProfileTrace):
+        slow = self.slow > 0 and trace.wall >= self.slow
+        if not (trace.sampled or slow):
+            return
+        self.stats["profiled"] += 1
+        self.stats["sampled" if trace.sampled else "slow"] += 1
+
+        totals = self.handlers.setdefault(trace.handler, {"count": 0, "wall": 0.0, "cpu": 0.0, "io": {}})
+        totals["count"] += 1
+        totals["wall"] += trace.wall
+        totals["cpu"] += trace.cpu
+        for category, seconds in trace.io.items():
+            totals["io"][category] = totals["io"].get(category, 0.0) + seconds
+
+        self._seq += 1
+        item = (trace.wall, self._seq, trace)
+        if len(self._worst) < self.keep:
+            heapq.heappush(self._worst, item)
+        elif trace.wall > self._worst[0][0]:
+            heapq.heapreplace(self._worst, item)
+
+    def _sample_loop(self):
+        while not self._stopping.is_set():
+            self._busy.wait()
+            if self._stopping.wait(self.interval):
+                break
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._sample(frame)
+
+    def _sample(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        # Цикл подій спить у selector - ніхто не на CPU
+        idle = stack[0].f_code.co_filename.endswith("selectors.py")
+        with self._lock:
+            self.stats["samples"] += 1
+            for trace in self._active:
+                depth = next((i for i, f in enumerate(stack) if f is trace.frame), None)
+                if depth is not None:
+                    trace.on_cpu += 1
+                    frames = (self._label(f.f_code) for f in reversed(stack[:depth]))
+                    trace.stacks[";".join((trace.handler, *frames))] += 1
+                    continue
+                trace.off_cpu += 1
+                if trace.waiting:
+                    waiting = f"[I/O {'+'.join(sorted(trace.waiting))}]"
+                else:
+                    waiting = "[очікування]" if idle else "[інші таски]"
+                trace.stacks[f"{trace.handler};{waiting}"] += 1
+
+    @staticmethod
+    def _label(code) -> str:
+        return f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+
+    def worst(self) -> List[ProfileTrace]:
+        return [trace for _, _, trace in sorted(self._worst, reverse=True)]
+
+    def folded(self) -> str:
+        """Стеки найгірших трас у folded-форматі: "кадр;кадр;кадр кількість" на рядок"""
+        stacks = Counter()
+        with self._lock:
+            for _, _, trace in self._worst:
+                stacks.update(trace.stacks)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def dump(self) -> List[str]:
+        """Кожна траса - окремий .folded файл у out_dir; повертає шляхи"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        paths = []
+        for trace in self.worst():
+            stamp = datetime.fromtimestamp(trace.started_at).strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(self.out_dir, f"{stamp}_{trace.handler}_{trace.update_id}.folded")
+            with self._lock:
+                lines = "".join(f"{stack} {count}\n" for stack, count in sorted(trace.stacks.items()))
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(lines)
+            paths.append(path)
+        return paths
+
+    def reset(self):
+        with self._lock:
+            self._worst.clear()
+        self.handlers.clear()
+
+    @staticmethod
+    def _io_text(io: Dict[str, float], scale: float = 1.0) -> str:
+        return ", ".join(f"{category} {seconds * scale * 1000:.0f}" for category, seconds in sorted(io.items()))
+
+    def render(self) -> str:
+        if not self.enabled:
+            return (
+                "<b>🔬 ПРОФАЙЛЕР</b>\n\nВимкнено: задайте <code>PROFILE_SAMPLE_RATE</code> "
+                "та/або <code>PROFILE_SLOW_MS</code>"
+            )
+        handlers = "\n".join(
+            f"• {name} ×{t['count']}: {t['wall'] / t['count'] * 1000:.0f} / {t['cpu'] / t['count'] * 1000:.0f}"
+            + (f" / {self._io_text(t['io'], 1 / t['count'])}" if t["io"] else "")
+            for name, t in sorted(self.handlers.items(), key=lambda item: -item[1]["wall"])
+        ) or "• ще немає"
+        worst = "\n".join(
+            f"• {trace.wall * 1000:.0f} мс {trace.handler} #{trace.update_id}: CPU {trace.cpu * 1000:.0f}"
+            + (f", {self._io_text(trace.io)}" if trace.io else "")
+            + f", інше {trace.other * 1000:.0f}"
+            for trace in self.worst()[:10]
+        ) or "• ще немає"
+        return f"""
+<b>🔬 ПРОФАЙЛЕР</b>
 
 ━━━━━━━━━━━━━━━━
 
-<b>Крок 2 з 5</b>
+Вибірка: {self.sample_rate:.0%}, повільні від {self.slow * 1000:.0f} мс
+Профільовано: <b>{self.stats['profiled']}</b> (вибірка {self.stats['sampled']}, повільні {self.stats['slow']})
+Семплів стеку: {self.stats['samples']}
 
-🎂 Скільки вам років?
+<b>По хендлерах</b> (сер. мс: всього / CPU / очікування, паралельні виклики сумуються):
+{handlers}
 
-❌ <b>Введіть коректний вік (число)</b>
-<i>Наприклад: 23</i>
+<b>Найповільніші</b> (мс):
+{worst}
 """
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
-            parse_mode="HTML"
+
+
+profiler = SamplingProfiler(
+    sample_rate=PROFILE_SAMPLE_RATE,
+    slow_ms=PROFILE_SLOW_MS,
+    interval_ms=PROFILE_INTERVAL_MS,
+    keep=PROFILE_KEEP,
+    out_dir=PROFILE_DIR
+)
+
+# ════════════════════════════════════════════════════════════
+# ЗАПИС АПДЕЙТІВ
+# ════════════════════════════════════════════════════════════
+
+class UpdateAnonymizer:
+    """
+    Знеособлення апдейту перед записом: id користувачів і чатів - стабільні
+    псевдоніми (keyed BLAKE2), імена та введений текст - маска тієї ж форми
+    (кирилиця -> "а", латиниця -> "x", цифри -> "0"), тож валідація кроків
+    форми на replay спрацьовує так само. Команди, вік (до 3 цифр) і дані
+    кнопок лишаються як є - саме вони описують поведінку.
+    """
+
+    PEOPLE = ("from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot")
+    NAMES = ("first_name", "last_name", "username", "title")
+    TEXTS = ("text", "caption")
+    DROP = ("contact", "location", "venue", "forward_sender_name", "author_signature")
+
+    def __init__(self, salt: str = ""):
+        self.key = hashlib.blake2b(salt.encode() or os.urandom(16), digest_size=32).digest()
+
+    def _digest(self, value, size: int) -> bytes:
+        return hashlib.blake2b(str(value).encode(), key=self.key, digest_size=size).digest()
+
+    def pseudonym(self, value: int) -> int:
+        pseudonym = int.from_bytes(self._digest(value, 6), "little") | 1
+        # Знак зберігаємо: від'ємний id - група чи канал
+        return -pseudonym if value < 0 else pseudonym
+
+    @staticmethod
+    def mask(text: str) -> str:
+        chars = []
+        for char in text:
+            if char.isdigit():
+                chars.append("0")
+            elif not char.isalpha():
+                chars.append(char)
+            elif char.isascii():
+                chars.append("X" if char.isupper() else "x")
+            else:
+                chars.append("А" if char.isupper() else "а")
+        return "".join(chars)
+
+    def text(self, text: str) -> str:
+        if text.startswith("/") or (text.isdigit() and len(text) <= 3):
+            return text
+        return self.mask(text)
+
+    def web_app_data(self, data: str) -> str:
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return self.mask(data)
+        return json.dumps(self._values(payload), ensure_ascii=False)
+
+    def _values(self, value):
+        if isinstance(value, dict):
+            return {key: self._values(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._values(item) for item in value]
+        return self.text(value) if isinstance(value, str) else value
+
+    def __call__(self, node, parent: str = ""):
+        if isinstance(node, list):
+            return [self(item, parent) for item in node]
+        if not isinstance(node, dict):
+            return node
+        result = {}
+        for key, value in node.items():
+            if key in self.DROP:
+                continue
+            if key == "id" and parent in self.PEOPLE and isinstance(value, int):
+                value = self.pseudonym(value)
+            elif key in self.NAMES and isinstance(value, str):
+                value = self.mask(value)
+            elif key in self.TEXTS and isinstance(value, str):
+                value = self.text(value)
+            elif key == "chat_instance" or (key == "id" and isinstance(value, str)):
+                # id callback/inline запиту непрозорий, але може містити чат - теж псевдонім
+                value = self._digest(value, 8).hex()
+            elif key == "web_app_data" and isinstance(value, dict):
+                value = {**value, "data": self.web_app_data(value.get("data", ""))}
+            else:
+                value = self(value, key)
+            result[key] = value
+        return result
+
+
+class UpdateRecorder(BaseMiddleware):
+    """
+    Outer middleware диспетчера: кожен апдейт (знеособлений) дописується в журнал.
+    Формат: gzip-потік із заголовком MAGIC, далі записи "<dI" (unix-час, довжина)
+    + JSON апдейту. Стиснення і запис на диск - у потоці раз на flush_interval,
+    з Z_SYNC_FLUSH, тож після падіння процесу журнал читається до останнього flush.
+    """
+
+    MAGIC = b"ESCU\x01"
+    RECORD = struct.Struct("<dI")
+
+    def __init__(self, path: str, salt: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.anonymize = UpdateAnonymizer(salt)
+        self._buffer: List[bytes] = []
+        self._file: Optional[gzip.GzipFile] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"records": 0, "bytes": 0}
+
+    async def __call__(self, handler, event, data):
+        if self._file is not None:
+            try:
+                payload = json.dumps(
+                    self.anonymize(event.model_dump(mode="json", exclude_none=True, by_alias=True)),
+                    ensure_ascii=False, separators=(",", ":")
+                ).encode()
+                self._buffer.append(self.RECORD.pack(time.time(), len(payload)) + payload)
+                self.stats["records"] += 1
+            except Exception as e:
+                logging.error(f"❌ Запис апдейту: {e!r}")
+        return await handler(event, data)
+
+    def _open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = gzip.open(self.path, "ab")
+        # Дописування після рестарту - новий gzip member, заголовок лише на початку файлу
+        if new:
+            self._file.write(self.MAGIC)
+
+    def _write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    async def flush(self):
+        if not self._buffer or self._file is None:
+            return
+        chunk, self._buffer = b"".join(self._buffer), []
+        await asyncio.to_thread(self._write, chunk)
+        self.stats["bytes"] += len(chunk)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"❌ Журнал апдейтів: {e!r}")
+
+    async def start(self):
+        if not self.path or self._file is not None:
+            return
+        await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"📼 Запис апдейтів: {self.path}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._file is not None:
+            await self.flush()
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+
+def read_update_log(path: str) -> Iterator[Tuple[float, Dict]]:
+    """Записи журналу (час, JSON апдейту); обірваний хвіст (падіння процесу) пропускається"""
+    with gzip.open(path, "rb") as f:
+        if f.read(len(UpdateRecorder.MAGIC)) != UpdateRecorder.MAGIC:
+            raise ValueError(f"{path}: не журнал апдейтів")
+        header = UpdateRecorder.RECORD
+        try:
+            while True:
+                head = f.read(header.size)
+                if len(head) < header.size:
+                    return
+                ts, length = header.unpack(head)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield ts, json.loads(payload)
+        except (EOFError, zlib.error):
+            return
+
+
+update_recorder = UpdateRecorder(RECORD_UPDATES, RECORD_SALT, RECORD_FLUSH_INTERVAL)
+
+# ════════════════════════════════════════════════════════════
+# ЧЕРГА АПДЕЙТІВ ЧАТУ
+# ════════════════════════════════════════════════════════════
+
+class ChatSlot:
+    """Апдейти одного чату в роботі: lock, callback, що виконується, і останній, що чекає"""
+
+    __slots__ = ("lock", "users", "running", "waiting")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.running: Optional[tuple] = None
+        self.waiting: Optional[tuple] = None
+
+
+class ChatGuardMiddleware(BaseMiddleware):
+    """
+    Outer middleware диспетчера, стоїть перед FSM: апдейти одного чату
+    обробляються строго по черзі. Наступний крок читає стан уже після flush
+    попереднього, а хендлери не редагують те саме повідомлення навперейми.
+
+    Callback з тими самими data на тому ж повідомленні, що вже виконується,
+    чекає черги або завершився менш ніж debounce секунд тому, - подвійне
+    натискання: callback.answer() у фоні і відкидається (dropped). З різних
+    callback, що чекають черги, виконується лише останній (coalesced).
+
+    Пам'ять стала: у таблиці лише чати з апдейтами в роботі (понад max_chats
+    апдейт іде без черги) і не більше max_chats останніх callback для debounce.
+    """
+
+    def __init__(self, max_chats: int, max_pending: int, debounce: float):
+        self.max_chats = max_chats
+        self.max_pending = max_pending
+        self.debounce = debounce
+        self._chats: Dict[int, ChatSlot] = {}
+        self._recent: "OrderedDict[tuple, float]" = OrderedDict()
+        self.stats = {"waited": 0, "dropped": 0, "coalesced": 0, "rejected": 0, "unguarded": 0}
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chats)
+
+    def _is_repeat(self, slot: ChatSlot, key: tuple) -> bool:
+        if key == slot.running or key == slot.waiting:
+            return True
+        finished = self._recent.get(key)
+        return finished is not None and time.monotonic() - finished < self.debounce
+
+    def _remember(self, key: tuple):
+        self._recent[key] = time.monotonic()
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_chats:
+            self._recent.popitem(last=False)
+
+    async def _skip(self, callback: Optional[CallbackQuery], reason: str):
+        self.stats[reason] += 1
+        metrics.inc("escobar_updates_skipped_total", reason)
+        # Без відповіді Telegram крутить "годинник" на кнопці
+        if callback is not None:
+            await outbound.fire(callback.answer())
+
+    async def __call__(self, handler, event, data):
+        chat = data.get("event_chat")
+        if chat is None or self.max_chats <= 0:
+            return await handler(event, data)
+
+        callback = event.callback_query
+        key = (chat.id, callback.data, callback.message.message_id) if callback and callback.message else None
+
+        slot = self._chats.get(chat.id)
+        if slot is None:
+            if len(self._chats) >= self.max_chats:
+                self.stats["unguarded"] += 1
+                return await handler(event, data)
+            slot = self._chats[chat.id] = ChatSlot()
+        if key is not None and self._is_repeat(slot, key):
+            return await self._skip(callback, "dropped")
+        if slot.users > self.max_pending:
+            logging.warning(f"🚧 Чат {chat.id}: у черзі вже {slot.users - 1} апдейтів, відкидаємо")
+            return await self._skip(callback, "rejected")
+
+        queued = slot.lock.locked()
+        if queued:
+            self.stats["waited"] += 1
+            if key is not None:
+                slot.waiting = key
+        slot.users += 1
+        try:
+            async with slot.lock:
+                if queued and key is not None:
+                    # Поки чекали, натиснули іншу кнопку - виконується вона
+                    if slot.waiting != key:
+                        return await self._skip(callback, "coalesced")
+                    slot.waiting = None
+                slot.running = key
+                try:
+                    return await handler(event, data)
+                finally:
+                    slot.running = None
+                    if key is not None:
+                        self._remember(key)
+        finally:
+            slot.users -= 1
+            if not slot.users:
+                del self._chats[chat.id]
+
+
+chat_guard = ChatGuardMiddleware(CHAT_GUARD_MAX_CHATS, CHAT_GUARD_MAX_PENDING, CALLBACK_DEBOUNCE)
+
+# ════════════════════════════════════════════════════════════
+# ІНІЦІАЛІЗАЦІЯ
+# ════════════════════════════════════════════════════════════
+
+logging.basicConfig(level=logging.INFO)
+bot = Bot(token=BOT_TOKEN, session=KeyboardCachingSession())
+bot.session.middleware(flood_control)
+bot.session.middleware(api_metrics)
+# Redis-ключам - EXPIRE за найдовшим TTL (0 у будь-якого стану - без обмеження)
+_fsm_ttls = (FSM_SESSION_TTL, FSM_POST_DRAFT_TTL)
+storage = ExpiringStorage(
+    InstrumentedStorage(create_storage(FSM_STORAGE, ttl=0 if 0 in _fsm_ttls else max(_fsm_ttls))),
+    default_ttl=FSM_SESSION_TTL,
+    ttls={PostCreation.__name__: FSM_POST_DRAFT_TTL},
+    max_sessions=FSM_MAX_SESSIONS,
+    sweep_interval=FSM_SWEEP_INTERVAL
+)
+dp = Dispatcher(storage=storage)
+router = Router()
+
+# ════════════════════════════════════════════════════════════
+# GOOGLE SHEETS
+# ════════════════════════════════════════════════════════════
+
+class GoogleSheetsSink:
+    """Довгоживучий HTTP-клієнт для Apps Script з keep-alive пулом з'єднань"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats = {
+            "requests": 0,
+            "success": 0,
+            "errors": 0,
+            "handshakes": 0,
+            "reused": 0,
+        }
+
+    async def start(self):
+        """Створення сесії (викликається з main)"""
+        if self._session and not self._session.closed:
+            return
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_created)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+
+        connector = aiohttp.TCPConnector(
+            limit=SHEETS_POOL_LIMIT,
+            limit_per_host=SHEETS_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=SHEETS_DNS_CACHE_TTL,
+            keepalive_timeout=SHEETS_KEEPALIVE_TIMEOUT
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=SHEETS_CONNECT_TIMEOUT,
+            sock_read=SHEETS_READ_TIMEOUT
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[trace]
         )
-        return
-    
-    # Валідація віку - менше 17
-    if age < 17:
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
 
-━━━━━━━━━━━━━━━━
+    async def close(self):
+        """Закриття сесії при зупинці бота"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
-<b>Крок 2 з 5</b>
+    async def _on_connection_created(self, session, ctx, params):
+        # Нове з'єднання = новий TCP + TLS handshake
+        self.stats["handshakes"] += 1
 
-🎂 Скільки вам років?
+    async def _on_connection_reused(self, session, ctx, params):
+        self.stats["reused"] += 1
 
-❌ <b>Мінімальний вік - 17 років</b>
-<i>Введіть ваш вік (від 17 до {vacancy['max_age']} років)</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
-            parse_mode="HTML"
+    @property
+    def reuse_ratio(self) -> float:
+        """Частка запитів, що пішли по вже відкритому з'єднанню"""
+        total = self.stats["handshakes"] + self.stats["reused"]
+        return self.stats["reused"] / total if total else 0.0
+
+    async def send(self, data) -> bool:
+        """POST в Apps Script через спільний пул"""
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        self.stats["requests"] += 1
+        try:
+            async with self._session.post(
+                self.url,
+                json=data,
+                headers={'Content-Type': 'application/json'}
+            ) as response:
+                # Дочитуємо тіло, щоб з'єднання повернулось у пул
+                await response.read()
+                if response.status == 200:
+                    self.stats["success"] += 1
+                    logging.info("✅ Дані відправлено в Google Sheets")
+                    return True
+                else:
+                    self.stats["errors"] += 1
+                    logging.error(f"❌ Помилка Google Sheets: {response.status}")
+                    return False
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.error(f"❌ Помилка відправки в Google Sheets: {e!r}")
+            return False
+
+
+    async def send_batch(self, rows: List[Dict]) -> List[bool]:
+        """POST пакету рядків одним JSON-масивом, результат - по кожному рядку"""
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        self.stats["requests"] += 1
+        try:
+            async with self._session.post(
+                self.url,
+                json=rows,
+                headers={'Content-Type': 'application/json'}
+            ) as response:
+                body = await response.read()
+                if response.status != 200:
+                    self.stats["errors"] += 1
+                    logging.error(f"❌ Помилка Google Sheets: {response.status} ({len(rows)} рядків)")
+                    return [False] * len(rows)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.error(f"❌ Помилка відправки пакету в Google Sheets: {e!r}")
+            return [False] * len(rows)
+
+        results = self._parse_batch_results(body, len(rows))
+        if results is None:
+            # Скрипт не знає пакетів (або відповів не за контрактом) - не можна вважати рядки записаними
+            self.stats["errors"] += 1
+            logging.error(
+                f"❌ Google Sheets: незрозуміла відповідь на пакет з {len(rows)} рядків "
+                f"({body[:100]!r}) - рядки лишаються на повтор"
+            )
+            return [False] * len(rows)
+
+        self.stats["success"] += 1
+        logging.info(f"✅ Пакет з {len(rows)} рядків відправлено в Google Sheets")
+        return results
+
+    @staticmethod
+    def _parse_batch_results(body: bytes, count: int) -> Optional[List[bool]]:
+        """
+        Результати по рядках з відповіді Apps Script.
+        Підтримується [true, false, ...], {"results": [...]} та [{"ok": true}, ...].
+        Не JSON, інша форма або інша кількість результатів - None (пакет не підтверджено).
+        """
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+
+        if isinstance(payload, dict):
+            payload = payload.get("results")
+        if not isinstance(payload, list) or len(payload) != count:
+            return None
+
+        results = []
+        for item in payload:
+            if isinstance(item, dict):
+                item = item.get("ok", item.get("success"))
+            if not isinstance(item, bool):
+                return None
+            results.append(item)
+        return results
+
+
+sheets_sink = GoogleSheetsSink(APPS_SCRIPT_URL)
+
+
+class SheetsBatcher:
+    """Write-behind черга: збирає заявки і відправляє їх у Sheets пакетами"""
+
+    def __init__(self, sink: GoogleSheetsSink, max_batch: int, max_delay: float, concurrency: int):
+        self.sink = sink
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_slots = asyncio.Semaphore(max(1, concurrency))
+        self._flushes = set()
+        self.stats = {"batches": 0, "rows": 0, "failed_rows": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Запуск фонового збирача пакетів"""
+        if self.running or self.max_batch <= 1:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Зупинка: дочікуємось відправки всього, що вже в черзі"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        self._task = None
+
+    async def submit(self, row: Dict) -> bool:
+        """Поставити рядок у чергу і дочекатись результату саме для нього"""
+        if not self.running:
+            return await self.sink.send(row)
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            stop = False
+
+            # Добираємо пакет до max_batch або поки не вийде max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    getter = asyncio.ensure_future(self._queue.get())
+                    await asyncio.wait({getter}, timeout=remaining)
+                    if not getter.done():
+                        getter.cancel()
+                        break
+                    item = getter.result()
+
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush_slots.acquire()
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+            if stop:
+                return
+
+    async def _flush(self, batch):
+        try:
+            rows = [row for row, _ in batch]
+            results = await self.sink.send_batch(rows)
+        except Exception as e:
+            logging.error(f"❌ Помилка пакетної відправки: {e!r}")
+            results = [False] * len(batch)
+        finally:
+            self._flush_slots.release()
+
+        self.stats["batches"] += 1
+        self.stats["rows"] += len(batch)
+        self.stats["failed_rows"] += results.count(False)
+
+        for (_, future), ok in zip(batch, results):
+            if not future.done():
+                future.set_result(ok)
+
+
+sheets_batcher = SheetsBatcher(
+    sheets_sink,
+    max_batch=SHEETS_BATCH_SIZE,
+    max_delay=SHEETS_BATCH_DELAY,
+    concurrency=SHEETS_BATCH_CONCURRENCY
+)
+
+# ════════════════════════════════════════════════════════════
+# OUTBOX ЗАЯВОК
+# ════════════════════════════════════════════════════════════
+
+class ApplicationOutbox:
+    """
+    Durable outbox: заявка спершу комітиться в SQLite (WAL + fsync),
+    а фоновий drainer доставляє її в Sheets з експоненційним backoff.
+    Доставка at-least-once - після рестарту недоставлені рядки йдуть повторно.
+    """
+
+    def __init__(self, path: str, drain_batch: int, retry_base: float, retry_max: float):
+        self.path = path
+        self.drain_batch = drain_batch
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._db: Optional[sqlite3.Connection] = None
+        # Один потік = послідовний доступ до з'єднання без локів
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.stats = {"appended": 0, "delivered": 0, "retries": 0, "errors": 0}
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)")
+        # Replay: все, що не доставили до рестарту, пробуємо одразу
+        db.execute("UPDATE outbox SET next_attempt_at = ?", (time.time(),))
+        self._db = db
+        return db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _insert(self, payload: str) -> int:
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO outbox (payload, created_at, next_attempt_at) VALUES (?, ?, ?)",
+            (payload, now, now)
         )
-        return
-    
-    # Валідація віку - більше максимального для вакансії
-    if age > vacancy['max_age']:
-        # Показуємо альтернативні вакансії
-        suitable = [v for v in VACANCIES if age <= v['max_age']]
-        
-        if suitable:
-            alt_text = "\n".join([f"• {v['emoji']} {v['name']} (до {v['max_age']} років)" for v in suitable])
-            text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+        return cursor.lastrowid
+
+    def _fetch_due(self, now: float):
+        return self._db.execute(
+            "SELECT id, payload, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (now, self.drain_batch)
+        ).fetchall()
+
+    def _next_due(self) -> Optional[float]:
+        return self._db.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()[0]
+
+    def _complete(self, delivered: List[int], retry: List[tuple]):
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in delivered])
+            self._db.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?",
+                retry
+            )
 
-━━━━━━━━━━━━━━━━
+    def _pending_count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    async def pending(self) -> int:
+        return await self._run(self._pending_count)
+
+    async def start(self):
+        """Відкриття бази та запуск drainer (з replay недоставлених)"""
+        if self._task:
+            return
+        self._stopping = False
+        pending = await self._run(self._open)
+        if pending:
+            logging.info(f"📤 Outbox: {pending} недоставлених заявок, відправляємо повторно")
+        self._task = asyncio.create_task(self._drain_loop())
+        self._task.add_done_callback(self._drainer_done)
+
+    @property
+    def alive(self) -> bool:
+        """Drainer працює - інакше заявки лише накопичуються в базі"""
+        return self._task is not None and not self._task.done()
+
+    def _drainer_done(self, task: asyncio.Task):
+        if self._stopping or task.cancelled():
+            return
+        error = task.exception()
+        logging.critical(
+            f"🛑 Outbox: drainer зупинився ({error!r}), заявки не доставляються до рестарту"
+        )
+
+    async def close(self, timeout: float = 10):
+        """Зупинка drainer (дочікуємось поточної доставки) та закриття бази"""
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                logging.warning("⚠️ Outbox: доставку перервано при зупинці, рядки підуть після рестарту")
+            self._task = None
+        if self._db:
+            await self._run(self._db.close)
+            self._db = None
+
+    async def append(self, data: Dict) -> int:
+        """Локальний коміт заявки - після нього заявку вже не втратимо"""
+        row_id = await self._run(self._insert, json.dumps(data, ensure_ascii=False))
+        self.stats["appended"] += 1
+        self._wakeup.set()
+        return row_id
+
+    def _backoff(self, attempts: int) -> float:
+        # Експоненційний backoff з jitter, щоб повтори не били в Apps Script хвилею
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _drain_loop(self):
+        while not self._stopping:
+            try:
+                await self._drain_once()
+            except Exception as e:
+                # Напр. "database is locked" - drainer не має вмирати, пробуємо ще раз
+                self.stats["errors"] += 1
+                logging.error(f"❌ Outbox: помилка доставки: {e!r}")
+                await asyncio.sleep(self.retry_base)
+
+    async def _drain_once(self):
+        self._wakeup.clear()
+        rows = await self._run(self._fetch_due, time.time())
+
+        if not rows:
+            next_due = await self._run(self._next_due)
+            timeout = None if next_due is None else max(0.0, next_due - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        results = await asyncio.gather(
+            *(send_to_google_sheets(json.loads(payload)) for _, payload, _ in rows),
+            return_exceptions=True
+        )
 
-<b>Крок 2 з 5</b>
+        now = time.time()
+        delivered, retry = [], []
+        for (row_id, _, attempts), ok in zip(rows, results):
+            if ok is True:
+                delivered.append(row_id)
+            else:
+                attempts += 1
+                retry.append((attempts, now + self._backoff(attempts), row_id))
 
-⚠️ <b>На вакансію "{vacancy['name']}" максимальний вік - {vacancy['max_age']} років</b>
+        await self._run(self._complete, delivered, retry)
 
-<b>Вакансії, які вам підходять:</b>
-{alt_text}
+        self.stats["delivered"] += len(delivered)
+        self.stats["retries"] += len(retry)
+        if retry:
+            logging.warning(f"⚠️ Outbox: {len(retry)} заявок не доставлено, повтор пізніше")
 
-<i>Поверніться назад та оберіть іншу вакансію</i>
-"""
+
+application_outbox = ApplicationOutbox(
+    DB_PATH,
+    drain_batch=OUTBOX_DRAIN_BATCH,
+    retry_base=OUTBOX_RETRY_BASE,
+    retry_max=OUTBOX_RETRY_MAX
+)
+
+# ════════════════════════════════════════════════════════════
+# ІДЕМПОТЕНТНІСТЬ ЗАЯВОК
+# ════════════════════════════════════════════════════════════
+
+class SubmissionIndex:
+    """
+    Відбиток заявки (чат + нормалізовані telegram/телефон + вакансія) -> результат.
+    Повтор у межах window секунд (подвійне натискання, повторна відправка WebApp)
+    отримує збережений результат без outbox і Sheets. Гарячі відбитки - в LRU,
+    решта - в таблиці submissions у DB_PATH, тож дублі ловляться і після рестарту.
+    Одночасні дублі чекають на першу відправку, а не запускають свою.
+    """
+
+    def __init__(self, path: str, window: float, cache_size: int):
+        self.path = path
+        self.window = window
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="submissions")
+        self.stats = {"submitted": 0, "duplicates": 0, "index_hits": 0}
+
+    @staticmethod
+    def fingerprint(chat_id: int, data: Dict) -> str:
+        telegram = str(data.get("telegram") or "").strip().lstrip("@").lower()
+        phone = re.sub(r"\D", "", str(data.get("phone") or ""))
+        vacancy = " ".join(str(data.get("vacancy") or "").split()).lower()
+        return hashlib.sha256(f"{chat_id}|{telegram}|{phone}|{vacancy}".encode()).hexdigest()[:32]
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS submissions (
+                fingerprint TEXT PRIMARY KEY,
+                submitted_at REAL NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS submissions_age ON submissions (submitted_at)")
+        db.execute("DELETE FROM submissions WHERE submitted_at < ?", (time.time() - self.window,))
+        self._db = db
+
+    def _lookup(self, fingerprint: str) -> Optional[float]:
+        row = self._db.execute(
+            "SELECT submitted_at FROM submissions WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _store(self, fingerprint: str, submitted_at: float):
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT OR REPLACE INTO submissions (fingerprint, submitted_at) VALUES (?, ?)",
+                (fingerprint, submitted_at)
+            )
+            # Індекс не росте: прострочені відбитки вже нічого не дедуплікують
+            self._db.execute("DELETE FROM submissions WHERE submitted_at < ?", (submitted_at - self.window,))
+
+    async def start(self):
+        if self._db is None and self.window > 0:
+            await self._run(self._open)
+
+    async def close(self):
+        if self._db:
+            await self._run(self._db.close)
+            self._db = None
+
+    def _remember(self, fingerprint: str, submitted_at: float):
+        self._cache[fingerprint] = submitted_at
+        self._cache.move_to_end(fingerprint)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _seen(self, fingerprint: str, now: float) -> bool:
+        submitted_at = self._cache.get(fingerprint)
+        if submitted_at is None and self._db is not None:
+            submitted_at = await self._run(self._lookup, fingerprint)
+            if submitted_at is not None:
+                self.stats["index_hits"] += 1
+                self._remember(fingerprint, submitted_at)
+        return submitted_at is not None and now - submitted_at < self.window
+
+    async def submit(self, chat_id: int, data: Dict, send: Callable[[Dict], Awaitable[bool]]) -> bool:
+        """send(data) лише для першої заявки у вікні; дубль одразу отримує True"""
+        if self.window <= 0:
+            return await send(data)
+
+        fingerprint = self.fingerprint(chat_id, data)
+        while True:
+            pending = self._in_flight.get(fingerprint)
+            if pending is None:
+                break
+            try:
+                saved = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Скасували саму цю заявку - далі не йдемо
+                if not pending.cancelled():
+                    raise
+                # Скасували першу відправку - дубль відправляється сам (або чекає нового першого)
+                continue
+            self.stats["duplicates"] += 1
+            return saved
+        # Реєструємось до першого await - одночасний дубль уже побачить нас
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[fingerprint] = future
+        try:
+            now = time.time()
+            if await self._seen(fingerprint, now):
+                self.stats["duplicates"] += 1
+                logging.info(f"♻️ Повторна заявка від {chat_id} - вже прийнята, не відправляємо")
+                saved = True
+            else:
+                saved = await send(data)
+                self.stats["submitted"] += 1
+                # Неуспішну заявку не запам'ятовуємо - повтор має пройти
+                if saved:
+                    self._remember(fingerprint, now)
+                    if self._db is not None:
+                        await self._run(self._store, fingerprint, now)
+            future.set_result(saved)
+            return saved
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Дублів могло не бути - виняток не має лишитись "непрочитаним"
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[fingerprint]
+
+
+submission_index = SubmissionIndex(DB_PATH, window=SUBMISSION_DEDUP_WINDOW, cache_size=SUBMISSION_CACHE_SIZE)
+
+# ════════════════════════════════════════════════════════════
+# WEBHOOK
+# ════════════════════════════════════════════════════════════
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    Webhook-хендлер: одразу відповідає Telegram 200, а апдейт кладе в обмежену чергу,
+    яку розбирає фіксована кількість воркерів. Черга повна - 503, Telegram повторить пізніше.
+    При зупинці дообробляє чергу; сесію бота закриває run_webhook після shutdown-хуків.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str],
+                 queue_size: int, workers: int, **data):
+        super().__init__(dispatcher=dispatcher, bot=bot, secret_token=secret_token, **data)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker_count = workers
+        self._workers = []
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0}
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def register(self, app: web.Application, /, path: str, **kwargs):
+        app.on_startup.append(self._start_workers)
+        super().register(app, path=path, **kwargs)
+
+    async def _start_workers(self, app: web.Application):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._worker_count)]
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error(f"❌ Помилка обробки апдейту: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            logging.warning("⚠️ Webhook: черга апдейтів переповнена")
+            return web.Response(status=503)
+        self.stats["accepted"] += 1
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    __call__ = handle
+
+    async def close(self):
+        """Дообробляємо чергу і зупиняємо воркери (до shutdown-хуків диспетчера, сесія ще відкрита)"""
+        try:
+            await asyncio.wait_for(self._queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"⚠️ Webhook: {self._queue.qsize()} апдейтів не оброблено при зупинці")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+
+# ════════════════════════════════════════════════════════════
+# ВІДКЛАДЕНІ ДІЇ
+# ════════════════════════════════════════════════════════════
+
+class DeferredScheduler:
+    """
+    Відкладені дії бота (напр. "відредагувати повідомлення через 2 с").
+    Один фоновий таск і heap за часом - хендлер не тримає корутину на sleep.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = set()
+        self.stats = {"scheduled": 0, "fired": 0, "cancelled": 0, "failed": 0, "max_lag": 0.0}
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, key, delay: float, action: Callable[[], Awaitable]):
+        """Запланувати action() через delay секунд (той самий key замінює попередню дію)"""
+        self.cancel(key, count=False)
+        self._seq += 1
+        entry = [time.monotonic() + delay, self._seq, key, action]
+        heapq.heappush(self._heap, entry)
+        self._entries[key] = entry
+        self.stats["scheduled"] += 1
+        # Будимо таск, лише якщо нова дія має спрацювати раніше за всі інші
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def cancel(self, key, count: bool = True) -> bool:
+        """Скасувати дію (напр. користувач вже натиснув щось сам)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        # Ліниве видалення: запис лишається в heap, але без дії
+        entry[3] = None
+        if count:
+            self.stats["cancelled"] += 1
+        return True
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Зупинка: незапущені дії відкидаються"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._entries:
+            logging.info(f"⏰ Відкладені дії: відкинуто {len(self._entries)} при зупинці")
+        self._heap.clear()
+        self._entries.clear()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+
+            while self._heap and self._heap[0][0] <= now:
+                when, _, key, action = heapq.heappop(self._heap)
+                if action is None:
+                    continue
+                self._entries.pop(key, None)
+                self.stats["max_lag"] = max(self.stats["max_lag"], now - when)
+                task = asyncio.create_task(self._fire(key, action))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, key, action):
+        try:
+            await action()
+            self.stats["fired"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logging.warning(f"⚠️ Відкладена дія {key} не виконана: {e!r}")
+
+
+deferred = DeferredScheduler()
+
+# ════════════════════════════════════════════════════════════
+# ВИХІДНІ ВИКЛИКИ BOT API
+# ════════════════════════════════════════════════════════════
+
+class OutboundPipeline:
+    """
+    Виклики Bot API з хендлерів: незалежні йдуть паралельно (gather),
+    другорядні (видалення введення) - у фоні з фіксацією помилок (fire),
+    а виклики з однаковим ключем (те саме повідомлення) - строго по черзі (ordered).
+    """
+
+    def __init__(self, concurrent: bool = True):
+        # concurrent=False - усе по черзі, як раніше (для порівняння затримки)
+        self.concurrent = concurrent
+        self._tails: Dict[Any, asyncio.Future] = {}
+        self._running = set()
+        self.stats = {"fired": 0, "failed": 0, "gathered": 0, "ordered": 0, "waited": 0}
+
+    @property
+    def pending(self) -> int:
+        return len(self._running)
+
+    async def fire(self, call: Awaitable, key=None):
+        """Виконати виклик у фоні; помилка логується, а не ламає хендлер"""
+        self.stats["fired"] += 1
+        if key is not None:
+            call = self.ordered(key, call)
+        if not self.concurrent:
+            await self._guard(call)
+            return
+        task = asyncio.create_task(self._guard(call))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def gather(self, *calls: Awaitable) -> list:
+        """Незалежні виклики одного апдейту - одночасно; помилка піднімається як зазвичай"""
+        self.stats["gathered"] += len(calls)
+        if not self.concurrent:
+            return [await call for call in calls]
+        # Методи aiogram (message.delete() тощо) - awaitable, але не корутини
+        return list(await asyncio.gather(*(self._await(call) for call in calls)))
+
+    async def ordered(self, key, call: Awaitable):
+        """Виклик, який стартує лише після попереднього з тим самим key"""
+        self.stats["ordered"] += 1
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                self.stats["waited"] += 1
+                await previous
+            return await call
+        finally:
+            # Корутина могла не стартувати (скасування під час очікування)
+            if asyncio.iscoroutine(call):
+                call.close()
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def close(self, timeout: float = 5):
+        """Дочекатися фонових викликів перед закриттям сесії бота"""
+        if not self._running:
+            return
+        done, pending = await asyncio.wait(set(self._running), timeout=timeout)
+        if pending:
+            logging.warning(f"⚠️ Вихідні виклики: {len(pending)} не завершились до зупинки")
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _await(call: Awaitable):
+        return await call
+
+    async def _guard(self, call: Awaitable):
+        try:
+            await call
+        except Exception as e:
+            # Напр. повідомлення вже видалене або старше 48 годин
+            self.stats["failed"] += 1
+            logging.debug(f"Вихідний виклик не вдався: {e!r}")
+
+
+outbound = OutboundPipeline()
+
+# ════════════════════════════════════════════════════════════
+# РОЗСИЛКА
+# ════════════════════════════════════════════════════════════
+
+class SubscriberRegistry:
+    """Усі, хто натискав /start, - адресати розсилок (таблиця subscribers в DB_PATH)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="subscribers")
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        # Втрата останньої підписки при падінні живлення не критична
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS subscribers (
+                chat_id INTEGER PRIMARY KEY,
+                joined_at REAL NOT NULL
+            )
+        """)
+        self._db = db
+
+    def _add(self, chat_id: int):
+        self._db.execute(
+            "INSERT OR IGNORE INTO subscribers (chat_id, joined_at) VALUES (?, ?)",
+            (chat_id, time.time())
+        )
+
+    def _page(self, after: int, limit: int) -> List[int]:
+        rows = self._db.execute(
+            "SELECT chat_id FROM subscribers WHERE chat_id > ? ORDER BY chat_id LIMIT ?",
+            (after, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _remove(self, chat_ids: List[int]):
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("DELETE FROM subscribers WHERE chat_id = ?", [(c,) for c in chat_ids])
+
+    def _count(self, exclude: Optional[int]) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM subscribers WHERE chat_id IS NOT ?", (exclude,)).fetchone()[0]
+
+    async def start(self):
+        if self._db is None:
+            await self._run(self._open)
+
+    async def close(self):
+        if self._db:
+            await self._run(self._db.close)
+            self._db = None
+
+    async def add(self, chat_id: int):
+        await self._run(self._add, chat_id)
+
+    async def page(self, after: int, limit: int) -> List[int]:
+        """Наступні limit підписників після after (курсор розсилки)"""
+        return await self._run(self._page, after, limit)
+
+    async def remove(self, chat_ids: List[int]):
+        if chat_ids:
+            await self._run(self._remove, chat_ids)
+
+    async def count(self, exclude: Optional[int] = None) -> int:
+        return await self._run(self._count, exclude)
+
+
+class BroadcastEngine:
+    """
+    Розсилка поста всім підписникам: send_photo з file_id пачками,
+    після кожної пачки курсор і лічильники комітяться - рестарт продовжує з місця зупинки.
+    Темп задає FloodControlMiddleware (низький пріоритет), заблоковані видаляються з реєстру.
+    """
+
+    # Курсор нової розсилки - нижче за будь-який chat_id (групи й канали мають від'ємні)
+    CURSOR_START = -2 ** 63
+
+    def __init__(self, path: str, subscribers: SubscriberRegistry, batch_size: int, progress_interval: float):
+        self.path = path
+        self.subscribers = subscribers
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Поточна розсилка: лічильники та темп для адмінки
+        self.current: Optional[Dict[str, Any]] = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                photo TEXT NOT NULL,
+                caption TEXT NOT NULL,
+                report_chat_id INTEGER,
+                report_message_id INTEGER,
+                cursor INTEGER NOT NULL DEFAULT -9223372036854775808,
+                total INTEGER,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                exclude_chat_id INTEGER
+            )
+        """)
+        # База з попередньої версії - без колонки exclude_chat_id
+        columns = {row[1] for row in db.execute("PRAGMA table_info(broadcasts)")}
+        if "exclude_chat_id" not in columns:
+            db.execute("ALTER TABLE broadcasts ADD COLUMN exclude_chat_id INTEGER")
+        # Старі розсилки стартували з курсора 0 і пропускали групи (від'ємні chat_id);
+        # ще не розпочаті (без total) починаємо з самого початку
+        db.execute(
+            "UPDATE broadcasts SET cursor = ? WHERE finished_at IS NULL AND total IS NULL AND cursor = 0",
+            (self.CURSOR_START,)
+        )
+        self._db = db
+        return db.execute("SELECT COUNT(*) FROM broadcasts WHERE finished_at IS NULL").fetchone()[0]
+
+    def _insert(self, photo: str, caption: str, report_chat_id: Optional[int], report_message_id: Optional[int],
+                exclude_chat_id: Optional[int]) -> int:
+        cursor = self._db.execute(
+            "INSERT INTO broadcasts (photo, caption, report_chat_id, report_message_id, exclude_chat_id, cursor, "
+            "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (photo, caption, report_chat_id, report_message_id, exclude_chat_id, self.CURSOR_START, time.time())
+        )
+        return cursor.lastrowid
+
+    def _next_unfinished(self) -> Optional[Dict[str, Any]]:
+        self._db.row_factory = sqlite3.Row
+        try:
+            row = self._db.execute(
+                "SELECT * FROM broadcasts WHERE finished_at IS NULL ORDER BY id LIMIT 1"
+            ).fetchone()
+        finally:
+            self._db.row_factory = None
+        return dict(row) if row else None
+
+    def _checkpoint(self, job: Dict[str, Any], finished: bool):
+        self._db.execute(
+            "UPDATE broadcasts SET cursor = ?, total = ?, sent = ?, failed = ?, blocked = ?, finished_at = ? "
+            "WHERE id = ?",
+            (job["cursor"], job["total"], job["sent"], job["failed"], job["blocked"],
+             time.time() if finished else None, job["id"])
+        )
+
+    async def start(self):
+        """Відкриття бази; незавершена до рестарту розсилка продовжиться"""
+        if self._task:
+            return
+        self._stopping = False
+        unfinished = await self._run(self._open)
+        if unfinished:
+            logging.info(f"📣 Розсилка: {unfinished} незавершених, продовжуємо з чекпоінту")
+        self._task = asyncio.create_task(self._worker())
+
+    async def close(self, timeout: float = 10):
+        """Зупинка після поточної пачки (її чекпоінт встигає записатись)"""
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                logging.warning("⚠️ Розсилка: пачку перервано при зупинці, її буде надіслано повторно")
+            self._task = None
+        if self._db:
+            await self._run(self._db.close)
+            self._db = None
+
+    async def enqueue(self, photo: str, caption: str, report_chat_id: Optional[int] = None,
+                      report_message_id: Optional[int] = None, exclude_chat_id: Optional[int] = None) -> int:
+        """
+        Поставити пост у чергу розсилки (file_id фото вже є на серверах Telegram);
+        exclude_chat_id - хто вже отримав пост (адмін), йому не дублюємо
+        """
+        broadcast_id = await self._run(
+            self._insert, photo, caption, report_chat_id, report_message_id, exclude_chat_id
+        )
+        self._wakeup.set()
+        return broadcast_id
+
+    async def _worker(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            job = await self._run(self._next_unfinished)
+            if job is None:
+                await self._wakeup.wait()
+                continue
+            await self._broadcast(job)
+
+    async def _broadcast(self, job: Dict[str, Any]):
+        if job["total"] is None:
+            job["total"] = await self.subscribers.count(exclude=job["exclude_chat_id"])
+        done_before = job["sent"] + job["failed"] + job["blocked"]
+        self.current = {**job, "started": time.monotonic(), "done_before": done_before}
+        reporter = asyncio.create_task(self._report_loop())
+        finished = False
+        try:
+            while not self._stopping:
+                chat_ids = await self.subscribers.page(job["cursor"], self.batch_size)
+                if not chat_ids:
+                    finished = True
+                    break
+                cursor = chat_ids[-1]
+                chat_ids = [chat_id for chat_id in chat_ids if chat_id != job["exclude_chat_id"]]
+                results = await asyncio.gather(*(self._send(job, chat_id) for chat_id in chat_ids))
+
+                blocked = [chat_id for chat_id, result in zip(chat_ids, results) if result == "blocked"]
+                await self.subscribers.remove(blocked)
+                job["blocked"] += len(blocked)
+                job["sent"] += results.count("sent")
+                job["failed"] += results.count("failed")
+                job["cursor"] = cursor
+                await self._run(self._checkpoint, job, False)
+                self.current.update(job)
+
+            if finished:
+                await self._run(self._checkpoint, job, True)
+                logging.info(
+                    f"📣 Розсилка #{job['id']} завершена: надіслано {job['sent']}, "
+                    f"заблокували {job['blocked']}, помилок {job['failed']}"
+                )
+        finally:
+            reporter.cancel()
+            self.current.update(job)
+            self.current["finished"] = finished
+            await self._report()
+            self.current = None
+
+    async def _send(self, job: Dict[str, Any], chat_id: int) -> str:
+        try:
+            with bulk_priority():
+                await bot.send_photo(
+                    chat_id=chat_id,
+                    photo=job["photo"],
+                    caption=job["caption"],
+                    reply_markup=get_post_button_keyboard(),
+                    parse_mode="HTML"
+                )
+            return "sent"
+        except TelegramForbiddenError:
+            # Користувач заблокував бота або видалив акаунт
+            return "blocked"
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "blocked"
+            logging.warning(f"⚠️ Розсилка в {chat_id}: {e.message}")
+            return "failed"
+        except Exception as e:
+            logging.warning(f"⚠️ Розсилка в {chat_id}: {e!r}")
+            return "failed"
+
+    def progress(self) -> Optional[Dict[str, Any]]:
+        """Прогрес поточної розсилки: скільки оброблено та темп (повідомлень за секунду)"""
+        if self.current is None:
+            return None
+        job = self.current
+        done = job["sent"] + job["failed"] + job["blocked"]
+        elapsed = max(time.monotonic() - job["started"], 1e-6)
+        rate = (done - job["done_before"]) / elapsed
+        remaining = max(job["total"] - done, 0)
+        return {
+            "id": job["id"], "total": job["total"], "done": done,
+            "sent": job["sent"], "failed": job["failed"], "blocked": job["blocked"],
+            "rate": rate, "eta": remaining / rate if rate > 0 else None,
+            "finished": job.get("finished", False),
+        }
+
+    def render(self) -> str:
+        progress = self.progress()
+        if progress is None:
+            return "📣 Активних розсилок немає"
+        percent = progress["done"] / progress["total"] * 100 if progress["total"] else 100.0
+        if progress["finished"]:
+            status = "✅ <b>Розсилку завершено</b>"
+        elif progress["eta"] is not None:
+            status = f"⏳ Залишилось ~{progress['eta'] / 60:.0f} хв"
         else:
-            text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+            status = "⏳ Триває..."
+        return f"""
+<b>📣 РОЗСИЛКА #{progress['id']}</b>
 
 ━━━━━━━━━━━━━━━━
 
-<b>Крок 2 з 5</b>
+Оброблено: <b>{progress['done']} / {progress['total']}</b> ({percent:.0f}%)
+⚡ {progress['rate']:.1f} повідомл./с
 
-❌ <b>На жаль, ваш вік ({age} років) перевищує максимальний для всіх наших вакансій</b>
+Надіслано: {progress['sent']}
+Заблокували бота: {progress['blocked']}
+Помилок: {progress['failed']}
 
-<i>Поверніться назад</i>
+{status}
 """
-        
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
+
+    async def _report(self):
+        """Оновити повідомлення з прогресом у адміна"""
+        job = self.current
+        if not job or not job["report_chat_id"] or not job["report_message_id"]:
+            return
+        key = (job["report_chat_id"], job["report_message_id"])
+        await outbound.fire(bot.edit_message_text(
+            self.render(),
+            chat_id=job["report_chat_id"],
+            message_id=job["report_message_id"],
             parse_mode="HTML"
-        )
-        return
-    
-    # Вік валідний - зберігаємо
-    await state.update_data(age=age)
-    await state.set_state(ApplicationForm.city)
-    
-    # Оновлюємо повідомлення - наступний крок
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+        ), key=key)
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._report()
+
+
+subscribers = SubscriberRegistry(DB_PATH)
+broadcaster = BroadcastEngine(
+    DB_PATH,
+    subscribers,
+    batch_size=BROADCAST_BATCH_SIZE,
+    progress_interval=BROADCAST_PROGRESS_INTERVAL
+)
+
+# ════════════════════════════════════════════════════════════
+# СТАТИСТИКА ЗАЯВОК
+# ════════════════════════════════════════════════════════════
+
+class TopCounter:
+    """
+    Top-N лічильник (алгоритм Space-Saving): не більше capacity ключів у пам'яті.
+    Новий ключ при заповненні витісняє найменший і успадковує його лічильник.
+    """
+
+    __slots__ = ("capacity", "counts")
+
+    def __init__(self, capacity: int, counts: Optional[Dict[str, int]] = None):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = dict(counts or {})
+
+    def add(self, key: str):
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+        else:
+            victim = min(counts, key=counts.get)
+            counts[key] = counts.pop(victim) + 1
+
+    def top(self, n: int) -> List[tuple]:
+        return heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+
+
+class ApplicationStats:
+    """
+    Потокова статистика заявок фіксованого розміру: вакансії та міста (top-N),
+    кільце погодинних лічильників і гістограма віку. Оновлюється на кожну заявку,
+    рендер не залежить від того, скільки заявок уже прийнято.
+    """
+
+    AGE_MIN = 17
+    AGE_MAX = 60
+    AGE_GROUPS = ((17, 20), (21, 25), (26, 30), (31, 35), (36, 45), (46, AGE_MAX))
+    SPARK = "▁▂▃▄▅▆▇█"
+
+    def __init__(self, path: str, hours: int = 7 * 24, max_cities: int = 100,
+                 max_vacancies: int = 50, save_interval: float = 60):
+        self.path = path
+        self.save_interval = save_interval
+        self.total = 0
+        self.vacancies = TopCounter(max_vacancies)
+        self.cities = TopCounter(max_cities)
+        # Кільце: слот = година (hour % len), hour_ids - яку саме годину зараз рахує слот
+        self.hours = [0] * hours
+        self.hour_ids = [0] * hours
+        self.ages = [0] * (self.AGE_MAX - self.AGE_MIN + 1)
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, data: Dict, now: Optional[float] = None):
+        """Врахувати заявку (з форми бота або WebApp)"""
+        now = time.time() if now is None else now
+        self.total += 1
+
+        vacancy = str(data.get("vacancy") or "").strip()
+        if vacancy:
+            self.vacancies.add(vacancy)
+
+        city = " ".join(str(data.get("city") or "").split()).title()
+        if city:
+            self.cities.add(city)
+
+        hour = int(now // 3600)
+        slot = hour % len(self.hours)
+        if self.hour_ids[slot] != hour:
+            self.hour_ids[slot] = hour
+            self.hours[slot] = 0
+        self.hours[slot] += 1
+
+        try:
+            age = int(data.get("age"))
+        except (TypeError, ValueError):
+            age = None
+        if age is not None:
+            age = min(max(age, self.AGE_MIN), self.AGE_MAX)
+            self.ages[age - self.AGE_MIN] += 1
+
+        self._dirty = True
+
+    def last_hours(self, n: int, now: Optional[float] = None) -> List[int]:
+        """Заявки за останні n годин (від найстарішої до поточної)"""
+        hour = int((time.time() if now is None else now) // 3600)
+        result = []
+        for h in range(hour - min(n, len(self.hours)) + 1, hour + 1):
+            slot = h % len(self.hours)
+            result.append(self.hours[slot] if self.hour_ids[slot] == h else 0)
+        return result
+
+    def age_groups(self) -> List[tuple]:
+        return [
+            (f"{low}-{high}" if high < self.AGE_MAX else f"{low}+",
+             sum(self.ages[low - self.AGE_MIN:high - self.AGE_MIN + 1]))
+            for low, high in self.AGE_GROUPS
+        ]
+
+    def render(self, now: Optional[float] = None) -> str:
+        day = self.last_hours(24, now)
+        week = sum(self.last_hours(len(self.hours), now))
+        peak = max(day) or 1
+        spark = "".join(self.SPARK[count * (len(self.SPARK) - 1) // peak] for count in day)
+
+        vacancies = "\n".join(f"• {name}: <b>{count}</b>" for name, count in self.vacancies.top(5)) or "—"
+        cities = "\n".join(f"• {name}: <b>{count}</b>" for name, count in self.cities.top(5)) or "—"
+        ages = "\n".join(f"• {label}: {count}" for label, count in self.age_groups())
+        return f"""
+<b>📊 СТАТИСТИКА</b>
 
 ━━━━━━━━━━━━━━━━
 
-<b>Крок 3 з 5</b>
+Всього заявок: <b>{self.total}</b>
+За 24 години: <b>{sum(day)}</b> • за 7 днів: {week}
+
+<b>По годинах (24 год):</b>
+<code>{spark}</code>
+
+<b>Топ вакансій:</b>
+{vacancies}
 
-🏙 З якого ви міста?
+<b>Топ міст:</b>
+{cities}
 
-<i>Введіть назву вашого міста</i>
+<b>Вік:</b>
+{ages}
+
+<i>Оновлено {datetime.now().strftime('%H:%M:%S')}</i>
 """
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "vacancies": self.vacancies.counts,
+            "cities": self.cities.counts,
+            "hours": self.hours,
+            "hour_ids": self.hour_ids,
+            "ages": self.ages,
+        }
+
+    def load_dict(self, data: Dict[str, Any]):
+        self.total = data.get("total", 0)
+        self.vacancies = TopCounter(self.vacancies.capacity, data.get("vacancies"))
+        self.cities = TopCounter(self.cities.capacity, data.get("cities"))
+        # Розмір кільця/гістограми міг змінитись - беремо лише те, що збігається
+        if len(data.get("hours", ())) == len(self.hours):
+            self.hours, self.hour_ids = list(data["hours"]), list(data["hour_ids"])
+        if len(data.get("ages", ())) == len(self.ages):
+            self.ages = list(data["ages"])
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.load_dict(json.load(f))
+
+    def _save(self, snapshot: Dict[str, Any]):
+        # Атомарний запис: не лишаємо напівзаписаний файл при падінні
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    async def save(self):
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._save, self.to_dict())
+        except OSError as e:
+            self._dirty = True
+            logging.error(f"❌ Статистика: не вдалось зберегти {self.path}: {e!r}")
+
+    async def start(self):
+        """Завантаження збереженої статистики та періодичне збереження (якщо path задано)"""
+        if not self.path or self._task:
+            return
+        try:
+            await asyncio.to_thread(self._load)
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ Статистика: не вдалось прочитати {self.path}: {e!r}")
+        self._task = asyncio.create_task(self._save_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+    async def _save_loop(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save()
+
+
+application_stats = ApplicationStats(STATS_FILE, save_interval=STATS_SAVE_INTERVAL)
+
+# ════════════════════════════════════════════════════════════
+# ДОПОМІЖНІ ФУНКЦІЇ
+# ════════════════════════════════════════════════════════════
+
+def get_vacancy_by_id(vacancy_id: int) -> Optional[Dict]:
+    """Отримати вакансію по ID"""
+    return catalog.get(vacancy_id)
+
+
+async def load_session(state: FSMContext) -> Optional[ApplicationSession]:
+    """Поточна заявка з FSM"""
+    return ApplicationSession.from_data(await state.get_data())
+
+
+async def save_session(state: FSMContext, session: ApplicationSession):
+    """Зберегти заявку в FSM"""
+    await state.update_data(session.to_data())
+
+
+async def vacancy_unavailable(chat_id: int, state: FSMContext, session: Optional[ApplicationSession]):
+    """
+    Вакансію форми прибрали з каталогу (або сесія загубилась): форма скидається,
+    а замість неї - актуальний список вакансій із поясненням
+    """
+    await state.clear()
+    text = form_texts.screen("vacancy_unavailable")
+    if session is None:
+        await bot.send_message(chat_id, text, reply_markup=get_vacancies_keyboard(), parse_mode="HTML")
+        return
     
-    await bot.edit_message_text(
+    logging.info(f"📭 Вакансії {session.vacancy_id} вже немає в каталозі - форму чату {chat_id} скинуто")
+    await outbound.ordered((chat_id, session.message_id), bot.edit_message_text(
         text,
-        chat_id=message.chat.id,
-        message_id=message_id,
-        reply_markup=get_back_keyboard(),
+        chat_id=chat_id,
+        message_id=session.message_id,
+        reply_markup=get_vacancies_keyboard(),
         parse_mode="HTML"
-    )
+    ))
+
+
+async def send_to_google_sheets(data: Dict) -> bool:
+    """Відправка даних в Google Sheets (через пакетну чергу)"""
+    started = time.perf_counter()
+    with io_wait("sheets"):
+        ok = await sheets_batcher.submit(data)
+    metrics.observe("escobar_sheets_seconds", time.perf_counter() - started)
+    metrics.inc("escobar_sheets_rows_total", "ok" if ok else "error")
+    return ok
+
+
+async def submit_application(data: Dict, chat_id: int) -> bool:
+    """Прийом заявки: повтор у вікні дедуплікації отримує збережений результат"""
+    return await submission_index.submit(chat_id, data, store_application)
+
+
+async def store_application(data: Dict) -> bool:
+    """Збереження заявки в локальний outbox (доставка в Sheets - у фоні)"""
+    application_stats.record(data)
+    try:
+        with io_wait("outbox"):
+            await application_outbox.append(data)
+        return True
+    except Exception as e:
+        # Локальний коміт не вдався - пробуємо відправити напряму
+        logging.error(f"❌ Помилка запису в outbox: {e!r}")
+        return await send_to_google_sheets(data)
 
 # ════════════════════════════════════════════════════════════
-# ЗАПОВНЕННЯ ФОРМИ - МІСТО
+# КЛАВІАТУРИ
 # ════════════════════════════════════════════════════════════
 
-@router.message(ApplicationForm.city)
-async def process_city(message: Message, state: FSMContext):
-    """Обробка міста"""
-    city = message.text.strip()
-    
-    # Видаляємо повідомлення користувача
-    await message.delete()
-    
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
-    
-    if len(city) < 2:
-        # Помилка валідації
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+@keyboards.keyboard("main", depends_on=("webapp_url",))
+def get_main_keyboard() -> InlineKeyboardMarkup:
+    """Головна клавіатура з 2 кнопками"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🌐 Заповнити онлайн", web_app=WebAppInfo(url=WEBAPP_URL))],
+        [InlineKeyboardButton(text="📋 Вибрати вакансію в боті", callback_data="select_vacancy")]
+    ])
+
+
+@keyboards.keyboard("vacancies", depends_on=("catalog",))
+def get_vacancies_keyboard() -> InlineKeyboardMarkup:
+    """Клавіатура зі списком вакансій"""
+    buttons = []
+    for v in catalog.vacancies:
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"{v['emoji']} {v['name']} • {v['salary']}",
+                callback_data=f"vacancy_{v['id']}"
+            )
+        ])
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@keyboards.keyboard("back")
+def get_back_keyboard() -> InlineKeyboardMarkup:
+    """Кнопка назад"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="◀️ Назад до вакансій", callback_data="back_to_vacancies")]
+    ])
+
+
+@keyboards.keyboard("telegram")
+def get_telegram_keyboard() -> InlineKeyboardMarkup:
+    """Клавіатура для кроку Telegram з кнопкою автопідстановки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📱 Підставити мій @username", callback_data="auto_username")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_city")]
+    ])
+
+
+@keyboards.keyboard("skip_phone")
+def get_skip_phone_keyboard() -> InlineKeyboardMarkup:
+    """Кнопка пропустити телефон"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⏭ Пропустити", callback_data="skip_phone")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_telegram")]
+    ])
+
+
+@keyboards.keyboard("post_cancel")
+def get_post_cancel_keyboard() -> InlineKeyboardMarkup:
+    """Скасування створення поста"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Скасувати", callback_data="cancel_post")]
+    ])
+
+
+@keyboards.keyboard("post_confirm")
+def get_post_confirm_keyboard() -> InlineKeyboardMarkup:
+    """Підтвердження публікації поста"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Опублікувати", callback_data="publish_post"),
+            InlineKeyboardButton(text="🗑 Видалити пост", callback_data="delete_preview")
+        ],
+        [InlineKeyboardButton(text="❌ Скасувати", callback_data="cancel_post")]
+    ])
+
+
+@keyboards.keyboard("post_button", depends_on=("webapp_url",))
+def get_post_button_keyboard() -> InlineKeyboardMarkup:
+    """Кнопка під постом (URL - працює при пересиланні)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Залишити заявку", url=WEBAPP_URL)]
+    ])
+
+
+def set_webapp_url(url: str):
+    """Змінити WEBAPP_URL без рестарту (скидає клавіатури з WebApp/URL кнопками)"""
+    global WEBAPP_URL
+    WEBAPP_URL = url
+    keyboards.invalidate("webapp_url")
+
+# ════════════════════════════════════════════════════════════
+# ТЕКСТИ ФОРМИ
+# ════════════════════════════════════════════════════════════
+
+DEFAULT_LOCALE = "uk"
+
+# Тексти екранів за мовами. Друга мова = ще один словник з тими ж ключами,
+# усі екрани для неї так само будуються заздалегідь.
+FORM_STRINGS = {
+    "uk": {
+        "step_counter": "Крок {step} з {total}",
+        "steps": {
+            "name": ("👤 Як вас звати?", "<i>Введіть ваше ім'я та прізвище</i>"),
+            "age": ("🎂 Скільки вам років?", "<i>Введіть ваш вік (від 17 до {max_age} років)</i>"),
+            "city": ("🏙 З якого ви міста?", "<i>Введіть назву вашого міста</i>"),
+            "telegram": ("📱 Ваш Telegram?", "<i>Введіть username (@ додасться автоматично) або натисніть кнопку</i>"),
+            "phone": ("📞 Ваш номер телефону?", "<i>Введіть номер або пропустіть цей крок</i>"),
+        },
+        "errors": {
+            ("name", "too_short"): "❌ <b>Ім'я занадто коротке</b>\n<i>Введіть ваше повне ім'я та прізвище</i>",
+            ("name", "letters"): "❌ <b>Тільки букви</b>\n<i>Ім'я може містити тільки літери (без цифр та символів)</i>",
+            ("age", "not_number"): "❌ <b>Введіть коректний вік (число)</b>\n<i>Наприклад: 23</i>",
+            ("age", "too_young"): "❌ <b>Мінімальний вік - 17 років</b>\n<i>Введіть ваш вік (від 17 до {max_age} років)</i>",
+            ("city", "too_short"): "❌ <b>Введіть коректну назву міста</b>\n<i>Наприклад: Київ, Львів, Одеса</i>",
+            ("city", "letters"): "❌ <b>Тільки букви</b>\n<i>Назва міста може містити тільки літери (без цифр та символів)</i>",
+            ("telegram", "too_short"): "❌ <b>Введіть ваш Telegram username</b>\n<i>Наприклад: @username або username</i>",
+            ("telegram", "format"): "❌ <b>Невірний формат</b>\n<i>Username може містити тільки англійські літери, цифри та _\nНаприклад: @username або username</i>",
+            ("phone", "digits"): "❌ <b>Тільки цифри</b>\n<i>Номер може містити тільки цифри\nНаприклад: 0501234567 або +380501234567</i>",
+        },
+        "too_old": (
+            "⚠️ <b>На вакансію \"{name}\" максимальний вік - {max_age} років</b>\n\n"
+            "<b>Вакансії, які вам підходять:</b>\n{alternatives}\n\n"
+            "<i>Поверніться назад та оберіть іншу вакансію</i>"
+        ),
+        "too_old_alternative": "• {emoji} {name} (до {max_age} років)",
+        # {age} підставляється при показі - єдиний екран, що залежить від введення
+        "too_old_none": (
+            "❌ <b>На жаль, ваш вік ({age} років) перевищує максимальний для всіх наших вакансій</b>\n\n"
+            "<i>Поверніться назад</i>"
+        ),
+        "start": """
+<b>🎯 ESCOBAR JOBS</b>
+<i>Ваша кар'єра починається тут</i>
 
 ━━━━━━━━━━━━━━━━
 
-<b>Крок 3 з 5</b>
+💼 <b>Ми пропонуємо:</b>
 
-🏙 З якого ви міста?
+💰 Високі зарплати від {min_salary} грн
+📈 Швидке кар'єрне зростання  
+🏢 Сучасний офіс в центрі міста
+✅ Офіційне працевлаштування
+🎓 Навчання з першого дня
+🎁 Бонуси та преміальні до 150%
 
-❌ <b>Введіть коректну назву міста</b>
-<i>Наприклад: Київ, Львів, Одеса</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
-            parse_mode="HTML"
-        )
-        return
-    
-    # Перевірка на літери (українські, російські, латинські, пробіл, дефіс)
-    if not re.match(r'^[а-яА-ЯіІїЇєЄґҐёЁa-zA-Z\s\-]+$', city):
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+━━━━━━━━━━━━━━━━
+
+<b>🔥 Актуальні вакансії:</b>
+
+{vacancy_list}
 
 ━━━━━━━━━━━━━━━━
 
-<b>Крок 3 з 5</b>
+👇 <b>Оберіть зручний спосіб подачі заявки:</b>
+""",
+        "vacancies": """
+<b>📋 ВАКАНСІЇ</b>
 
-🏙 З якого ви міста?
+Оберіть вакансію, яка вас цікавить:
+""",
+        "vacancy_unavailable": """
+⚠️ <b>Ця вакансія вже неактуальна</b>
 
-❌ <b>Тільки букви</b>
-<i>Назва міста може містити тільки літери (без цифр та символів)</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_back_keyboard(),
+Оберіть іншу вакансію зі списку:
+""",
+        "done_sent": """
+✅ <b>Заявка успішно відправлена!</b>
+
+Дякуємо за інтерес до нашої компанії!
+
+Наш HR-відділ зв'яжеться з вами найближчим часом для обговорення деталей.
+
+━━━━━━━━━━━━━━━━
+
+Гарного дня! 🌟
+""",
+        "done_received": """
+✅ <b>Заявка отримана!</b>
+
+Дякуємо! Ми зв'яжемося з вами найближчим часом.
+
+Гарного дня! 🌟
+""",
+        "apply_again": """
+✅ <b>Заявка успішно відправлена!</b>
+
+Дякуємо за інтерес до нашої компанії!
+
+Наш HR-відділ зв'яжеться з вами найближчим часом для обговорення деталей.
+
+━━━━━━━━━━━━━━━━
+
+Гарного дня! 🌟
+
+━━━━━━━━━━━━━━━━
+
+💼 <b>Цікавлять інші вакансії?</b>
+Заповнюй ще раз 👇
+""",
+    },
+}
+
+def min_salary_text() -> str:
+    """Найменша зарплата з каталогу для привітання"""
+    amounts = []
+    for v in catalog.vacancies:
+        match = re.search(r"\d[\d\s]*\d|\d", v["salary"])
+        if match:
+            amounts.append(int(re.sub(r"\s", "", match.group())))
+    if not amounts:
+        return ""
+    return f"{min(amounts):,}".replace(",", " ")
+
+
+class FormTemplates:
+    """
+    Готові тексти всіх екранів форми: (мова, вакансія, крок, помилка) -> рядок.
+    Будуються при старті та при оновленні каталогу - хендлер робить лише dict lookup.
+    """
+
+    def __init__(self, strings: Dict[str, Dict]):
+        self.strings = strings
+        self._forms: Dict[tuple, str] = {}
+        self._screens: Dict[tuple, str] = {}
+        self._ages: List[int] = []
+
+    @property
+    def locales(self):
+        return self.strings.keys()
+
+    def rebuild(self):
+        forms, screens = {}, {}
+        vacancies = catalog.vacancies
+        # Пороги max_age: індекс bisect визначає список альтернатив для "завеликого" віку
+        ages = sorted({v["max_age"] for v in vacancies})
+
+        for locale, strings in self.strings.items():
+            screens[locale, "start"] = strings["start"].format(
+                min_salary=min_salary_text(),
+                vacancy_list="\n".join(f"• {v['name']}" for v in vacancies)
+            )
+            for name in ("vacancies", "vacancy_unavailable", "done_sent", "done_received", "apply_again"):
+                screens[locale, name] = strings[name]
+
+            for vacancy in vacancies:
+                for number, step in enumerate(FORM_STEPS, 1):
+                    question, hint = strings["steps"][step]
+                    head = self._head(strings, vacancy, step, number)
+                    forms[locale, vacancy["id"], step, None] = (
+                        f"{head}{question}\n\n{hint.format(**vacancy)}\n"
+                    )
+                    for (error_step, kind), error in strings["errors"].items():
+                        if error_step == step:
+                            forms[locale, vacancy["id"], step, kind] = (
+                                f"{head}{question}\n\n{error.format(**vacancy)}\n"
+                            )
+
+                head = self._head(strings, vacancy, "age", FORM_STEPS.index("age") + 1)
+                for index in range(len(ages) + 1):
+                    if index == len(ages):
+                        body = strings["too_old_none"]
+                    else:
+                        alternatives = "\n".join(
+                            strings["too_old_alternative"].format(**v)
+                            for v in catalog.suitable_for_age(ages[index])
+                        )
+                        body = strings["too_old"].format(alternatives=alternatives, **vacancy)
+                    forms[locale, vacancy["id"], "age", ("too_old", index)] = f"{head}{body}\n"
+
+        # Атомарна підміна - хендлери ніколи не бачать напівготовий каталог
+        self._forms, self._screens, self._ages = forms, screens, ages
+
+    @staticmethod
+    def _head(strings: Dict, vacancy: Dict, step: str, number: int) -> str:
+        salary = f"💰 {vacancy['salary']}\n" if step == "name" else ""
+        counter = strings["step_counter"].format(step=number, total=len(FORM_STEPS))
+        return (
+            f"\n<b>{vacancy['emoji']} {vacancy['name']}</b>\n{salary}"
+            f"\n━━━━━━━━━━━━━━━━\n\n<b>{counter}</b>\n\n"
+        )
+
+    def form(self, vacancy_id: int, step: str, error: Optional[str] = None, locale: str = DEFAULT_LOCALE) -> str:
+        """Екран кроку форми (з помилкою або без)"""
+        return self._forms[locale, vacancy_id, step, error]
+
+    def too_old(self, vacancy_id: int, age: int, locale: str = DEFAULT_LOCALE) -> str:
+        """Екран "вік більший за максимальний" з вакансіями, що підходять"""
+        # Перший поріг max_age, не менший за вік, визначає список альтернатив
+        index = bisect.bisect_left(self._ages, age)
+        text = self._forms[locale, vacancy_id, "age", ("too_old", index)]
+        if index == len(self._ages):
+            return text.replace("{age}", str(age))
+        return text
+
+    def screen(self, name: str, locale: str = DEFAULT_LOCALE) -> str:
+        """Загальні екрани: start, vacancies, vacancy_unavailable, done_sent, done_received, apply_again"""
+        return self._screens[locale, name]
+
+
+def user_locale(user) -> str:
+    """Мова користувача, якщо для неї є тексти, інакше мова за замовчуванням"""
+    code = getattr(user, "language_code", None)
+    return code if code in FORM_STRINGS else DEFAULT_LOCALE
+
+
+form_texts = FormTemplates(FORM_STRINGS)
+
+# ════════════════════════════════════════════════════════════
+# ФОРМА ЗАЯВКИ
+# ════════════════════════════════════════════════════════════
+
+# Регулярки компілюються один раз при імпорті
+LETTERS_RE = re.compile(r'^[а-яА-ЯіІїЇєЄґҐёЁa-zA-Z\s\-]+$')
+USERNAME_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9_]*$')
+PHONE_RE = re.compile(r'^[\d\+\-\s\(\)]+$')
+
+
+def min_length(n: int) -> Callable[[Any, Dict], bool]:
+    return lambda value, vacancy: len(value) >= n
+
+
+def matches(pattern: "re.Pattern") -> Callable[[Any, Dict], bool]:
+    return lambda value, vacancy: pattern.match(value) is not None
+
+
+def normalize_username(text: str) -> str:
+    """Автоматично додаємо @ і прибираємо подвійні собачки"""
+    if not text.startswith('@'):
+        text = '@' + text
+    return text.replace('@@', '@')
+
+
+class FormStep:
+    """
+    Крок форми: стан FSM, поле заявки, розбір введення, перевірки та навігація.
+    Перевірки - пари (код помилки, предикат(значення, вакансія)); текст помилки
+    береться з FORM_STRINGS за кодом, або з screens, якщо екран особливий.
+    """
+
+    __slots__ = ("name", "state", "field", "parse", "parse_error", "checks", "screens", "keyboard", "back")
+
+    def __init__(self, name: str, state: State, field: Optional[str] = None,
+                 parse: Optional[Callable[[str], Any]] = None, parse_error: Optional[str] = None,
+                 checks: tuple = (), screens: Optional[Dict[str, Callable]] = None,
+                 keyboard: Callable[[], InlineKeyboardMarkup] = get_back_keyboard, back: Optional[str] = None):
+        self.name = name
+        self.state = state
+        self.field = field
+        self.parse = parse
+        self.parse_error = parse_error
+        self.checks = checks
+        self.screens = screens or {}
+        self.keyboard = keyboard
+        self.back = back
+
+    def validate(self, text: str, vacancy: Dict):
+        """(значення, код помилки або None)"""
+        value = text
+        if self.parse:
+            try:
+                value = self.parse(text)
+            except ValueError:
+                return text, self.parse_error
+        for error, check in self.checks:
+            if not check(value, vacancy):
+                return value, error
+        return value, None
+
+
+FORM_SCHEMA = (
+    FormStep(
+        "name", ApplicationForm.name, field="name",
+        checks=(("too_short", min_length(2)), ("letters", matches(LETTERS_RE))),
+    ),
+    FormStep(
+        "age", ApplicationForm.age, field="age",
+        parse=int, parse_error="not_number",
+        checks=(
+            ("too_young", lambda age, vacancy: age >= 17),
+            ("too_old", lambda age, vacancy: age <= vacancy["max_age"]),
+        ),
+        screens={"too_old": form_texts.too_old},
+    ),
+    FormStep(
+        "city", ApplicationForm.city, field="city",
+        checks=(("too_short", min_length(2)), ("letters", matches(LETTERS_RE))),
+    ),
+    FormStep(
+        "telegram", ApplicationForm.telegram, field="telegram",
+        parse=normalize_username,
+        # @ + мінімум 2 символи; username - англійські літери, цифри, _
+        checks=(("too_short", min_length(3)), ("format", lambda value, vacancy: USERNAME_RE.match(value[1:]) is not None)),
+        keyboard=get_telegram_keyboard, back="city",
+    ),
+    FormStep(
+        # Останній крок: значення не зберігається в сесії, а йде у finalize_application
+        "phone", ApplicationForm.phone,
+        checks=(("digits", lambda value, vacancy: not value or PHONE_RE.match(value) is not None),),
+        keyboard=get_skip_phone_keyboard, back="telegram",
+    ),
+)
+
+FORM_STEPS = tuple(step.name for step in FORM_SCHEMA)
+
+
+class FormEngine:
+    """
+    Веде ApplicationForm за схемою: стан -> крок одним dict lookup,
+    наступний крок і кнопки "Назад" виводяться з порядку кроків.
+    """
+
+    def __init__(self, steps: tuple):
+        self.steps = steps
+        self.by_name = {step.name: step for step in steps}
+        self.by_state = {step.state.state: step for step in steps}
+        self.next = {step.name: following for step, following in zip(steps, steps[1:])}
+        # callback_data "back_to_<крок>" -> крок, на який повертаємось
+        self.back = {f"back_to_{step.back}": self.by_name[step.back] for step in steps if step.back}
+
+    @property
+    def states(self) -> List[State]:
+        return [step.state for step in self.steps]
+
+    @property
+    def first(self) -> FormStep:
+        return self.steps[0]
+
+    def step_for(self, raw_state: Optional[str]) -> Optional[FormStep]:
+        return self.by_state.get(raw_state)
+
+    def render(self, session: ApplicationSession, step: FormStep, error: Optional[str] = None,
+               value: Any = None, locale: str = DEFAULT_LOCALE) -> str:
+        screen = step.screens.get(error)
+        if screen:
+            return screen(session.vacancy_id, value, locale)
+        return form_texts.form(session.vacancy_id, step.name, error, locale)
+
+    async def show(self, chat_id: int, session: ApplicationSession, step: FormStep,
+                   error: Optional[str] = None, value: Any = None, locale: str = DEFAULT_LOCALE):
+        """Оновити повідомлення форми екраном кроку (правки одного повідомлення - по черзі)"""
+        await outbound.ordered((chat_id, session.message_id), bot.edit_message_text(
+            self.render(session, step, error, value, locale),
+            chat_id=chat_id,
+            message_id=session.message_id,
+            reply_markup=step.keyboard(),
             parse_mode="HTML"
+        ))
+
+    async def accept(self, chat_id: int, state: FSMContext, session: ApplicationSession,
+                     step: FormStep, value: Any, locale: str = DEFAULT_LOCALE):
+        """Зберегти значення кроку і показати наступний"""
+        setattr(session, step.field, value)
+        await save_session(state, session)
+        following = self.next[step.name]
+        await state.set_state(following.state)
+        track_funnel(chat_id, session.vacancy_id, following.name, FUNNEL_ENTER)
+        await self.show(chat_id, session, following, locale=locale)
+
+
+form_engine = FormEngine(FORM_SCHEMA)
+
+
+def on_catalog_reload():
+    """Перебудова всього, що похідне від каталогу вакансій"""
+    form_texts.rebuild()
+    keyboards.invalidate("catalog")
+
+
+on_catalog_reload()
+catalog.on_reload(on_catalog_reload)
+
+# ════════════════════════════════════════════════════════════
+# ВОРОНКА ФОРМИ
+# ════════════════════════════════════════════════════════════
+
+# Події воронки (молодші 4 біти байта події; старші 4 - код помилки кроку)
+FUNNEL_ENTER = 1
+FUNNEL_ERROR = 2
+FUNNEL_BACK = 3
+FUNNEL_COMPLETE = 4
+
+
+def step_errors(step: FormStep) -> List[str]:
+    """Коди помилок кроку в порядку схеми - індекс+1 пишеться в подію"""
+    codes = [step.parse_error] if step.parse_error else []
+    return codes + [error for error, _ in step.checks]
+
+
+FUNNEL_ERRORS = {step.name: step_errors(step) for step in FORM_SCHEMA}
+
+
+class FunnelLog:
+    """
+    Append-only журнал подій форми у memory-mapped файлі.
+    Запис фіксованої ширини (16 байт): час, чат, вакансія, крок, подія.
+    Додавання - struct.pack_into у mmap, без системних викликів.
+    """
+
+    MAGIC = b"ESCF"
+    HEADER = struct.Struct("<4sIQ")
+    RECORD = struct.Struct("<IqHBB")
+    # Файл росте сегментами по 65536 подій (1 МБ)
+    SEGMENT = 65536
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._capacity = 0
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+
+    def open(self):
+        if not self.path or self._mm is not None:
+            return
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) >= self.HEADER.size
+        self._file = open(self.path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(self.HEADER.size + self.SEGMENT * self.RECORD.size)
+        self._map()
+        magic, version, count = self.HEADER.unpack_from(self._mm, 0)
+        if not exists:
+            self.HEADER.pack_into(self._mm, 0, self.MAGIC, 1, 0)
+        elif magic != self.MAGIC:
+            raise ValueError(f"{self.path}: не журнал воронки")
+        self.count = count if exists else 0
+
+    def _map(self):
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), size)
+        self._capacity = (size - self.HEADER.size) // self.RECORD.size
+
+    def _grow(self):
+        self._mm.close()
+        self._file.truncate(self.HEADER.size + (self._capacity + self.SEGMENT) * self.RECORD.size)
+        self._map()
+
+    def append(self, chat_id: int, vacancy_id: int, step: int, event: int, detail: int = 0):
+        if self._mm is None:
+            return
+        if self.count >= self._capacity:
+            self._grow()
+        self.RECORD.pack_into(
+            self._mm, self.HEADER.size + self.count * self.RECORD.size,
+            int(time.time()), chat_id, vacancy_id, step, event | detail << 4
         )
-        return
-    
-    # Зберігаємо місто
-    await state.update_data(city=city)
-    await state.set_state(ApplicationForm.telegram)
-    
-    # Оновлюємо повідомлення
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+        self.count += 1
+        # Лічильник у заголовку - після запису самої події
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, 1, self.count)
+
+    def read(self, start: int, stop: int):
+        """Події [start, stop) як кортежі (час, чат, вакансія, крок, подія, код помилки)"""
+        offset = self.HEADER.size
+        chunk = self._mm[offset + start * self.RECORD.size:offset + stop * self.RECORD.size]
+        for ts, chat_id, vacancy_id, step, code in self.RECORD.iter_unpack(chunk):
+            yield ts, chat_id, vacancy_id, step, code & 0x0F, code >> 4
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+
+class FunnelAggregator:
+    """
+    Фоновий агрегатор журналу: інкрементно (лише нові події) рахує по вакансіях,
+    скільки сесій дійшло до кожного кроку, помилки валідації та повернення назад.
+    Після рестарту агрегати відновлюються з журналу.
+    """
+
+    # Скільки подій обробляти за раз, не віддаючи керування event loop
+    CHUNK = 50000
+
+    def __init__(self, log: FunnelLog, interval: float, session_ttl: float):
+        self.log = log
+        self.interval = interval
+        self.session_ttl = session_ttl
+        self.position = 0
+        # vacancy_id -> сесій, що дійшли до кроку i (останній елемент - завершили)
+        self.reached: Dict[int, List[int]] = {}
+        self.errors: Dict[tuple, int] = {}
+        self.backs: Dict[tuple, int] = {}
+        # chat_id -> [vacancy_id, найдальший крок, час останньої події] для незавершених сесій
+        self._progress: Dict[int, list] = {}
+        self._pruned = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def _reached(self, vacancy_id: int) -> List[int]:
+        counts = self.reached.get(vacancy_id)
+        if counts is None:
+            counts = self.reached[vacancy_id] = [0] * (len(FORM_STEPS) + 1)
+        return counts
+
+    def apply(self, ts: int, chat_id: int, vacancy_id: int, step: int, event: int, detail: int):
+        progress = self._progress.get(chat_id)
+        if event == FUNNEL_ENTER:
+            # Новий вибір вакансії (крок 0) - нова сесія
+            if step == 0 or progress is None or progress[0] != vacancy_id:
+                progress = self._progress[chat_id] = [vacancy_id, -1, ts]
+            if step > progress[1]:
+                progress[1] = step
+                self._reached(vacancy_id)[step] += 1
+            progress[2] = ts
+        elif event == FUNNEL_ERROR:
+            key = (vacancy_id, step, detail)
+            self.errors[key] = self.errors.get(key, 0) + 1
+            if progress:
+                progress[2] = ts
+        elif event == FUNNEL_BACK:
+            key = (vacancy_id, step)
+            self.backs[key] = self.backs.get(key, 0) + 1
+            if progress:
+                progress[2] = ts
+        elif event == FUNNEL_COMPLETE:
+            # Сесії, початої до журналу, у воронці немає - не рахуємо і завершення
+            progress = self._progress.pop(chat_id, None)
+            if progress is None or progress[0] != vacancy_id:
+                return
+            # Кроки, пропущені кнопкою (напр. "Пропустити"), теж вважаються пройденими
+            counts = self._reached(vacancy_id)
+            for i in range(progress[1] + 1, len(FORM_STEPS) + 1):
+                counts[i] += 1
+
+    async def aggregate(self):
+        """Дочитати нові події журналу"""
+        while self.position < self.log.count:
+            stop = min(self.log.count, self.position + self.CHUNK)
+            for event in self.log.read(self.position, stop):
+                self.apply(*event)
+            self.position = stop
+            await asyncio.sleep(0)
+        self._prune()
+
+    def _prune(self):
+        """Сесії без подій довше за TTL форми більше не продовжаться - забуваємо"""
+        now = time.time()
+        if now - self._pruned < 600:
+            return
+        self._pruned = now
+        deadline = now - self.session_ttl
+        for chat_id in [c for c, p in self._progress.items() if p[2] < deadline]:
+            del self._progress[chat_id]
+
+    async def start(self):
+        if self._task is None and self.log.path:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.aggregate()
+            except Exception as e:
+                logging.error(f"❌ Воронка: помилка агрегації: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def rows(self, vacancy_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Воронка по кроках (для однієї вакансії або сумарно)"""
+        vacancy_ids = [vacancy_id] if vacancy_id is not None else list(self.reached)
+        totals = [0] * (len(FORM_STEPS) + 1)
+        for vid in vacancy_ids:
+            for i, count in enumerate(self.reached.get(vid, ())):
+                totals[i] += count
+
+        rows = []
+        for i, step in enumerate(FORM_STEPS):
+            errors = {}
+            for (vid, s, detail), count in self.errors.items():
+                if s == i and vid in vacancy_ids:
+                    codes = FUNNEL_ERRORS[step]
+                    code = codes[detail - 1] if 0 < detail <= len(codes) else str(detail)
+                    errors[code] = errors.get(code, 0) + count
+            backs = sum(count for (vid, s), count in self.backs.items() if s == i and vid in vacancy_ids)
+            rows.append({
+                "step": step,
+                "reached": totals[i],
+                "dropped": totals[i] - totals[i + 1],
+                "errors": errors,
+                "backs": backs,
+            })
+        return rows
+
+    def completed(self, vacancy_id: Optional[int] = None) -> int:
+        if vacancy_id is not None:
+            return self.reached.get(vacancy_id, [0] * (len(FORM_STEPS) + 1))[-1]
+        return sum(counts[-1] for counts in self.reached.values())
+
+    def render(self) -> str:
+        rows = self.rows()
+        started = rows[0]["reached"] if rows else 0
+        lines = []
+        for number, row in enumerate(rows, 1):
+            share = row["reached"] / started * 100 if started else 0
+            drop = row["dropped"] / row["reached"] * 100 if row["reached"] else 0
+            errors = ", ".join(f"{code} {count}" for code, count in sorted(row["errors"].items(), key=lambda e: -e[1]))
+            lines.append(
+                f"{number}. <b>{row['step']}</b>: {row['reached']} ({share:.0f}%) • "
+                f"відпало {row['dropped']} ({drop:.0f}%)"
+                + (f"\n    ❌ {errors}" if errors else "")
+                + (f"\n    ◀️ назад {row['backs']}" if row["backs"] else "")
+            )
+        completed = self.completed()
+        conversion = completed / started * 100 if started else 0
+
+        vacancies = []
+        for vid, counts in sorted(self.reached.items(), key=lambda item: -item[1][0])[:5]:
+            vacancy = catalog.get(vid)
+            name = vacancy["name"] if vacancy else f"#{vid}"
+            rate = counts[-1] / counts[0] * 100 if counts[0] else 0
+            vacancies.append(f"• {name}: {counts[0]} → {counts[-1]} ({rate:.0f}%)")
+
+        steps = "\n".join(lines) or "—"
+        by_vacancy = "\n".join(vacancies) or "—"
+        return f"""
+<b>📉 ВОРОНКА ФОРМИ</b>
 
 ━━━━━━━━━━━━━━━━
 
-<b>Крок 4 з 5</b>
+Почали: <b>{started}</b>
+Завершили: <b>{completed}</b> ({conversion:.0f}%)
+
+{steps}
 
-📱 Ваш Telegram?
+<b>За вакансіями:</b>
+{by_vacancy}
 
-<i>Введіть username (@ додасться автоматично) або натисніть кнопку</i>
+<i>Подій у журналі: {self.position}</i>
 """
+
+    def export_csv(self) -> str:
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["vacancy_id", "vacancy", "step", "reached", "dropped", "backs", "errors"])
+        for vid in sorted(self.reached):
+            vacancy = catalog.get(vid)
+            for row in self.rows(vid):
+                errors = ";".join(f"{code}:{count}" for code, count in row["errors"].items())
+                writer.writerow([vid, vacancy["name"] if vacancy else "", row["step"],
+                                 row["reached"], row["dropped"], row["backs"], errors])
+            writer.writerow([vid, vacancy["name"] if vacancy else "", "completed",
+                             self.completed(vid), "", "", ""])
+        return out.getvalue()
+
+
+def track_funnel(chat_id: int, vacancy_id: int, step: str, event: int, error: Optional[str] = None):
+    """Записати подію форми (мікросекунди - можна з хендлера)"""
+    detail = FUNNEL_ERRORS[step].index(error) + 1 if error else 0
+    step_index = FORM_STEPS.index(step) if step in FORM_STEPS else len(FORM_STEPS)
+    funnel_log.append(chat_id, vacancy_id, step_index, event, detail)
+
+
+funnel_log = FunnelLog(FUNNEL_LOG)
+funnel = FunnelAggregator(funnel_log, interval=FUNNEL_AGGREGATE_INTERVAL, session_ttl=FSM_SESSION_TTL or 24 * 3600)
+
+# ════════════════════════════════════════════════════════════
+# ОБРОБНИКИ КОМАНД
+# ════════════════════════════════════════════════════════════
+
+@router.message(CommandStart())
+async def cmd_start(message: Message, state: FSMContext):
+    """Обробник команди /start"""
+    await state.clear()
+    # Користувач вже почав заново - пропозиція "Заповнюй ще раз" не потрібна
+    deferred.cancel(("apply_again", message.chat.id))
+    # Кожен, хто натискав /start, отримує нові вакансії з розсилки
+    await subscribers.add(message.chat.id)
     
-    await bot.edit_message_text(
-        text,
-        chat_id=message.chat.id,
-        message_id=message_id,
-        reply_markup=get_telegram_keyboard(),
+    await message.answer(
+        form_texts.screen("start"),
+        reply_markup=get_main_keyboard(),
         parse_mode="HTML"
     )
 
 # ════════════════════════════════════════════════════════════
-# ЗАПОВНЕННЯ ФОРМИ - TELEGRAM
+# ВИБІР ВАКАНСІЇ В БОТІ
 # ════════════════════════════════════════════════════════════
 
-@router.message(ApplicationForm.telegram)
-async def process_telegram(message: Message, state: FSMContext):
-    """Обробка Telegram"""
-    telegram = message.text.strip()
-    
-    # Видаляємо повідомлення користувача
-    await message.delete()
+@router.callback_query(F.data == "select_vacancy")
+async def select_vacancy_in_bot(callback: CallbackQuery, state: FSMContext):
+    """Показати список вакансій"""
+    await state.clear()
     
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
+    await outbound.gather(
+        callback.message.edit_text(
+            form_texts.screen("vacancies"),
+            reply_markup=get_vacancies_keyboard(),
+            parse_mode="HTML"
+        ),
+        callback.answer()
+    )
+
+# ════════════════════════════════════════════════════════════
+# ОБРОБНИКИ CALLBACK
+# ════════════════════════════════════════════════════════════
+
+@router.callback_query(F.data.startswith("vacancy_"))
+async def vacancy_selected(callback: CallbackQuery, state: FSMContext):
+    """Вибрана вакансія"""
+    vacancy_id = int(callback.data.split("_")[1])
+    vacancy = get_vacancy_by_id(vacancy_id)
     
-    # Автоматично додаємо @ якщо немає
-    if not telegram.startswith('@'):
-        telegram = '@' + telegram
+    if not vacancy:
+        await callback.answer("❌ Вакансію не знайдено")
+        return
     
-    # Видаляємо подвійні собачки
-    telegram = telegram.replace('@@', '@')
+    # Зберігаємо лише id вакансії - саму вакансію беремо з каталогу
+    session = ApplicationSession(vacancy_id, callback.message.message_id)
+    step = form_engine.first
+    await save_session(state, session)
+    await state.set_state(step.state)
+    track_funnel(callback.message.chat.id, vacancy_id, step.name, FUNNEL_ENTER)
     
-    if len(telegram) < 3:  # @ + мінімум 2 символи
-        # Помилка валідації
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
-
-━━━━━━━━━━━━━━━━
-
-<b>Крок 4 з 5</b>
+    await outbound.gather(
+        callback.message.edit_text(
+            form_engine.render(session, step, locale=user_locale(callback.from_user)),
+            reply_markup=step.keyboard(),
+            parse_mode="HTML"
+        ),
+        callback.answer()
+    )
 
-📱 Ваш Telegram?
 
-❌ <b>Введіть ваш Telegram username</b>
-<i>Наприклад: @username або username</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_telegram_keyboard(),
-            parse_mode="HTML"
-        )
-        return
+@router.callback_query(F.data == "back_to_vacancies")
+async def back_to_vacancies(callback: CallbackQuery, state: FSMContext):
+    """Повернення до списку вакансій"""
+    await state.clear()
     
-    # Перевірка на формат Telegram username (англійські літери, цифри, _)
-    username = telegram[1:]  # без @
-    if not re.match(r'^[a-zA-Z][a-zA-Z0-9_]*$', username):
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
+    await outbound.gather(
+        callback.message.edit_text(
+            form_texts.screen("vacancies"),
+            reply_markup=get_vacancies_keyboard(),
+            parse_mode="HTML"
+        ),
+        callback.answer()
+    )
 
-━━━━━━━━━━━━━━━━
 
-<b>Крок 4 з 5</b>
+@router.callback_query(F.data == "back_to_start")
+async def back_to_start(callback: CallbackQuery, state: FSMContext):
+    """Повернення на старт"""
+    await state.clear()
+    await outbound.fire(callback.message.delete())
+    await outbound.gather(cmd_start(callback.message, state), callback.answer())
 
-📱 Ваш Telegram?
 
-❌ <b>Невірний формат</b>
-<i>Username може містити тільки англійські літери, цифри та _
-Наприклад: @username або username</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_telegram_keyboard(),
-            parse_mode="HTML"
-        )
+@router.callback_query(F.data.in_(set(form_engine.back)))
+async def back_to_form_step(callback: CallbackQuery, state: FSMContext):
+    """Повернення до попереднього кроку форми (back_to_city, back_to_telegram, ...)"""
+    step = form_engine.back[callback.data]
+    session = await load_session(state)
+    
+    if session is None or session.vacancy is None:
+        await outbound.gather(vacancy_unavailable(callback.message.chat.id, state, session), callback.answer())
         return
     
-    # Зберігаємо telegram
-    await state.update_data(telegram=telegram)
-    await state.set_state(ApplicationForm.phone)
+    await state.set_state(step.state)
+    track_funnel(callback.message.chat.id, session.vacancy_id, step.name, FUNNEL_BACK)
     
-    # Оновлюємо повідомлення
-    text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
-
-━━━━━━━━━━━━━━━━
-
-<b>Крок 5 з 5</b>
+    await outbound.gather(
+        callback.message.edit_text(
+            form_engine.render(session, step, locale=user_locale(callback.from_user)),
+            reply_markup=step.keyboard(),
+            parse_mode="HTML"
+        ),
+        callback.answer()
+    )
 
-📞 Ваш номер телефону?
 
-<i>Введіть номер або пропустіть цей крок</i>
-"""
+@router.callback_query(F.data == "auto_username")
+async def auto_username(callback: CallbackQuery, state: FSMContext):
+    """Автоматична підстановка username"""
+    username = callback.from_user.username
     
-    await bot.edit_message_text(
-        text,
-        chat_id=message.chat.id,
-        message_id=message_id,
-        reply_markup=get_skip_phone_keyboard(),
-        parse_mode="HTML"
+    if not username:
+        await callback.answer("❌ У вас немає @username в Telegram", show_alert=True)
+        return
+    
+    session = await load_session(state)
+    
+    if session is None or session.vacancy is None:
+        await outbound.gather(vacancy_unavailable(callback.message.chat.id, state, session), callback.answer())
+        return
+    
+    # Зберігаємо username і переходимо до наступного кроку
+    await outbound.gather(
+        form_engine.accept(
+            callback.message.chat.id, state, session, form_engine.by_name["telegram"],
+            f"@{username}", user_locale(callback.from_user)
+        ),
+        callback.answer()
     )
 
 # ════════════════════════════════════════════════════════════
-# ЗАПОВНЕННЯ ФОРМИ - ТЕЛЕФОН
+# ЗАПОВНЕННЯ ФОРМИ
 # ════════════════════════════════════════════════════════════
 
-@router.message(ApplicationForm.phone)
-async def process_phone(message: Message, state: FSMContext):
-    """Обробка телефону"""
-    phone = message.text.strip()
-    await message.delete()
+@router.message(StateFilter(*form_engine.states))
+async def process_form_step(message: Message, state: FSMContext, raw_state: Optional[str]):
+    """Обробка відповіді на будь-який крок форми (крок визначається за станом)"""
+    step = form_engine.step_for(raw_state)
+    text = (message.text or "").strip()
     
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
+    # Видаляємо повідомлення користувача у фоні - відповідь не чекає на цей запит
+    await outbound.fire(message.delete())
     
-    # Видаляємо всі символи крім цифр для перевірки
-    phone_digits = re.sub(r'[^\d]', '', phone)
+    session = await load_session(state)
+    vacancy = session.vacancy if session else None
+    if vacancy is None:
+        await vacancy_unavailable(message.chat.id, state, session)
+        return
     
-    # Якщо ввели щось крім цифр та +
-    if phone and not re.match(r'^[\d\+\-\s\(\)]+$', phone):
-        text = f"""
-<b>{vacancy['emoji']} {vacancy['name']}</b>
-
-━━━━━━━━━━━━━━━━
-
-<b>Крок 5 з 5</b>
-
-📞 Ваш номер телефону?
-
-❌ <b>Тільки цифри</b>
-<i>Номер може містити тільки цифри
-Наприклад: 0501234567 або +380501234567</i>
-"""
-        await bot.edit_message_text(
-            text,
-            chat_id=message.chat.id,
-            message_id=message_id,
-            reply_markup=get_skip_phone_keyboard(),
-            parse_mode="HTML"
-        )
+    locale = user_locale(message.from_user)
+    value, error = step.validate(text, vacancy)
+    if error:
+        track_funnel(message.chat.id, session.vacancy_id, step.name, FUNNEL_ERROR, error)
+        await form_engine.show(message.chat.id, session, step, error, value, locale)
+        return
+    
+    # Останній крок - заявка готова
+    if step.name not in form_engine.next:
+        await finalize_application(message, state, value)
         return
     
-    await finalize_application(message, state, phone)
+    await form_engine.accept(message.chat.id, state, session, step, value, locale)
 
 
 @router.callback_query(F.data == "skip_phone")
 async def skip_phone(callback: CallbackQuery, state: FSMContext):
     """Пропустити телефон"""
-    await callback.answer()
-    await finalize_application(callback.message, state, "")
+    await outbound.gather(callback.answer(), finalize_application(callback.message, state, ""))
 
 # ════════════════════════════════════════════════════════════
 # ФІНАЛІЗАЦІЯ ЗАЯВКИ
@@ -919,89 +4540,54 @@ async def skip_phone(callback: CallbackQuery, state: FSMContext):
 
 async def finalize_application(message: Message, state: FSMContext, phone: str):
     """Фінальна обробка заявки"""
-    data = await state.get_data()
-    vacancy = data['vacancy']
-    message_id = data['message_id']
+    session = await load_session(state)
+    if session is None:
+        # Повторне натискання після того, як заявку вже прийнято і стан очищено
+        return
+    vacancy = session.vacancy
+    if vacancy is None:
+        await vacancy_unavailable(message.chat.id, state, session)
+        return
+    message_id = session.message_id
     
     # Готуємо дані
     application_data = {
-        "name": data['name'],
-        "age": data['age'],
-        "city": data['city'],
-        "telegram": data['telegram'],
+        "name": session.name,
+        "age": session.age,
+        "city": session.city,
+        "telegram": session.telegram,
         "phone": phone,
         "vacancy": vacancy['name']
     }
     
-    # Показуємо "Обробка..."
-    await bot.edit_message_text(
-        "⏳ <b>Обробка заявки...</b>",
-        chat_id=message.chat.id,
-        message_id=message_id,
-        parse_mode="HTML"
-    )
-    
-    # Відправляємо в Google Sheets
-    sheets_success = await send_to_google_sheets(application_data)
+    # Зберігаємо локально - в Google Sheets заявка піде у фоні
+    saved = await submit_application(application_data, message.chat.id)
+    track_funnel(message.chat.id, session.vacancy_id, "done", FUNNEL_COMPLETE)
     
     # Показуємо результат
-    if sheets_success:
-        result_text = """
-✅ <b>Заявка успішно відправлена!</b>
-
-Дякуємо за інтерес до нашої компанії!
-
-Наш HR-відділ зв'яжеться з вами найближчим часом для обговорення деталей.
-
-━━━━━━━━━━━━━━━━
-
-Гарного дня! 🌟
-"""
-    else:
-        result_text = """
-✅ <b>Заявка отримана!</b>
-
-Дякуємо! Ми зв'яжемося з вами найближчим часом.
-
-Гарного дня! 🌟
-"""
-    
-    await bot.edit_message_text(
-        result_text,
-        chat_id=message.chat.id,
+    chat_id = message.chat.id
+    await outbound.ordered((chat_id, message_id), bot.edit_message_text(
+        form_texts.screen("done_sent" if saved else "done_received"),
+        chat_id=chat_id,
         message_id=message_id,
         parse_mode="HTML"
-    )
+    ))
     
     # Очищаємо стан
     await state.clear()
     
-    # Чекаємо 2 секунди і показуємо пропозицію подати ще одну заявку
-    await asyncio.sleep(2)
-    
-    new_text = """
-✅ <b>Заявка успішно відправлена!</b>
-
-Дякуємо за інтерес до нашої компанії!
-
-Наш HR-відділ зв'яжеться з вами найближчим часом для обговорення деталей.
-
-━━━━━━━━━━━━━━━━
-
-Гарного дня! 🌟
-
-━━━━━━━━━━━━━━━━
-
-💼 <b>Цікавлять інші вакансії?</b>
-Заповнюй ще раз 👇
-"""
-    
-    await bot.edit_message_text(
-        new_text,
-        chat_id=message.chat.id,
-        message_id=message_id,
-        reply_markup=get_main_keyboard(),
-        parse_mode="HTML"
+    # Через 2 секунди показуємо пропозицію подати ще одну заявку (без очікування в хендлері).
+    # Той самий ключ порядку - не обжене повільну правку з результатом
+    deferred.schedule(
+        ("apply_again", chat_id),
+        2,
+        lambda: outbound.ordered((chat_id, message_id), bot.edit_message_text(
+            form_texts.screen("apply_again"),
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=get_main_keyboard(),
+            parse_mode="HTML"
+        ))
     )
 
 # ════════════════════════════════════════════════════════════
@@ -1015,8 +4601,18 @@ async def handle_webapp_data(message: Message):
         # Парсимо дані
         data = json.loads(message.web_app_data.data)
         
-        # Відправляємо в Google Sheets
-        await send_to_google_sheets(data)
+        # WebApp міг бути відкритий до того, як вакансію прибрали з каталогу
+        if data.get("vacancy") and catalog.find(data["vacancy"]) is None:
+            logging.warning(f"📭 WebApp заявка на вакансію поза каталогом: {data['vacancy']!r}")
+            await message.answer(
+                form_texts.screen("vacancy_unavailable"),
+                reply_markup=get_vacancies_keyboard(),
+                parse_mode="HTML"
+            )
+            return
+        
+        # Зберігаємо (в Google Sheets заявка піде у фоні)
+        await submit_application(data, message.chat.id)
         
         # Підтвердження користувачу
         await message.answer(
@@ -1041,11 +4637,13 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
+@keyboards.keyboard("admin")
 def get_admin_keyboard() -> InlineKeyboardMarkup:
     """Клавіатура адмін-панелі"""
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📝 Створити пост", callback_data="create_post")],
         [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="📉 Воронка", callback_data="admin_funnel")],
         [InlineKeyboardButton(text="❌ Закрити", callback_data="close_admin")]
     ])
 
@@ -1086,12 +4684,196 @@ async def close_admin(callback: CallbackQuery):
 
 @router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: CallbackQuery):
-    """Статистика (заглушка)"""
+    """Статистика заявок (повторне натискання - оновлення)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Немає доступу")
         return
     
-    await callback.answer("📊 Статистика поки недоступна", show_alert=True)
+    try:
+        await callback.message.edit_text(
+            application_stats.render(),
+            reply_markup=get_admin_keyboard(),
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest:
+        # Нічого не змінилось з минулого натискання
+        pass
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin_funnel")
+async def admin_funnel(callback: CallbackQuery):
+    """Воронка форми: де кандидати відпадають (повторне натискання - оновлення)"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Немає доступу")
+        return
+    
+    # Дочитуємо свіжі події, не чекаючи фонового проходу
+    await funnel.aggregate()
+    try:
+        await callback.message.edit_text(
+            funnel.render(),
+            reply_markup=get_admin_keyboard(),
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest:
+        pass
+    await callback.answer()
+
+
+@router.message(F.text == "/funnel_export")
+async def admin_funnel_export(message: Message):
+    """Вивантаження воронки в CSV (по вакансіях і кроках)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас немає доступу до адмін-панелі")
+        return
+    
+    await funnel.aggregate()
+    document = BufferedInputFile(
+        funnel.export_csv().encode("utf-8-sig"),
+        filename=f"funnel_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    )
+    await message.answer_document(document, caption="📉 Воронка форми")
+
+
+@router.message(F.text.startswith("/sessions"))
+async def admin_sessions(message: Message):
+    """
+    FSM сесії: /sessions - стан, /sessions ttl <стан|default> <сек>, /sessions max <кількість>
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас немає доступу до адмін-панелі")
+        return
+    
+    args = message.text.split()[1:]
+    try:
+        if len(args) == 3 and args[0] == "ttl":
+            storage.set_ttl(None if args[1] == "default" else args[1], int(args[2]))
+        elif len(args) == 2 and args[0] == "max":
+            storage.set_max_sessions(int(args[1]))
+        elif args:
+            raise ValueError(args)
+    except ValueError:
+        await message.answer(
+            "❌ Формат: <code>/sessions ttl ApplicationForm 3600</code> "
+            "або <code>/sessions max 50000</code>",
+            parse_mode="HTML"
+        )
+        return
+    
+    ages = "\n".join(f"• {label}: {count}" for label, count in storage.age_histogram())
+    ttls = "\n".join(f"• {name}: {ttl} с" for name, ttl in storage.ttls.items())
+    text = f"""
+<b>🗂 FSM СЕСІЇ</b>
+
+━━━━━━━━━━━━━━━━
+
+Активних: <b>{storage.live_sessions}</b>
+Прострочено: {storage.stats['expired']}
+Витіснено (ліміт): {storage.stats['lru_evicted']}
+
+<b>Вік сесій:</b>
+{ages}
+
+<b>TTL:</b>
+• default: {storage.default_ttl} с
+{ttls}
+Ліміт сесій: {storage.max_sessions or "немає"}
+
+<b>Черга чатів:</b>
+Чатів в роботі: {chat_guard.active_chats}
+Чекали черги: {chat_guard.stats['waited']}
+Подвійних натискань: {chat_guard.stats['dropped']}
+Витіснено новішим callback: {chat_guard.stats['coalesced']}
+Відкинуто (переповнена черга): {chat_guard.stats['rejected']}
+"""
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(F.text == "/outbound")
+async def admin_outbound(message: Message):
+    """Ліміти Telegram: черга вихідних запитів та час очікування"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас немає доступу до адмін-панелі")
+        return
+    
+    snapshot = flood_control.snapshot()
+    waits = "\n".join(
+        f"• {name}: {w['count']} запитів, в середньому {w['avg_ms']:.0f} мс, макс. {w['max_ms']:.0f} мс"
+        for name, w in snapshot["waits"].items()
+    )
+    text = f"""
+<b>🚦 ВИХІДНІ ЗАПИТИ</b>
+
+━━━━━━━━━━━━━━━━
+
+У черзі зараз: <b>{snapshot['queue_depth']}</b> (макс. {snapshot['max_queue']})
+Запитів: {snapshot['requests']}, з очікуванням: {snapshot['delayed']}
+RetryAfter від Telegram: {snapshot['retry_after']}
+Чатів з лімітом: {snapshot['chats']}
+
+<b>Очікування:</b>
+{waits}
+
+Фонові виклики: {outbound.pending}, помилок: {outbound.stats['failed']}
+"""
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(F.text == "/broadcast")
+async def admin_broadcast(message: Message):
+    """Прогрес поточної розсилки"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас немає доступу до адмін-панелі")
+        return
+    
+    total = await subscribers.count()
+    await message.answer(f"{broadcaster.render()}\nПідписників: {total}", parse_mode="HTML")
+
+
+@router.message(F.text.startswith("/profile"))
+async def admin_profile(message: Message):
+    """
+    Профайлер: /profile - звіт і folded-стеки файлом, /profile save - траси на диск, /profile reset
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас немає доступу до адмін-панелі")
+        return
+    
+    args = message.text.split()[1:]
+    if args == ["reset"]:
+        profiler.reset()
+        await message.answer("🔬 Буфер трас очищено")
+        return
+    if args == ["save"]:
+        paths = await asyncio.to_thread(profiler.dump)
+        await message.answer(f"🔬 Збережено трас: {len(paths)} у <code>{profiler.out_dir}</code>", parse_mode="HTML")
+        return
+    
+    await message.answer(profiler.render(), parse_mode="HTML")
+    folded = profiler.folded()
+    if folded:
+        document = BufferedInputFile(
+            folded.encode("utf-8"),
+            filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M')}.folded"
+        )
+        await message.answer_document(document, caption="🔥 flamegraph.pl / speedscope")
+
+
+@router.message(F.text.startswith("/webapp_url"))
+async def admin_webapp_url(message: Message):
+    """Змінити адресу WebApp без рестарту: /webapp_url https://..."""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас немає доступу до адмін-панелі")
+        return
+    
+    args = message.text.split()[1:]
+    if len(args) != 1 or not args[0].startswith("https://"):
+        await message.answer(f"Поточний WebApp: {WEBAPP_URL}\n\nФормат: /webapp_url https://...")
+        return
+    
+    set_webapp_url(args[0])
+    await message.answer(f"✅ WebApp змінено: {WEBAPP_URL}")
 
 
 # ════════════════════════════════════════════════════════════
@@ -1122,11 +4904,7 @@ async def create_post_start(callback: CallbackQuery, state: FSMContext):
 <i>Відправте фото...</i>
 """
     
-    cancel_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Скасувати", callback_data="cancel_post")]
-    ])
-    
-    await callback.message.edit_text(text, reply_markup=cancel_kb, parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=get_post_cancel_keyboard(), parse_mode="HTML")
     await callback.answer()
 
 
@@ -1207,10 +4985,6 @@ async def post_photo_received(message: Message, state: FSMContext):
 <i>Відправте текст...</i>
 """
     
-    cancel_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Скасувати", callback_data="cancel_post")]
-    ])
-    
     # Пробуємо відредагувати, якщо не вийде - створюємо нове
     try:
         if admin_message_id:
@@ -1218,14 +4992,14 @@ async def post_photo_received(message: Message, state: FSMContext):
                 text,
                 chat_id=message.chat.id,
                 message_id=admin_message_id,
-                reply_markup=cancel_kb,
+                reply_markup=get_post_cancel_keyboard(),
                 parse_mode="HTML"
             )
         else:
             raise ValueError("No admin_message_id")
     except:
         # Якщо не вдалось відредагувати - створюємо нове
-        new_msg = await message.answer(text, reply_markup=cancel_kb, parse_mode="HTML")
+        new_msg = await message.answer(text, reply_markup=get_post_cancel_keyboard(), parse_mode="HTML")
         await state.update_data(admin_message_id=new_msg.message_id)
 
 
@@ -1257,17 +5031,12 @@ async def post_text_received(message: Message, state: FSMContext):
     photo = data['photo']
     admin_message_id = data.get('admin_message_id')
     
-    # Кнопка для поста (URL - працює при пересиланні)
-    post_button = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Залишити заявку", url=WEBAPP_URL)]
-    ])
-    
     # Відправляємо превью
     preview_msg = await bot.send_photo(
         chat_id=message.chat.id,
         photo=photo,
         caption=f"{text}\n\n<i>━━━━━━━━━━━━━━━━\n👇 Натисніть кнопку нижче</i>",
-        reply_markup=post_button,
+        reply_markup=get_post_button_keyboard(),
         parse_mode="HTML"
     )
     
@@ -1275,14 +5044,6 @@ async def post_text_received(message: Message, state: FSMContext):
     await state.update_data(preview_message_id=preview_msg.message_id)
     
     # Редагуємо адмін повідомлення з кнопками підтвердження
-    confirm_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Опублікувати", callback_data="publish_post"),
-            InlineKeyboardButton(text="🗑 Видалити пост", callback_data="delete_preview")
-        ],
-        [InlineKeyboardButton(text="❌ Скасувати", callback_data="cancel_post")]
-    ])
-    
     # Пробуємо відредагувати, якщо не вийде - створюємо нове
     try:
         if admin_message_id:
@@ -1290,7 +5051,7 @@ async def post_text_received(message: Message, state: FSMContext):
                 "☝️ <b>ПРЕВЬЮ ПОСТА</b>\n\nПодобається? Публікуємо?",
                 chat_id=message.chat.id,
                 message_id=admin_message_id,
-                reply_markup=confirm_kb,
+                reply_markup=get_post_confirm_keyboard(),
                 parse_mode="HTML"
             )
         else:
@@ -1299,7 +5060,7 @@ async def post_text_received(message: Message, state: FSMContext):
         # Якщо не вдалось відредагувати - створюємо нове
         new_msg = await message.answer(
             "☝️ <b>ПРЕВЬЮ ПОСТА</b>\n\nПодобається? Публікуємо?",
-            reply_markup=confirm_kb,
+            reply_markup=get_post_confirm_keyboard(),
             parse_mode="HTML"
         )
         await state.update_data(admin_message_id=new_msg.message_id)
@@ -1344,10 +5105,6 @@ async def delete_preview(callback: CallbackQuery, state: FSMContext):
 <i>Відправте текст...</i>
 """
     
-    cancel_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Скасувати", callback_data="cancel_post")]
-    ])
-    
     # Пробуємо відредагувати, якщо не вийде - створюємо нове
     try:
         if admin_message_id:
@@ -1355,7 +5112,7 @@ async def delete_preview(callback: CallbackQuery, state: FSMContext):
                 text,
                 chat_id=callback.message.chat.id,
                 message_id=admin_message_id,
-                reply_markup=cancel_kb,
+                reply_markup=get_post_cancel_keyboard(),
                 parse_mode="HTML"
             )
         else:
@@ -1365,7 +5122,7 @@ async def delete_preview(callback: CallbackQuery, state: FSMContext):
         new_msg = await bot.send_message(
             chat_id=callback.message.chat.id,
             text=text,
-            reply_markup=cancel_kb,
+            reply_markup=get_post_cancel_keyboard(),
             parse_mode="HTML"
         )
         await state.update_data(admin_message_id=new_msg.message_id)
@@ -1386,39 +5143,49 @@ async def publish_post(callback: CallbackQuery, state: FSMContext):
     preview_message_id = data.get('preview_message_id')
     admin_message_id = data.get('admin_message_id')
     
-    # Кнопка для поста (URL - працює при пересиланні)
-    post_button = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Залишити заявку", url=WEBAPP_URL)]
-    ])
-    
     caption = f"{text}\n\n<i>━━━━━━━━━━━━━━━━\n👇 Натисніть кнопку нижче щоб залишити заявку</i>"
     
-    success = False
-    
-    # Відправляємо в канал (якщо вказаний)
+    # Відправляємо в канал (якщо вказаний) - з низьким пріоритетом, форми користувачів йдуть першими
     if POST_CHANNEL_ID and POST_CHANNEL_ID != "":
         try:
-            await bot.send_photo(
-                chat_id=POST_CHANNEL_ID,
-                photo=photo,
-                caption=caption,
-                reply_markup=post_button,
-                parse_mode="HTML"
-            )
-            success = True
+            with bulk_priority():
+                await bot.send_photo(
+                    chat_id=POST_CHANNEL_ID,
+                    photo=photo,
+                    caption=caption,
+                    reply_markup=get_post_button_keyboard(),
+                    parse_mode="HTML"
+                )
             logging.info(f"✅ Пост опубліковано в {POST_CHANNEL_ID}")
         except Exception as e:
             logging.error(f"❌ Помилка публікації: {e}")
+            # Пост не вийшов - розсилку не запускаємо, чернетка лишається для повтору
+            await callback.answer("❌ Не вдалося опублікувати пост у канал, спробуйте ще раз", show_alert=True)
+            return
     else:
         # Якщо канал не вказаний, відправляємо адміну
         await bot.send_photo(
             chat_id=callback.message.chat.id,
             photo=photo,
             caption=f"✅ <b>Пост створено!</b>\n\n{caption}",
-            reply_markup=post_button,
+            reply_markup=get_post_button_keyboard(),
             parse_mode="HTML"
         )
-        success = True
+    
+    # Розсилка всім підписникам бота - у фоні, прогрес в окремому повідомленні.
+    # Адмін пост уже бачив (превью або копія вище) - йому не дублюємо
+    progress_msg = await bot.send_message(
+        chat_id=callback.message.chat.id,
+        text="📣 Розсилка поста підписникам запускається...",
+        parse_mode="HTML"
+    )
+    broadcast_id = await broadcaster.enqueue(
+        photo, caption,
+        report_chat_id=callback.message.chat.id,
+        report_message_id=progress_msg.message_id,
+        exclude_chat_id=callback.message.chat.id
+    )
+    logging.info(f"📣 Розсилку #{broadcast_id} поставлено в чергу")
     
     # Видаляємо превью
     if preview_message_id:
@@ -1474,18 +5241,144 @@ async def publish_post(callback: CallbackQuery, state: FSMContext):
 # ЗАПУСК БОТА
 # ════════════════════════════════════════════════════════════
 
-async def main():
-    """Головна функція"""
-    dp.include_router(router)
+async def on_startup():
+    """Запуск фонових сервісів"""
+    # Відкриваємо пул з'єднань до Google Sheets
+    await sheets_sink.start()
+    await sheets_batcher.start()
+    await application_outbox.start()
+    await submission_index.start()
+    await subscribers.start()
+    await broadcaster.start()
+    await application_stats.start()
+    funnel_log.open()
+    await funnel.start()
+    await metrics_endpoint.start()
+    profiler.start()
+    await update_recorder.start()
+    await deferred.start()
+    await storage.start()
+    catalog.start()
     
+    logging.info("🤖 Бот Escobar Jobs запущено!")
+
+
+async def on_shutdown():
+    """Зупинка фонових сервісів"""
+    await metrics_endpoint.close()
+    profiler.close()
+    await update_recorder.close()
+    await catalog.close()
+    await broadcaster.close()
+    await subscribers.close()
+    await application_stats.close()
+    await funnel.close()
+    funnel_log.close()
+    await deferred.close()
+    await outbound.close()
+    await flood_control.close()
+    await submission_index.close()
+    await application_outbox.close()
+    await sheets_batcher.close()
+    await sheets_sink.close()
+    logging.info(
+        f"📊 Google Sheets: запитів {sheets_sink.stats['requests']}, "
+        f"handshake {sheets_sink.stats['handshakes']}, "
+        f"повторних з'єднань {sheets_sink.stats['reused']}"
+    )
+    direct_ops, storage_ops = fsm_unit_of_work.ops_per_update()
+    logging.info(
+        f"📊 FSM: {direct_ops:.1f} звернень до сховища на апдейт без буфера, "
+        f"{storage_ops:.1f} фактично"
+    )
+
+
+def setup_dispatcher():
+    """Реєстрація роутера та хуків запуску/зупинки"""
+    # Черга чату - перед FSM, щоб стан читався вже після попереднього апдейту чату
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(update_metrics)
+    dp.update.outer_middleware(update_recorder)
+    dp.update.outer_middleware(chat_guard)
+    dp.update.outer_middleware(dp.fsm)
+    # Профайлер і метрики хендлера першими - час включає flush FSM
+    router.message.middleware(profiler)
+    router.callback_query.middleware(profiler)
+    router.message.middleware(handler_metrics)
+    router.callback_query.middleware(handler_metrics)
+    router.message.middleware(fsm_unit_of_work)
+    router.callback_query.middleware(fsm_unit_of_work)
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+
+async def run_polling():
+    """Long polling (для локальної розробки)"""
     # Видаляємо webhook
     await bot.delete_webhook(drop_pending_updates=True)
     
-    logging.info("🤖 Бот Escobar Jobs запущено!")
-    
     # Запускаємо polling
     await dp.start_polling(bot)
 
 
+async def run_webhook():
+    """Webhook з вбудованим aiohttp сервером; SIGTERM/SIGINT - м'яка зупинка"""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook: задайте WEBHOOK_SECRET (однаковий для всіх реплік)")
+    # Telegram приймає лише https - перевіряємо до старту сервера і сервісів
+    if not WEBHOOK_URL.startswith("https://") or len(WEBHOOK_URL.rstrip("/")) <= len("https://"):
+        raise RuntimeError(f"BOT_MODE=webhook: задайте WEBHOOK_URL з https:// (зараз {WEBHOOK_URL!r})")
+    
+    app = web.Application()
+    
+    handler = QueuedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        workers=WEBHOOK_WORKERS
+    )
+    # Порядок on_shutdown: спершу черга апдейтів, потім хуки диспетчера (outbox, сховище, метрики)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logging.info(f"🌐 Webhook слухає {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    # Heroku/k8s зупиняють процес SIGTERM - без обробника прийняті апдейти губляться
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    
+    try:
+        await stop.wait()
+        logging.info("🛑 Webhook: зупинка, дообробляємо прийняті апдейти")
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def main():
+    """Головна функція"""
+    setup_dispatcher()
+    
+    if BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await run_polling()
+
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Спільне оточення тестів: бот імпортується з тимчасовими файлами, без мережі
+і без фонових сервісів; Bot API - сесія, що записує виклики
+"""
+
+import asyncio
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="escobar-tests-")
+shutil.copy(os.path.join(ROOT, "vacancies.json"), os.path.join(WORKDIR, "vacancies.json"))
+
+sys.path.insert(0, ROOT)
+os.environ.update({
+    "BOT_TOKEN": "1:test",
+    "VACANCIES_FILE": os.path.join(WORKDIR, "vacancies.json"),
+    "DB_PATH": os.path.join(WORKDIR, "test.db"),
+    "FSM_STORAGE": "memory",
+    "METRICS_PORT": "0",
+    "STATS_FILE": "",
+    "FUNNEL_LOG": "",
+    "RECORD_UPDATES": "",
+    "FLOOD_GLOBAL_RATE": "0",
+    "FLOOD_CHAT_RATE": "0",
+})
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+
+import escobar_jobs_bot  # noqa: E402
+
+CHAT_ID = 1001
+FORM_MESSAGE_ID = 500
+_chat_ids = itertools.count(CHAT_ID)
+
+
+class RecordingSession(BaseSession):
+    """Bot API без мережі: кожен виклик записується, Message-методи отримують мінімальне повідомлення"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if "Message" in str(method.__returning__):
+            return Message.model_validate(
+                {"message_id": FORM_MESSAGE_ID, "date": 0,
+                 "chat": {"id": getattr(method, "chat_id", CHAT_ID), "type": "private"}},
+                context={"bot": bot}
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture(scope="session")
+def app():
+    escobar_jobs_bot.bot.session = RecordingSession()
+    # Усі виклики inline - після feed_update усе вже відправлено
+    escobar_jobs_bot.outbound.concurrent = False
+    escobar_jobs_bot.setup_dispatcher()
+    return escobar_jobs_bot
+
+
+@pytest.fixture
+def api(app):
+    app.bot.session.requests.clear()
+    return app.bot.session.requests
+
+
+@pytest.fixture
+def chat_id():
+    """Свій чат на кожен тест - debounce і FSM не переносяться між тестами"""
+    return next(_chat_ids)
+
+
+@pytest.fixture
+def catalog_file(app):
+    """Шлях до vacancies.json тесту; після тесту вихідний каталог повертається"""
+    path = app.catalog.path
+    with open(path, encoding="utf-8") as f:
+        original = f.read()
+    yield path
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(original)
+    app.catalog.reload()
+
+
+def user(chat_id: int = CHAT_ID) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "Test", "username": "tester"}
+
+
+def text(value: str, chat_id: int = CHAT_ID) -> dict:
+    return {"message": {
+        "message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "from": user(chat_id), "text": value,
+    }}
+
+
+def callback(data: str, chat_id: int = CHAT_ID) -> dict:
+    return {"callback_query": {
+        "id": "1", "chat_instance": "test", "from": user(chat_id), "data": data,
+        "message": {"message_id": FORM_MESSAGE_ID, "date": 0, "chat": {"id": chat_id, "type": "private"}},
+    }}
+
+
+def feed(app, *payloads: dict):
+    """Прогнати апдейти через Dispatcher по черзі"""
+    async def run():
+        for payload in payloads:
+            update = Update.model_validate({"update_id": 1, **payload}, context={"bot": app.bot})
+            await app.dp.feed_update(app.bot, update)
+    asyncio.run(run())
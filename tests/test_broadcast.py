@@ -0,0 +1,38 @@
+"""Розсилка поста: групи (від'ємні chat_id) теж отримують, адмін - не вдруге"""
+
+import asyncio
+
+from aiogram.methods import SendPhoto
+
+ADMIN_ID = 42
+
+
+def test_broadcast_reaches_groups_and_skips_excluded_chat(app, api, tmp_path):
+    async def run():
+        path = str(tmp_path / "broadcast.db")
+        subscribers = app.SubscriberRegistry(path)
+        engine = app.BroadcastEngine(path, subscribers, batch_size=2, progress_interval=60)
+        await subscribers.start()
+        for chat_id in (-1001234567890, 7, ADMIN_ID, 99):
+            await subscribers.add(chat_id)
+        await engine.start()
+        try:
+            await engine.enqueue("photo-id", "caption", exclude_chat_id=ADMIN_ID)
+            for _ in range(100):
+                job = await engine._run(
+                    lambda: engine._db.execute(
+                        "SELECT total, sent, finished_at FROM broadcasts WHERE exclude_chat_id = ?", (ADMIN_ID,)
+                    ).fetchone()
+                )
+                if job[2] is not None:
+                    return job
+                await asyncio.sleep(0.01)
+        finally:
+            await engine.close()
+            await subscribers.close()
+
+    total, sent, finished_at = asyncio.run(run())
+
+    assert finished_at is not None
+    assert (total, sent) == (3, 3)
+    assert sorted(m.chat_id for m in api if isinstance(m, SendPhoto)) == [-1001234567890, 7, 99]
@@ -0,0 +1,66 @@
+"""Гаряче оновлення vacancies.json, поки кандидат заповнює форму"""
+
+import asyncio
+import json
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from conftest import callback, feed, text
+
+
+def remove_vacancy(app, path: str, vacancy_id: int):
+    with open(path, encoding="utf-8") as f:
+        vacancies = json.load(f)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([v for v in vacancies if v["id"] != vacancy_id], f, ensure_ascii=False)
+    assert app.catalog.reload()
+    assert app.catalog.get(vacancy_id) is None
+
+
+def form_state(app, chat_id: int):
+    key = StorageKey(bot_id=app.bot.id, chat_id=chat_id, user_id=chat_id)
+    return asyncio.run(app.storage.get_state(key))
+
+
+def last_text(api) -> str:
+    return next(m.text for m in reversed(api) if hasattr(m, "text") and m.text)
+
+
+@pytest.mark.parametrize("finish", [
+    ["25"],
+    ["25", "Київ", "tester", "+380501234567"],
+    ["25", "Київ", "cb:auto_username", "cb:skip_phone"],
+    ["25", "Київ", "tester", "cb:back_to_telegram"],
+])
+def test_vacancy_removed_during_form(app, api, catalog_file, chat_id, finish):
+    vacancy_id = app.catalog.vacancies[0]["id"]
+    feed(app, callback(f"vacancy_{vacancy_id}", chat_id), text("Іван Петренко", chat_id))
+    assert form_state(app, chat_id) == app.ApplicationForm.age.state
+
+    # Вакансію прибирають на кроці "вік" - решта кроків іде вже без неї
+    remove_vacancy(app, catalog_file, vacancy_id)
+    total = app.application_stats.total
+    api.clear()
+    feed(app, *(
+        callback(step[3:], chat_id) if step.startswith("cb:") else text(step, chat_id) for step in finish
+    ))
+
+    assert form_state(app, chat_id) is None
+    assert last_text(api) == app.form_texts.screen("vacancy_unavailable")
+    assert app.application_stats.total == total
+
+
+def test_webapp_application_for_removed_vacancy(app, api, catalog_file, chat_id):
+    vacancy = app.catalog.vacancies[0]
+    remove_vacancy(app, catalog_file, vacancy["id"])
+    total = app.application_stats.total
+
+    feed(app, {"message": {
+        "message_id": 2, "date": 0, "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+        "web_app_data": {"data": json.dumps({"name": "Іван", "vacancy": vacancy["name"]}), "button_text": "Заявка"},
+    }})
+
+    assert last_text(api) == app.form_texts.screen("vacancy_unavailable")
+    assert app.application_stats.total == total
@@ -0,0 +1,42 @@
+"""Закешовані клавіатури спільні для всіх користувачів - правка на місці має падати"""
+
+import pytest
+from aiogram.types import InlineKeyboardButton
+from pydantic import ValidationError
+
+
+def encode(app, markup):
+    session = app.bot.session
+    return app.keyboards.serialized(
+        markup, lambda m: session.prepare_value(m.model_dump(warnings=False), bot=app.bot, files={})
+    )
+
+
+def test_cached_markup_rejects_mutation(app):
+    markup = app.get_vacancies_keyboard()
+    before = encode(app, markup)
+    extra = InlineKeyboardButton(text="extra", callback_data="extra")
+
+    with pytest.raises(TypeError):
+        markup.inline_keyboard.append([extra])
+    with pytest.raises(TypeError):
+        markup.inline_keyboard[0].append(extra)
+    with pytest.raises(TypeError):
+        markup.inline_keyboard[0][0] = extra
+    with pytest.raises(ValidationError):
+        markup.inline_keyboard = []
+    with pytest.raises(ValidationError):
+        markup.inline_keyboard[0][0].text = "змінено"
+
+    main = app.get_main_keyboard()
+    with pytest.raises(ValidationError):
+        main.inline_keyboard[0][0].web_app.url = "https://example.com"
+
+    assert app.get_vacancies_keyboard() is markup
+    assert encode(app, markup) == before
+
+
+def test_cached_markup_matches_builder(app):
+    for getter in (app.get_main_keyboard, app.get_vacancies_keyboard, app.get_telegram_keyboard):
+        built = getter.build()
+        assert getter().model_dump(mode="json") == built.model_dump(mode="json")
@@ -0,0 +1,41 @@
+"""Outbox: помилка бази не зупиняє drainer - заявка доставляється з наступної спроби"""
+
+import asyncio
+import sqlite3
+
+
+def test_drainer_survives_database_error(app, tmp_path, monkeypatch):
+    delivered = []
+
+    async def send(data):
+        delivered.append(data)
+        return True
+
+    monkeypatch.setattr(app, "send_to_google_sheets", send)
+
+    async def run():
+        outbox = app.ApplicationOutbox(str(tmp_path / "outbox.db"), drain_batch=10, retry_base=0.01, retry_max=1)
+        fetch_due = outbox._fetch_due
+        calls = []
+
+        def flaky_fetch(now):
+            calls.append(now)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return fetch_due(now)
+
+        outbox._fetch_due = flaky_fetch
+        await outbox.start()
+        try:
+            await outbox.append({"name": "Тест"})
+            for _ in range(100):
+                if delivered:
+                    break
+                await asyncio.sleep(0.01)
+            assert outbox.alive
+            assert outbox.stats["errors"] == 1
+        finally:
+            await outbox.close()
+
+    asyncio.run(run())
+    assert delivered == [{"name": "Тест"}]
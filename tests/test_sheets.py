@@ -0,0 +1,17 @@
+"""Відповідь Apps Script на пакет: підтверджено лише те, що відповідає контракту"""
+
+import pytest
+
+
+@pytest.mark.parametrize("body, expected", [
+    (b"[true, false]", [True, False]),
+    (b'{"results": [true, true]}', [True, True]),
+    (b'[{"ok": true}, {"ok": false}]', [True, False]),
+    # Старий скрипт, що не знає пакетів, - рядки не можна вважати записаними
+    (b"OK", None),
+    (b'{"status": "success"}', None),
+    (b"[true]", None),
+    (b'[{"row": 1}, true]', None),
+])
+def test_parse_batch_results(app, body, expected):
+    assert app.GoogleSheetsSink._parse_batch_results(body, 2) == expected
@@ -0,0 +1,139 @@
+"""FSM сховища: порожня сесія не лишає записів, сесії до рестарту прибираються за TTL"""
+
+import asyncio
+import sqlite3
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=2)
+
+
+def rows(storage) -> int:
+    db = storage._pool.get()
+    try:
+        return db.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+    finally:
+        storage._pool.put(db)
+
+
+def rows_in(path: str) -> int:
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+
+
+def test_sqlite_clearing_state_and_data_deletes_row(app, tmp_path):
+    async def run():
+        storage = app.SQLiteStorage(str(tmp_path / "fsm.db"), pool_size=2)
+        try:
+            # Скидання стану сесії, якої немає, не створює рядок
+            await storage.set_state(KEY, None)
+            assert rows(storage) == 0
+
+            await storage.set_state(KEY, "Form:name")
+            await storage.set_data(KEY, {"a": 1})
+            await storage.set_state(KEY, None)
+            assert rows(storage) == 1
+            assert await storage.get_data(KEY) == {"a": 1}
+
+            await storage.set_data(KEY, {})
+            assert rows(storage) == 0
+            assert await storage.get_state(KEY) is None
+        finally:
+            await storage.close()
+        assert storage._pool is None
+
+    asyncio.run(run())
+
+
+def test_redis_set_record(app):
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def run():
+        storage = app.create_storage("redis")
+        storage.redis = fakeredis.FakeAsyncRedis()
+        try:
+            await storage.set_record(KEY, "Form:name", {"a": 1})
+            assert await storage.get_state(KEY) == "Form:name"
+            assert await storage.get_data(KEY) == {"a": 1}
+
+            await storage.set_record(KEY, None, {})
+            assert await storage.get_state(KEY) is None
+            assert await storage.get_data(KEY) == {}
+            assert await storage.redis.keys("*") == []
+        finally:
+            await storage.close()
+
+    asyncio.run(run())
+
+
+def test_restore_expires_sessions_persisted_before_restart(app, tmp_path):
+    stale = StorageKey(bot_id=1, chat_id=3, user_id=3)
+
+    async def run():
+        path = str(tmp_path / "fsm.db")
+        before = app.SQLiteStorage(path)
+        await before.set_record(KEY, "Form:name", {"a": 1})
+        await before.set_record(stale, "Form:name", {"a": 2})
+        await before._run("UPDATE fsm SET updated_at = updated_at - 7200 WHERE key = ?", (before._key(stale),))
+        await before.close()
+
+        storage = app.ExpiringStorage(app.SQLiteStorage(path), default_ttl=3600)
+        try:
+            assert await storage.restore() == 1
+            assert storage.live_sessions == 1
+            assert await storage.get_state(KEY) == "Form:name"
+            assert await storage.get_state(stale) is None
+        finally:
+            await storage.close()
+
+    asyncio.run(run())
+
+
+def test_lru_drop_is_awaited_on_close(app, tmp_path):
+    async def run():
+        inner = app.SQLiteStorage(str(tmp_path / "fsm.db"))
+        storage = app.ExpiringStorage(inner, default_ttl=3600, max_sessions=1)
+        await storage.set_state(KEY, "Form:name")
+        await storage.set_state(StorageKey(bot_id=1, chat_id=3, user_id=3), "Form:name")
+        assert storage.stats["lru_evicted"] == 1
+        assert len(storage._drops) == 1
+        await storage.close()
+        assert not storage._drops
+        assert rows_in(str(tmp_path / "fsm.db")) == 1
+
+    asyncio.run(run())
+
+
+def test_sweep_keeps_session_resumed_while_earlier_drops_run(app, tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(app.time, "time", lambda: clock[0])
+    resumed = StorageKey(bot_id=1, chat_id=3, user_id=3)
+
+    async def run():
+        inner = app.SQLiteStorage(str(tmp_path / "fsm.db"))
+        storage = app.ExpiringStorage(inner, default_ttl=60, sweep_interval=10)
+        await storage.set_record(KEY, "Form:name", {"a": 1})
+        # Наступний кошик - перша сесія видаляється раніше за другу
+        clock[0] += 15
+        await storage.set_record(resumed, "Form:name", {"a": 2})
+
+        delete_stale = inner.delete_stale
+
+        async def slow_delete(key, updated_at):
+            # Поки видаляється перша сесія, користувач другої продовжує форму
+            if key == KEY:
+                await storage.set_record(resumed, "Form:age", {"a": 3})
+            return await delete_stale(key, updated_at)
+
+        inner.delete_stale = slow_delete
+        clock[0] += 120
+        try:
+            assert await storage.sweep() == 1
+            assert await storage.get_state(KEY) is None
+            assert await storage.get_state(resumed) == "Form:age"
+            assert await storage.get_data(resumed) == {"a": 3}
+        finally:
+            await storage.close()
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+"""Дедуплікація заявок: дубль, що чекав на скасовану першу відправку, відправляється сам"""
+
+import asyncio
+
+
+def test_duplicate_submits_when_first_send_is_cancelled(app):
+    async def run():
+        index = app.SubmissionIndex(":memory:", window=600, cache_size=100)
+        started = asyncio.Event()
+        sent = []
+
+        async def hanging_send(data):
+            started.set()
+            await asyncio.Event().wait()
+
+        async def send(data):
+            sent.append(data)
+            return True
+
+        data = {"telegram": "@tester", "vacancy": "Кур'єр"}
+        first = asyncio.create_task(index.submit(1, data, hanging_send))
+        await started.wait()
+        duplicate = asyncio.create_task(index.submit(1, data, send))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await duplicate is True
+        assert first.cancelled()
+        assert sent == [data]
+        assert index.stats["duplicates"] == 0
+
+    asyncio.run(run())